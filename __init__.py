@@ -43,6 +43,11 @@ def menuImport(self, context):
 
 def register():
     """Register Menu Listing."""
+    bpy.utils.register_class(importasq.ImportAsqClearCacheOps)
+    bpy.utils.register_class(importasq.ImportAsqSwapLibraryOps)
+    bpy.utils.register_class(importasq.ImportAsqLevelOfDetailOps)
+    bpy.utils.register_class(importasq.ImportAsqBrowserPanel)
+    bpy.utils.register_class(importasq.ImportAsqAddonPreferences)
     bpy.utils.register_class(importasq.ImportAsqOps)
     bpy.utils.register_class(utils.OBJECT_OT_cursor_save)
     bpy.utils.register_class(utils.OBJECT_OT_cursor_load)
@@ -55,10 +60,17 @@ def register():
     bpy.utils.register_class(utils.OBJECT_OT_show_layer)
     bpy.utils.register_class(utils.OBJECT_OT_show_all_layers)
     bpy.types.TOPBAR_MT_file_import.append(menuImport)
+    importasq.loadasq.registerHandlers()
+    importasq.registerPreviews()
 
 
 def unregister():
     """Unregister Menu Listing."""
+    bpy.utils.unregister_class(importasq.ImportAsqClearCacheOps)
+    bpy.utils.unregister_class(importasq.ImportAsqSwapLibraryOps)
+    bpy.utils.unregister_class(importasq.ImportAsqLevelOfDetailOps)
+    bpy.utils.unregister_class(importasq.ImportAsqBrowserPanel)
+    bpy.utils.unregister_class(importasq.ImportAsqAddonPreferences)
     bpy.utils.unregister_class(importasq.ImportAsqOps)
     bpy.utils.unregister_class(utils.OBJECT_OT_cursor_save)
     bpy.utils.unregister_class(utils.OBJECT_OT_cursor_load)
@@ -71,6 +83,8 @@ def unregister():
     bpy.utils.unregister_class(utils.OBJECT_OT_show_layer)
     bpy.utils.unregister_class(utils.OBJECT_OT_show_all_layers)
     bpy.types.TOPBAR_MT_file_import.remove(menuImport)
+    importasq.loadasq.unregisterHandlers()
+    importasq.unregisterPreviews()
 
 if __name__ == "__main__":
     register()
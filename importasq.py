@@ -29,13 +29,17 @@ The python module loadasq does the actual work.
 import configparser
 import os
 import bpy
+import bpy.utils.previews
 from bpy.props import (StringProperty,
                        EnumProperty,
                        BoolProperty,
-                       FloatProperty
+                       FloatProperty,
+                       IntProperty
                        )
 from bpy_extras.io_utils import ImportHelper
 from .loadasq import loadasq
+from .loadasq import importjob
+from .loadasq import previews
 
 """
 Example preferences file:
@@ -93,6 +97,222 @@ class Preferences():
             debugPrint("WARNING: Could not save preferences. {0}".format(e))
             return False
 
+def updateBuildCacheSize(self, context):
+    loadasq.Options.buildCacheSize = self.buildCacheSize
+    loadasq.pruneBuildCache()
+
+class ImportAsqAddonPreferences(bpy.types.AddonPreferences):
+    """Import ASQ - Add-on Preferences."""
+    bl_idname = __package__
+
+    buildCacheSize: IntProperty(
+        name="Import cache size (MB)",
+        description="Disk space for cached buildings, the least recently imported are removed first",
+        default=1024,
+        min=0,
+        update=updateBuildCacheSize
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.prop(self, "buildCacheSize")
+        row.operator(ImportAsqClearCacheOps.bl_idname, icon='TRASH')
+
+class ImportAsqClearCacheOps(bpy.types.Operator):
+    """Import ASQ - Clear the cache of built buildings."""
+    bl_idname       = "import_scene.importasq_clear_cache"
+    bl_description  = "Delete all buildings kept in the import cache"
+    bl_label        = "Clear Import Cache"
+
+    def execute(self, context):
+        count = loadasq.clearBuildCache()
+        scanned = previews.clearPreviews(previewDirectory())
+        self.report({'INFO'}, "Removed {0} cached buildings and {1} previews".format(count, scanned))
+        return {'FINISHED'}
+
+# Thumbnails loaded into Blender, keyed by their path in the preview cache
+previewCollection = None
+# Scanned files of the browser folder, the enum items have to stay referenced while they are shown
+browserEntries = []
+browserItems = []
+
+def previewDirectory():
+    return os.path.join(loadasq.Options.cacheDirectory, "previews")
+
+def previewIcon(path):
+    """Icon id of a cached thumbnail, 0 when there is none."""
+    if previewCollection is None or not path or not os.path.isfile(path):
+        return 0
+    if path not in previewCollection:
+        previewCollection.load(path, path, 'IMAGE')
+    return previewCollection[path].icon_id
+
+def drawAsqInfo(layout, entry):
+    """Preview and metadata of a scanned .asq file."""
+    icon = previewIcon(entry["thumbnail"])
+    if icon:
+        layout.template_icon(icon_value=icon, scale=6.0)
+    if entry["error"]:
+        layout.label(text=entry["error"], icon='ERROR')
+    for building in entry["buildings"]:
+        col = layout.column(align=True)
+        col.label(text=building["name"] or os.path.basename(entry["file"]), icon='HOME')
+        if building["designer"]:
+            col.label(text="Designer: {0}".format(building["designer"]))
+        col.label(text="{0} x {1} x {2} mm".format(building["width"], building["depth"], building["height"]))
+        col.label(text="AnkerPlan {0}, building {1}".format(building["ap2Version"], building["building"]))
+
+def updateBrowserDirectory(self, context):
+    global browserEntries, browserItems
+    directory = bpy.path.abspath(self.asqBrowserDirectory)
+    browserEntries = previews.scanFolder(directory, previewDirectory()) if os.path.isdir(directory) else []
+    browserItems = [
+        (entry["file"], (entry["buildings"][0]["name"] if entry["buildings"] else None) or os.path.basename(entry["file"]),
+         entry["file"], previewIcon(entry["thumbnail"]), i)
+        for i, entry in enumerate(browserEntries)
+    ]
+
+def browserFileItems(self, context):
+    return browserItems
+
+class ImportAsqBrowserPanel(bpy.types.Panel):
+    """Import ASQ - Browse the previews of a folder of .asq files."""
+    bl_idname       = "VIEW3D_PT_importasq_browser"
+    bl_label        = "ASQ Browser"
+    bl_space_type   = "VIEW_3D"
+    bl_region_type  = "UI"
+    bl_category     = "ASQ"
+
+    def draw(self, context):
+        layout = self.layout
+        wm = context.window_manager
+        layout.prop(wm, "asqBrowserDirectory", text="")
+        if not browserItems:
+            layout.label(text="No .asq files")
+            return
+        layout.template_icon_view(wm, "asqBrowserFile", show_labels=True, scale=6.0)
+        entry = next((e for e in browserEntries if e["file"] == wm.asqBrowserFile), None)
+        if entry is not None:
+            drawAsqInfo(layout.box(), entry)
+            layout.operator(ImportAsqOps.bl_idname, text="Import", icon='IMPORT').filepath = entry["file"]
+
+def registerPreviews():
+    global previewCollection
+    previewCollection = bpy.utils.previews.new()
+    bpy.types.WindowManager.asqBrowserDirectory = StringProperty(
+        name="Folder",
+        description="Folder with .asq files to browse",
+        subtype='DIR_PATH',
+        update=updateBrowserDirectory
+    )
+    bpy.types.WindowManager.asqBrowserFile = EnumProperty(
+        name="Building",
+        items=browserFileItems
+    )
+
+def unregisterPreviews():
+    global previewCollection
+    del bpy.types.WindowManager.asqBrowserFile
+    del bpy.types.WindowManager.asqBrowserDirectory
+    bpy.utils.previews.remove(previewCollection)
+    previewCollection = None
+
+class ImportAsqSwapLibraryOps(bpy.types.Operator):
+    """Import ASQ - Switch imported buildings to another stone or material library."""
+    bl_idname       = "object.importasq_swap_library"
+    bl_description  = "Switch the stones and materials of the selected imported buildings, or all of them when none is selected, without importing again"
+    bl_label        = "Swap ASQ Library"
+    bl_options      = {'REGISTER', 'UNDO'}
+
+    stoneLib: EnumProperty(
+        name="Stones",
+        description="Stone library to switch to",
+        default="KEEP",
+        items=(
+            ("KEEP", "Keep", "Keep the stones."),
+            ("realistic", "Realistic Stones", "Anker Stones with realistic look."),
+            ("instruction", "Instructions Stones", "Anker Stones for Instructions (without bevel and carvings)."),
+        )
+    )
+
+    materialLib: EnumProperty(
+        name="Material",
+        description="Material library to switch to",
+        default="KEEP",
+        items=(
+            ("KEEP", "Keep", "Keep the materials."),
+            ("noise", "Noise ", "Render with noisy generated texture."),
+            ("instruction", "Instruction", "Render to look like the instruction book pictures."),
+            ("realistic", "Realistic", "Render to look realistic."),
+            ("texture", "Texture ", "Render to look realistic with image texture."),
+        )
+    )
+
+    def execute(self, context):
+        stoneLib = None if self.stoneLib == "KEEP" else self.stoneLib
+        materialLib = None if self.materialLib == "KEEP" else self.materialLib
+        parents = {ob if "ankerCollection" in ob else ob.parent for ob in context.selected_objects}
+        parents = [p for p in parents if p is not None and "ankerCollection" in p]
+        parents = parents or [ob for ob in context.scene.objects if "ankerCollection" in ob]
+        if bpy.ops.object.mode_set.poll():
+            bpy.ops.object.mode_set(mode='OBJECT')
+        loadasq.profiler.reset()
+        for parent in parents:
+            building = bpy.data.collections.get(parent["ankerCollection"])
+            if building is not None:
+                loadasq.swapLibrary(building, parent, stoneLib, materialLib)
+        scene = context.scene
+        if scene.get("ankerLevelOfDetail", "FULL") != "FULL":
+            loadasq.setLevelOfDetail(scene, scene["ankerLevelOfDetail"], scene["ankerLodDistance"], scene["ankerProxyType"])
+        loadasq.profiler.finish()
+        self.report({'INFO'}, "Switched " + loadasq.profiler.summary())
+        return {'FINISHED'}
+
+class ImportAsqLevelOfDetailOps(bpy.types.Operator):
+    """Import ASQ - Show low poly proxies instead of the full stones."""
+    bl_idname       = "object.importasq_level_of_detail"
+    bl_description  = "Show low poly proxies instead of the full stones of all imported buildings, in the viewport, in renders or far from the camera"
+    bl_label        = "ASQ Level of Detail"
+    bl_options      = {'REGISTER', 'UNDO'}
+
+    level: EnumProperty(
+        name="Proxies",
+        description="Where the stones are replaced by their proxies",
+        default="VIEWPORT",
+        items=(
+            ("FULL", "Never", "Full stones everywhere."),
+            ("VIEWPORT", "Viewport", "Proxies in the viewport, full stones in renders."),
+            ("RENDER", "Render", "Full stones in the viewport, proxies in renders."),
+            ("DISTANCE", "Distance", "Proxies for the stones far from the active camera."),
+        )
+    )
+
+    distance: FloatProperty(
+        name="Distance",
+        description="Stones farther from the active camera than this are shown as proxies",
+        default=25.0,
+        min=0.0,
+        unit='LENGTH'
+    )
+
+    proxyType: EnumProperty(
+        name="Proxy",
+        description="Shape of the proxies",
+        default="box",
+        items=(
+            ("box", "Box", "Bounding box of the stone."),
+            ("hull", "Hull", "Simplified convex hull of the stone."),
+        )
+    )
+
+    def execute(self, context):
+        if bpy.ops.object.mode_set.poll():
+            bpy.ops.object.mode_set(mode='OBJECT')
+        count = loadasq.setLevelOfDetail(context.scene, self.level, self.distance, self.proxyType)
+        self.report({'INFO'}, "Switched {0} stones".format(count))
+        return {'FINISHED'}
+
 class ImportAsqOps(bpy.types.Operator, ImportHelper):
     """Import ASQ - Import Operator."""
     bl_idname       = "import_scene.importasq"
@@ -142,6 +362,17 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         )
     )
 
+    importMode: EnumProperty(
+        name="Import Mode",
+        description="How the stones of the building are created",
+        default=prefs.get("importMode", "objects"),
+        items=(
+            ("objects", "Objects", "One object per stone."),
+            ("instances", "Instances", "One object per building instancing the stones with geometry nodes (Blender 3.2+)."),
+            ("merged", "Merged", "One mesh per material, stones can not be selected individually."),
+        )
+    )
+
     addGaps: BoolProperty(
         name="Add space between each part:",
         description="Add a small space between each part",
@@ -205,9 +436,39 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
     )
 
     link: BoolProperty(
-        name="Link",
-        description="Link Objects to library",
-        default=prefs.get("link", True)
+        name="Share mesh data",
+        description="Use one mesh per stone shape for all stones instead of a copy per stone. Rotation and scale stay on the stone objects",
+        default=prefs.get("link", False)
+    )
+
+    update: BoolProperty(
+        name="Update existing building",
+        description="Only add, remove and move the stones that changed since the building was imported from a file of the same name",
+        default=prefs.get("update", False)
+    )
+
+    buildings: StringProperty(
+        name="Buildings",
+        description="Comma separated ids of the buildings to import from a file with several buildings, all when empty",
+        default=""
+    )
+
+    buildCache: BoolProperty(
+        name="Use import cache",
+        description="Append the building from the cache when the same file was imported with the same options before",
+        default=prefs.get("buildCache", True)
+    )
+
+    writeProfile: BoolProperty(
+        name="Write timing report",
+        description="Save the time spent in every import stage as .profile.json next to the .asq file",
+        default=prefs.get("writeProfile", False)
+    )
+
+    background: BoolProperty(
+        name="Import in background",
+        description="Keep Blender responsive while importing and show the progress, ESC cancels the import",
+        default=prefs.get("background", False)
     )
 
     def draw(self, context):
@@ -219,6 +480,7 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         box.prop(self, "stoneLib", expand=True)
         box.prop(self, "materialLib", expand=True)
         box.prop(self, "magnification", expand=True)
+        box.prop(self, "importMode", expand=True)
         box.prop(self, "setupCam", expand=True)
         box.prop(self, "cameraMargin", expand=True)
         box.prop(self, "angleH", expand=True)
@@ -228,8 +490,19 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         box.prop(self, "setupLighting", expand=True)
         box.prop(self, "environment", expand=False)
         box.prop(self, "clearScene")
+        box.prop(self, "update")
+        box.prop(self, "buildings")
+        box.prop(self, "buildCache")
+        box.prop(self, "writeProfile")
+        box.prop(self, "background")
         #box.prop(self, "addGaps")
-        #box.prop(self, "link")
+        box.prop(self, "link")
+
+        # Preview of the file selected in the file browser, scanned once per file version
+        if self.filepath.lower().endswith(".asq") and os.path.isfile(self.filepath):
+            box = layout.box()
+            box.label(text="Preview", icon='IMAGE_DATA')
+            drawAsqInfo(box, previews.scanAsq(self.filepath, previewDirectory()))
 
     def execute(self, context):
         """Start the import process."""
@@ -237,6 +510,7 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         ImportAsqOps.prefs.set("stoneLib",      self.stoneLib)
         ImportAsqOps.prefs.set("materialLib",   self.materialLib)
         ImportAsqOps.prefs.set("magnification", self.magnification)
+        ImportAsqOps.prefs.set("importMode",    self.importMode)
         ImportAsqOps.prefs.set("setupCam",      self.setupCam)
         ImportAsqOps.prefs.set("cameraMargin",  self.cameraMargin)
         ImportAsqOps.prefs.set("angleH",        self.angleH)
@@ -246,14 +520,19 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         ImportAsqOps.prefs.set("setupLighting", self.setupLighting)
         ImportAsqOps.prefs.set("environment",   self.environment)
         ImportAsqOps.prefs.set("clearScene",    self.clearScene)
+        ImportAsqOps.prefs.set("update",        self.update)
+        ImportAsqOps.prefs.set("buildCache",    self.buildCache)
+        ImportAsqOps.prefs.set("writeProfile",  self.writeProfile)
+        ImportAsqOps.prefs.set("background",    self.background)
         #ImportAsqOps.prefs.set("addGaps",       self.addGaps)
-        #ImportAsqOps.prefs.set("link",          self.link)
+        ImportAsqOps.prefs.set("link",          self.link)
         ImportAsqOps.prefs.save()
 
         # Set import options and import
         loadasq.Options.stoneLib                = self.stoneLib
         loadasq.Options.materialLib             = self.materialLib
         loadasq.Options.magnification           = self.magnification
+        loadasq.Options.importMode              = self.importMode
         loadasq.Options.setupCam                = self.setupCam
         loadasq.Options.cameraMargin            = self.cameraMargin
         loadasq.Options.angleH                  = self.angleH
@@ -263,7 +542,60 @@ class ImportAsqOps(bpy.types.Operator, ImportHelper):
         loadasq.Options.setupLighting           = self.setupLighting
         loadasq.Options.environment             = self.environment
         loadasq.Options.clearScene              = self.clearScene
+        loadasq.Options.update                  = self.update
+        loadasq.Options.buildCache              = self.buildCache
+        addon = context.preferences.addons.get(__package__)
+        if addon is not None:
+            loadasq.Options.buildCacheSize      = addon.preferences.buildCacheSize
         #loadasq.Options.addGaps                 = self.addGaps
-        #loadasq.Options.link                    = self.link
+        loadasq.Options.link                    = self.link
+        loadasq.Options.profileFile             = os.path.splitext(self.filepath)[0] + ".profile.json" if self.writeProfile else None
+        try:
+            loadasq.Options.buildings           = [int(b) for b in self.buildings.replace(",", " ").split()] or None
+        except ValueError:
+            self.report({'ERROR'}, "Buildings must be comma separated numbers: " + self.buildings)
+            return {'CANCELLED'}
+        if self.background:
+            return self.startJob(context)
         loadasq.loadFromFile(self, self.filepath)
+        self.report({'INFO'}, "Imported " + loadasq.profiler.summary())
         return {'FINISHED'}
+
+    def startJob(self, context):
+        """Run the import in steps from a timer, see modal()."""
+        self.job = importjob.ImportJob(self.filepath)
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.05, window=context.window)
+        wm.modal_handler_add(self)
+        wm.progress_begin(0, 100)
+        return {'RUNNING_MODAL'}
+
+    def stopJob(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def modal(self, context, event):
+        """Advance the import a bit on every timer event, ESC cancels and removes what was created."""
+        if event.type == 'ESC':
+            self.job.cancel()
+            self.stopJob(context)
+            self.report({'WARNING'}, "Import cancelled")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        try:
+            done = self.job.step(0.1)
+        except Exception as e:
+            self.job.cancel()
+            self.stopJob(context)
+            self.report({'ERROR'}, "Import failed: {0}".format(e))
+            return {'CANCELLED'}
+        if done:
+            self.stopJob(context)
+            self.report({'INFO'}, "Imported " + loadasq.profiler.summary())
+            return {'FINISHED'}
+        context.window_manager.progress_update(int(self.job.progress * 100))
+        context.workspace.status_text_set("Importing {0}: {1:.0f}%, ESC to cancel".format(self.job.name, self.job.progress * 100))
+        return {'RUNNING_MODAL'}
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ core
+
+The parts of the importer that don't need Blender: reading the .asq SQLite
+file, replacing hot stones and converting the placements to Blender
+coordinates. Only sqlite3 and numpy are used, so the module runs in any python,
+i.e. in tests, profilers, worker processes or services:
+
+    from loadasq import asqcore
+    placements = asqcore.readPlacements("building.asq")
+    placements.location[:10]
+
+A building is read as batches of AsqStone rows, converted to BlenderPlacements
+tables of numpy columns and consumed by the Blender side in loadasq.py.
+"""
+
+import pathlib
+import sqlite3
+import hashlib
+import itertools
+import collections
+import numpy
+
+BATCH_SIZE = 4096           # Placements read from the .asq file per batch
+MMAP_SIZE = 268435456       # Bytes of the .asq file sqlite may memory-map
+DIGITS = 6                  # Decimals the locations are rounded to
+
+# **************************************************************************************
+def hotStoneId(shapeId):
+    appendF = ["GKNF101", "GKNF101","GKNF102","GKNF112","GKNF113","GKNF114","GKNF115","GKNF124","GKNF126",]
+    if shapeId in appendF:
+        return "{}F".format(shapeId)
+    return shapeId
+
+# **************************************************************************************
+def hotStonesReplace(placements):
+    shapeId = numpy.array([hotStoneId(s) for s in placements.shapeId.tolist()], dtype=object)
+    return placements._replace(shapeId=shapeId)
+
+# **************************************************************************************
+def fileChecksum(file):
+    sha = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# **************************************************************************************
+# Compact row for a single placement as stored in the .asq file
+AsqStone = collections.namedtuple("AsqStone", ["shapeId","x","y","z","rw","rx","ry","rz","material","layer","placement","building"])
+
+# **************************************************************************************
+def openAsq(file, mmapSize=None):
+    # Open the .asq read-only and immutable, so sqlite can skip locking and map the pages
+    uri = "{0}?mode=ro&immutable=1".format(pathlib.Path(file).resolve().as_uri())
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute("PRAGMA mmap_size={0}".format(MMAP_SIZE if mmapSize is None else mmapSize))
+    return conn
+
+# **************************************************************************************
+def hasTable(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+# **************************************************************************************
+def buildingFilter(buildingIds):
+    # WHERE clause and parameters selecting the placements of the buildings, all buildings when None.
+    # BuildingId 0 holds loose stones lying outside of every building, they are never imported.
+    if buildingIds is None:
+        return "WHERE BuildingShapePlacement.BuildingId > 0", []
+    buildingIds = list(buildingIds)
+    return "WHERE BuildingShapePlacement.BuildingId IN ({0})".format(",".join("?" * len(buildingIds))), buildingIds
+
+# **************************************************************************************
+def loadBuildingsFromAsq(file, mmapSize=None):
+    # Returns (BuildingId, name) of every building with stones, the name is None when the file has none
+    conn = openAsq(file, mmapSize)
+    try:
+        names = {}
+        if hasTable(conn, "BuildingParameters"):
+            names = dict(conn.execute("SELECT BuildingId, Name FROM BuildingParameters").fetchall())
+        ids = [i for i, in conn.execute("SELECT DISTINCT BuildingId FROM BuildingShapePlacement WHERE BuildingId > 0 ORDER BY BuildingId")]
+    finally:
+        conn.close()
+    return [(i, names.get(i) or None) for i in ids]
+
+# **************************************************************************************
+def loadBricksFromAsq(file, batchSize=None, mmapSize=None, buildingIds=None):
+    # Yields the placements of the buildings in batches of AsqStone rows, ordered by building
+    searchSQL = """SELECT BuildingShapePlacement.ShapeId, BuildingShapePlacement.PositionX, BuildingShapePlacement.PositionY, BuildingShapePlacement.PositionZ, BuildingShapePlacement.RotationW,BuildingShapePlacement.RotationX,BuildingShapePlacement.RotationY,BuildingShapePlacement.RotationZ, Material.KeyCode, IFNULL(LayerShapePlacement.LayerId, 0), BuildingShapePlacement.BuildingShapePlacementId, BuildingShapePlacement.BuildingId
+    FROM BuildingShapePlacement
+    LEFT JOIN LayerShapePlacement on BuildingShapePlacement.BuildingShapePlacementId=LayerShapePlacement.BuildingShapePlacementId
+	LEFT JOIN Material on BuildingShapePlacement.MaterialId = Material.MaterialId
+    {0}
+    ORDER BY BuildingShapePlacement.BuildingId
+    """
+    where, parameters = buildingFilter(buildingIds)
+    batchSize = batchSize or BATCH_SIZE
+    conn = openAsq(file, mmapSize)
+    try:
+        cur = conn.execute(searchSQL.format(where), parameters)
+        while True:
+            rows = cur.fetchmany(batchSize)
+            if not rows:
+                break
+            yield [AsqStone._make(row) for row in rows]
+    finally:
+        conn.close()
+
+# **************************************************************************************
+def loadRequirementsFromAsq(file, mmapSize=None, buildingIds=None):
+    # Returns the shape ids and material key codes used by the buildings
+    searchSQL = """SELECT DISTINCT BuildingShapePlacement.ShapeId, Material.KeyCode
+    FROM BuildingShapePlacement
+    LEFT JOIN Material on BuildingShapePlacement.MaterialId = Material.MaterialId
+    {0}
+    """
+    where, parameters = buildingFilter(buildingIds)
+    conn = openAsq(file, mmapSize)
+    try:
+        rows = conn.execute(searchSQL.format(where), parameters).fetchall()
+    finally:
+        conn.close()
+    return {shapeId for shapeId, _ in rows}, {keyCode for _, keyCode in rows}
+
+# **************************************************************************************
+# Metadata of a building as kept in BuildingParameters, the dimensions in mm
+AsqInfo = collections.namedtuple("AsqInfo", ["building","name","nameDE","nameEN","designer","draftsman","ap2Version",
+    "dataFormat","kaliber","width","height","depth","created","modified"])
+
+# **************************************************************************************
+def loadInfoFromAsq(file, mmapSize=None):
+    # Metadata of every building of the file, only BuildingParameters is read
+    searchSQL = """SELECT BuildingId, Name, NameDE, NameEN, Designer, Draftsman, Ap2Version, DataFormat, Kaliber,
+    Width, Height, Depth, Creationdate, Modificationdate
+    FROM BuildingParameters ORDER BY BuildingId
+    """
+    conn = openAsq(file, mmapSize)
+    try:
+        rows = conn.execute(searchSQL).fetchall() if hasTable(conn, "BuildingParameters") else []
+    finally:
+        conn.close()
+    return [AsqInfo._make(row) for row in rows]
+
+# **************************************************************************************
+def loadPreviewFromAsq(file, size=None, mmapSize=None, buildingId=None):
+    # (format, data) of the smallest preview at least size pixels wide, or of the largest one,
+    # None when the file has no preview. Only the blob of the chosen image is read.
+    conn = openAsq(file, mmapSize)
+    try:
+        if not hasTable(conn, "PreviewImages"):
+            return None
+        where, parameters = ("WHERE BuildingId=?", [buildingId]) if buildingId is not None else ("", [])
+        images = conn.execute("SELECT ImageId, ResolutionX FROM PreviewImages {0} ORDER BY ResolutionX".format(where), parameters).fetchall()
+        if not images:
+            return None
+        imageId = next((i for i, width in images if size is None or width >= size), images[-1][0])
+        return conn.execute("SELECT DataFormat, imageData FROM PreviewImages WHERE ImageId=?", (imageId,)).fetchone()
+    finally:
+        conn.close()
+
+# **************************************************************************************
+def loadShapeCountsFromAsq(file, mmapSize=None):
+    # (BuildingId, ShapeId, material key code, count) of every shape and material a building uses
+    searchSQL = """SELECT BuildingShapePlacement.BuildingId, BuildingShapePlacement.ShapeId, Material.KeyCode, COUNT(*)
+    FROM BuildingShapePlacement
+    LEFT JOIN Material on BuildingShapePlacement.MaterialId = Material.MaterialId
+    {0}
+    GROUP BY BuildingShapePlacement.BuildingId, BuildingShapePlacement.ShapeId, Material.KeyCode
+    """
+    where, parameters = buildingFilter(None)
+    conn = openAsq(file, mmapSize)
+    try:
+        return conn.execute(searchSQL.format(where), parameters).fetchall()
+    finally:
+        conn.close()
+
+# **************************************************************************************
+def loadStoneSetsFromAsq(file, mmapSize=None):
+    # The stone set of every building as {BuildingId: StoneSetId}, and the stone set inventories carried
+    # by the file as (StoneSetId, ShapeId, material key code, number) and (StoneSetId, child StoneSetId, number)
+    conn = openAsq(file, mmapSize)
+    try:
+        buildingSets, shapes, sets = {}, [], []
+        if hasTable(conn, "BuildingsStoneSet"):
+            buildingSets = dict(conn.execute("SELECT BuildingId, StoneSetId FROM BuildingsStoneSet").fetchall())
+        if hasTable(conn, "StoneSetShapeInventory"):
+            shapes = conn.execute("""SELECT StoneSetShapeInventory.StoneSetId, StoneSetShapeInventory.ShapeId, Material.KeyCode, StoneSetShapeInventory.Number
+            FROM StoneSetShapeInventory
+            LEFT JOIN Material on StoneSetShapeInventory.MaterialId = Material.MaterialId""").fetchall()
+        if hasTable(conn, "StoneSetSetInventory"):
+            sets = conn.execute("SELECT StoneSetId, ChildStoneSetId, Number FROM StoneSetSetInventory").fetchall()
+    finally:
+        conn.close()
+    return buildingSets, shapes, sets
+
+# **************************************************************************************
+# Compact row for a single placement in blender coordinates
+BlenderStone = collections.namedtuple("BlenderStone", ["shapeId","x","y","z","rx","ry","rz","material","layer","placement","building"])
+
+# Columns of a batch of placements in blender coordinates, one row per placement:
+#   shapeId   (n,)       object  shape id as in the file
+#   location  (n, 3)     float64 meters, z up
+#   rotation  (n, 3)     float64 XYZ euler angles in radians
+#   matrix    (n, 3, 3)  float64 rotation matrices
+#   material  (n,)       object  material key code
+#   layer     (n,)       int64   layer id, 0 for stones without layer
+#   placement (n,)       int64   BuildingShapePlacementId
+#   building  (n,)       int64   BuildingId
+BlenderPlacements = collections.namedtuple("BlenderPlacements", ["shapeId","location","rotation","matrix","material","layer","placement","building"])
+
+# Rotation of 90 degrees around X, turns the y-up asq space into z-up blender space
+ASQ_TO_BLENDER = numpy.array(((1.0, 0.0, 0.0), (0.0, 0.0, -1.0), (0.0, 1.0, 0.0)))
+
+# **************************************************************************************
+def quaternionsToMatrices(quaternions):
+    # Converts an (n, 4) array of w, x, y, z quaternions to (n, 3, 3) rotation matrices
+    q = quaternions / numpy.linalg.norm(quaternions, axis=1)[:, None]
+    w, x, y, z = q.T
+    matrices = numpy.empty((len(q), 3, 3))
+    matrices[:, 0, 0] = 1 - 2*(y*y + z*z)
+    matrices[:, 0, 1] = 2*(x*y - w*z)
+    matrices[:, 0, 2] = 2*(x*z + w*y)
+    matrices[:, 1, 0] = 2*(x*y + w*z)
+    matrices[:, 1, 1] = 1 - 2*(x*x + z*z)
+    matrices[:, 1, 2] = 2*(y*z - w*x)
+    matrices[:, 2, 0] = 2*(x*z - w*y)
+    matrices[:, 2, 1] = 2*(y*z + w*x)
+    matrices[:, 2, 2] = 1 - 2*(x*x + y*y)
+    return matrices
+
+# **************************************************************************************
+def matricesToEulers(matrices):
+    # Converts (n, 3, 3) rotation matrices to XYZ eulers, choosing the same solution as mathutils
+    m = matrices
+    cy = numpy.hypot(m[:, 0, 0], m[:, 1, 0])
+    euler1 = numpy.stack((
+        numpy.arctan2(m[:, 2, 1], m[:, 2, 2]),
+        numpy.arctan2(-m[:, 2, 0], cy),
+        numpy.arctan2(m[:, 1, 0], m[:, 0, 0])), axis=1)
+    euler2 = numpy.stack((
+        numpy.arctan2(-m[:, 2, 1], -m[:, 2, 2]),
+        numpy.arctan2(-m[:, 2, 0], -cy),
+        numpy.arctan2(-m[:, 1, 0], -m[:, 0, 0])), axis=1)
+    gimbal = cy <= 16 * numpy.finfo(numpy.float32).eps
+    euler1[gimbal, 0] = numpy.arctan2(-m[gimbal, 1, 2], m[gimbal, 1, 1])
+    euler1[gimbal, 2] = 0.0
+    euler2[gimbal] = euler1[gimbal]
+    useSecond = numpy.abs(euler1).sum(axis=1) > numpy.abs(euler2).sum(axis=1)
+    return numpy.where(useSecond[:, None], euler2, euler1)
+
+# **************************************************************************************
+def asqToBlenderArrays(asqStones, digits=None):
+    # Converts a batch of stones from asq to blender coordinates in one vectorized pass
+    columns = numpy.array([stone[1:8] for stone in asqStones], dtype=float).reshape(-1, 7)
+    location = numpy.round(columns[:, (0, 2, 1)] / numpy.array((1000.0, -1000.0, 1000.0)), DIGITS if digits is None else digits)
+    matrix = ASQ_TO_BLENDER @ quaternionsToMatrices(columns[:, 3:7])
+    return BlenderPlacements(
+        shapeId = numpy.array([stone.shapeId for stone in asqStones], dtype=object),
+        location = location,
+        rotation = matricesToEulers(matrix),
+        matrix = matrix,
+        material = numpy.array([stone.material for stone in asqStones], dtype=object),
+        layer = numpy.array([stone.layer for stone in asqStones], dtype=numpy.int64),
+        placement = numpy.array([stone.placement for stone in asqStones], dtype=numpy.int64),
+        building = numpy.array([stone.building for stone in asqStones], dtype=numpy.int64)
+    )
+
+# **************************************************************************************
+def asqToBlender(asqBatches, digits=None):
+    # Converts batches of stones from asq to batches of placements in blender coordinates
+    return (asqToBlenderArrays(batch, digits) for batch in asqBatches)
+
+# **************************************************************************************
+def iterBlenderStones(placementBatches):
+    # Yields one BlenderStone row per placement of the batches
+    for p in placementBatches:
+        rows = zip(p.shapeId.tolist(), *p.location.T.tolist(), *p.rotation.T.tolist(), p.material.tolist(), p.layer.tolist(), p.placement.tolist(), p.building.tolist())
+        yield from itertools.starmap(BlenderStone, rows)
+
+# **************************************************************************************
+def collectPlacements(placementBatches):
+    # Concatenates batches of placements into a single BlenderPlacements table
+    batches = list(placementBatches)
+    if not batches:
+        return None
+    return BlenderPlacements(*(numpy.concatenate(column) for column in zip(*batches)))
+
+# **************************************************************************************
+def splitBuildings(placements):
+    # Splits a table of several buildings into one table per BuildingId
+    ids = numpy.unique(placements.building)
+    if len(ids) == 1:
+        return {int(ids[0]): placements}
+    return {int(i): BlenderPlacements(*(column[placements.building == i] for column in placements)) for i in ids}
+
+# **************************************************************************************
+def readPlacements(file, hotStones=True, batchSize=None, mmapSize=None, digits=None, buildingIds=None):
+    # The buildings as one BlenderPlacements table, None when they have no stones
+    batches = asqToBlender(loadBricksFromAsq(file, batchSize, mmapSize, buildingIds), digits)
+    if hotStones:
+        batches = map(hotStonesReplace, batches)
+    return collectPlacements(batches)
+
+# **************************************************************************************
+# Plain buffers of a mesh, as read and written by foreach_get/foreach_set
+MeshGeometry = collections.namedtuple("MeshGeometry", ["co","loopVertex","loopStart","loopTotal","smooth","uv"])
+
+# **************************************************************************************
+def instanceGeometry(geometry, matrices, locations):
+    # Copies of the geometry, each transformed by one of the (n, 3, 3) matrices and moved to its location
+    n = len(matrices)
+    vertexCount, loopCount = len(geometry.co), len(geometry.loopVertex)
+    co = numpy.einsum('nij,vj->nvi', matrices, geometry.co) + locations[:, None, :]
+    return MeshGeometry(
+        co = co.reshape(-1, 3),
+        loopVertex = (geometry.loopVertex + (numpy.arange(n, dtype=numpy.int32) * vertexCount)[:, None]).ravel(),
+        loopStart = (geometry.loopStart + (numpy.arange(n, dtype=numpy.int32) * loopCount)[:, None]).ravel(),
+        loopTotal = numpy.tile(geometry.loopTotal, n),
+        smooth = numpy.tile(geometry.smooth, n),
+        uv = numpy.tile(geometry.uv, (n, 1))
+    )
+
+# **************************************************************************************
+def joinGeometry(geometries):
+    # Joins several geometries into one, offsetting their vertex and loop indices
+    vertexOffsets = numpy.cumsum([0] + [len(g.co) for g in geometries], dtype=numpy.int32)
+    loopOffsets = numpy.cumsum([0] + [len(g.loopVertex) for g in geometries], dtype=numpy.int32)
+    return MeshGeometry(
+        co = numpy.concatenate([g.co for g in geometries]),
+        loopVertex = numpy.concatenate([g.loopVertex + o for g, o in zip(geometries, vertexOffsets)]),
+        loopStart = numpy.concatenate([g.loopStart + o for g, o in zip(geometries, loopOffsets)]),
+        loopTotal = numpy.concatenate([g.loopTotal for g in geometries]),
+        smooth = numpy.concatenate([g.smooth for g in geometries]),
+        uv = numpy.concatenate([g.uv for g in geometries])
+    )
+
+# **************************************************************************************
+# Shading MeshGeometry doesn't carry: the normal of every loop and the sharp and freestyle edges as vertex pairs
+MeshShading = collections.namedtuple("MeshShading", ["normals","sharpEdges","freestyleEdges"])
+
+# **************************************************************************************
+def instanceShading(shading, vertexCount, matrices):
+    # The shading of the copies made by instanceGeometry, normals turned by the inverse transpose of the matrices
+    n = len(matrices)
+    normals = numpy.einsum('nij,lj->nli', numpy.linalg.inv(matrices).transpose(0, 2, 1), shading.normals).reshape(-1, 3)
+    length = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    offsets = (numpy.arange(n, dtype=numpy.int64) * vertexCount)[:, None, None]
+    return MeshShading(
+        normals = normals / numpy.where(length > 0, length, 1),
+        sharpEdges = (shading.sharpEdges[None] + offsets).reshape(-1, 2),
+        freestyleEdges = (shading.freestyleEdges[None] + offsets).reshape(-1, 2)
+    )
+
+# **************************************************************************************
+def joinShading(shadings, vertexCounts):
+    # Joins the shading of the geometries joinGeometry joins, offsetting the edge vertices
+    vertexOffsets = numpy.cumsum([0] + list(vertexCounts), dtype=numpy.int64)
+    return MeshShading(
+        normals = numpy.concatenate([s.normals for s in shadings]),
+        sharpEdges = numpy.concatenate([s.sharpEdges + o for s, o in zip(shadings, vertexOffsets)]),
+        freestyleEdges = numpy.concatenate([s.freestyleEdges + o for s, o in zip(shadings, vertexOffsets)])
+    )
+
+# **************************************************************************************
+def boundsCenter(co):
+    if not len(co):
+        return numpy.zeros(3)
+    return (co.min(axis=0) + co.max(axis=0)) / 2
+
+# **************************************************************************************
+# Geometry of a shape stored in the .asq, in template space
+AsqShape = collections.namedtuple("AsqShape", ["geometry","normals","lines"])
+
+# **************************************************************************************
+def loadShapeVersionsFromAsq(file, mmapSize=None):
+    conn = openAsq(file, mmapSize)
+    try:
+        rows = conn.execute("SELECT ShapeId, MAX(ShapeVersion) FROM BuildingShapePlacement GROUP BY ShapeId").fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+# **************************************************************************************
+def loadShapeGeometryFromAsq(file, shapeIds, mmapSize=None):
+    # Reads the Part, Vertex, Triangle and Line tables in one query each and splits them per shape
+    conn = openAsq(file, mmapSize)
+    try:
+        parts = conn.execute("SELECT PartId, ShapeId FROM Part").fetchall()
+        vertices = numpy.array(conn.execute("""SELECT PartId, Index1, PositionX, PositionY, PositionZ, NormalX, NormalY, NormalZ, TexCoU, TexCoV
+            FROM Vertex ORDER BY PartId, Index1""").fetchall(), dtype=float).reshape(-1, 10)
+        triangles = numpy.array(conn.execute("SELECT PartId, Index1, Index2, Index3 FROM Triangle").fetchall(), dtype=numpy.int64).reshape(-1, 4)
+        lines = numpy.array(conn.execute("SELECT PartId, Index1, Index2 FROM Line").fetchall(), dtype=numpy.int64).reshape(-1, 3)
+    finally:
+        conn.close()
+
+    # Turn the per part vertex indices into rows of the vertex table
+    vertexKeys = (vertices[:, 0].astype(numpy.int64) << 32) | vertices[:, 1].astype(numpy.int64)
+    triangleRows = numpy.searchsorted(vertexKeys, (triangles[:, :1] << 32) | triangles[:, 1:])
+    lineRows = numpy.searchsorted(vertexKeys, (lines[:, :1] << 32) | lines[:, 1:])
+
+    shapes = {}
+    for shapeId in shapeIds:
+        partIds = [partId for partId, partShape in parts if partShape == shapeId]
+        vertexRows = numpy.flatnonzero(numpy.isin(vertices[:, 0], partIds))
+        if not len(vertexRows):
+            continue
+        local = numpy.full(len(vertices), -1, dtype=numpy.int32)
+        local[vertexRows] = numpy.arange(len(vertexRows), dtype=numpy.int32)
+        loops = local[triangleRows[numpy.isin(triangles[:, 0], partIds)]].ravel()
+        # Millimeters in asq space, the library stones are 50 times the size in meters
+        geometry = MeshGeometry(
+            co = (vertices[vertexRows, 2:5] / 20).astype(numpy.float32),
+            loopVertex = loops,
+            loopStart = numpy.arange(0, len(loops), 3, dtype=numpy.int32),
+            loopTotal = numpy.full(len(loops) // 3, 3, dtype=numpy.int32),
+            smooth = numpy.ones(len(loops) // 3, dtype=bool),
+            uv = vertices[vertexRows, 8:10][loops].astype(numpy.float32)
+        )
+        shapes[shapeId] = AsqShape(geometry, vertices[vertexRows, 5:8], local[lineRows[numpy.isin(lines[:, 0], partIds)]])
+    return shapes
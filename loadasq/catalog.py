@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ catalog
+
+Indexes an archive of .asq files into a SQLite catalog: the buildings with
+their metadata and stone set, how often they use every shape and material,
+and the stone set inventories the files carry. Files whose size and
+modification time are unchanged are skipped, touched files whose hash is
+unchanged are not read again. Queries run on the catalog alone:
+
+    conn = openCatalog("catalog.sqlite")
+    scanDirectory(conn, "archive/")
+    buildableWith(conn, ["GKKlassik 8", "GKKlassik 8"])
+    topShapes(conn, 10)
+
+Like asqcore this module doesn't need Blender.
+"""
+
+import os
+import glob
+import sqlite3
+import collections
+import concurrent.futures
+
+from . import asqcore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Files (FileId INTEGER PRIMARY KEY, Path TEXT UNIQUE, Size INTEGER, Mtime INTEGER, Sha1 TEXT);
+CREATE TABLE IF NOT EXISTS Buildings (BuildingKey INTEGER PRIMARY KEY, FileId INTEGER, BuildingId INTEGER, Name TEXT,
+    Designer TEXT, StoneSetId TEXT, Stones INTEGER, Width INTEGER, Height INTEGER, Depth INTEGER);
+CREATE TABLE IF NOT EXISTS ShapeCounts (BuildingKey INTEGER, ShapeId TEXT, KeyCode TEXT, Count INTEGER);
+CREATE TABLE IF NOT EXISTS StoneSetShapes (StoneSetId TEXT, ShapeId TEXT, KeyCode TEXT, Number INTEGER,
+    PRIMARY KEY (StoneSetId, ShapeId, KeyCode));
+CREATE TABLE IF NOT EXISTS StoneSetSets (StoneSetId TEXT, ChildStoneSetId TEXT, Number INTEGER,
+    PRIMARY KEY (StoneSetId, ChildStoneSetId));
+CREATE INDEX IF NOT EXISTS BuildingsFile ON Buildings (FileId);
+CREATE INDEX IF NOT EXISTS ShapeCountsBuilding ON ShapeCounts (BuildingKey);
+CREATE INDEX IF NOT EXISTS ShapeCountsShape ON ShapeCounts (ShapeId);
+"""
+
+# Everything read from one .asq file
+FileIndex = collections.namedtuple("FileIndex", ["path","size","mtime","sha1","infos","counts","buildingSets","setShapes","setSets","error"])
+
+# **************************************************************************************
+def openCatalog(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+# **************************************************************************************
+def readFile(path, stat, sha1=None):
+    # Reads what the catalog keeps of a file, sqlite only so it runs on worker threads
+    try:
+        sha1 = sha1 or asqcore.fileChecksum(path)
+        infos = asqcore.loadInfoFromAsq(path)
+        counts = asqcore.loadShapeCountsFromAsq(path)
+        buildingSets, setShapes, setSets = asqcore.loadStoneSetsFromAsq(path)
+        error = None
+    except (OSError, sqlite3.Error) as e:
+        infos, counts, buildingSets, setShapes, setSets, error = [], [], {}, [], [], str(e)
+    return FileIndex(path, stat.st_size, stat.st_mtime_ns, sha1, infos, counts, buildingSets, setShapes, setSets, error)
+
+# **************************************************************************************
+def removeFile(conn, fileId):
+    conn.execute("DELETE FROM ShapeCounts WHERE BuildingKey IN (SELECT BuildingKey FROM Buildings WHERE FileId=?)", (fileId,))
+    conn.execute("DELETE FROM Buildings WHERE FileId=?", (fileId,))
+    conn.execute("DELETE FROM Files WHERE FileId=?", (fileId,))
+
+# **************************************************************************************
+def writeFile(conn, index):
+    # Replaces the rows of a file with what was read from it
+    row = conn.execute("SELECT FileId FROM Files WHERE Path=?", (index.path,)).fetchone()
+    if row is not None:
+        removeFile(conn, row[0])
+    fileId = conn.execute("INSERT INTO Files (Path, Size, Mtime, Sha1) VALUES (?, ?, ?, ?)",
+        (index.path, index.size, index.mtime, index.sha1)).lastrowid
+    infos = {info.building: info for info in index.infos}
+    counts = collections.defaultdict(list)
+    for buildingId, shapeId, keyCode, count in index.counts:
+        counts[buildingId].append((shapeId, keyCode, count))
+    for buildingId in sorted(set(infos) | set(counts)):
+        info = infos.get(buildingId)
+        buildingKey = conn.execute("""INSERT INTO Buildings (FileId, BuildingId, Name, Designer, StoneSetId, Stones, Width, Height, Depth)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+            fileId, buildingId, info.name if info else None, info.designer if info else None, index.buildingSets.get(buildingId),
+            sum(count for _, _, count in counts[buildingId]),
+            info.width if info else None, info.height if info else None, info.depth if info else None)).lastrowid
+        conn.executemany("INSERT INTO ShapeCounts VALUES (?, ?, ?, ?)", [(buildingKey, *c) for c in counts[buildingId]])
+    # Stone sets are identified by their id, the last file read defines a set
+    conn.executemany("INSERT OR REPLACE INTO StoneSetShapes VALUES (?, ?, ?, ?)", index.setShapes)
+    conn.executemany("INSERT OR REPLACE INTO StoneSetSets VALUES (?, ?, ?)", index.setSets)
+
+# **************************************************************************************
+def scanDirectory(conn, directory, recursive=True, workers=8):
+    # Brings the catalog up to date with the .asq files of the directory, returns (read, skipped, removed)
+    directory = os.path.abspath(directory)
+    pattern = os.path.join(directory, "**", "*.asq") if recursive else os.path.join(directory, "*.asq")
+    files = {os.path.abspath(f): os.stat(f) for f in glob.glob(pattern, recursive=recursive)}
+    known = {path: (fileId, size, mtime, sha1) for fileId, path, size, mtime, sha1 in conn.execute("SELECT FileId, Path, Size, Mtime, Sha1 FROM Files")}
+
+    changed, touched = [], []
+    for path, stat in files.items():
+        entry = known.get(path)
+        if entry is None or entry[1] != stat.st_size:
+            changed.append((path, stat, None))
+        elif entry[2] != stat.st_mtime_ns:
+            touched.append((path, stat, entry))
+    # A touched file is only read again when its contents changed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = pool.map(lambda t: asqcore.fileChecksum(t[0]), touched)
+        for (path, stat, entry), sha1 in zip(touched, hashes):
+            if sha1 == entry[3]:
+                conn.execute("UPDATE Files SET Mtime=? WHERE FileId=?", (stat.st_mtime_ns, entry[0]))
+            else:
+                changed.append((path, stat, sha1))
+        with conn:
+            for index in pool.map(lambda t: readFile(*t), changed):
+                writeFile(conn, index)
+            # Without recursion the files of subfolders weren't looked at and stay in the catalog
+            if recursive:
+                scanned = lambda path: path.startswith(directory + os.sep)
+            else:
+                scanned = lambda path: os.path.dirname(path) == directory
+            removed = [entry[0] for path, entry in known.items() if scanned(path) and path not in files]
+            for fileId in removed:
+                removeFile(conn, fileId)
+    return len(changed), len(files) - len(changed), len(removed)
+
+# **************************************************************************************
+def stoneSetInventory(conn, stoneSetIds, ignoreColors=False):
+    # Stones of the given sets, a set given twice counts twice, sets made of other sets are expanded.
+    # Returns {(ShapeId, key code): number}, the key code is None with ignoreColors.
+    inventory = collections.Counter()
+    def add(stoneSetId, number, depth):
+        if depth > 16:
+            raise ValueError("Stone set {0} contains itself".format(stoneSetId))
+        for shapeId, keyCode, count in conn.execute("SELECT ShapeId, KeyCode, Number FROM StoneSetShapes WHERE StoneSetId=?", (stoneSetId,)):
+            inventory[(shapeId, None if ignoreColors else keyCode)] += count * number
+        for childId, count in conn.execute("SELECT ChildStoneSetId, Number FROM StoneSetSets WHERE StoneSetId=?", (stoneSetId,)).fetchall():
+            add(childId, count * number, depth + 1)
+    for stoneSetId in stoneSetIds:
+        add(stoneSetId, 1, 0)
+    return inventory
+
+# **************************************************************************************
+def missingStones(conn, stoneSetIds, ignoreColors=False):
+    # Stones every building needs beyond the inventory of the sets, {BuildingKey: missing stones}
+    inventory = stoneSetInventory(conn, stoneSetIds, ignoreColors)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS Inventory (ShapeId TEXT, KeyCode TEXT, Number INTEGER)")
+    conn.execute("DELETE FROM Inventory")
+    conn.executemany("INSERT INTO Inventory VALUES (?, ?, ?)", [(shapeId, keyCode, n) for (shapeId, keyCode), n in inventory.items()])
+    keyCode = "NULL" if ignoreColors else "ShapeCounts.KeyCode"
+    rows = conn.execute("""SELECT Needed.BuildingKey, SUM(MAX(Needed.Count - IFNULL(Inventory.Number, 0), 0))
+        FROM (SELECT BuildingKey, ShapeId, {0} AS KeyCode, SUM(Count) AS Count FROM ShapeCounts GROUP BY BuildingKey, ShapeId, 3) AS Needed
+        LEFT JOIN Inventory ON Inventory.ShapeId = Needed.ShapeId AND Inventory.KeyCode IS Needed.KeyCode
+        GROUP BY Needed.BuildingKey""".format(keyCode)).fetchall()
+    return dict(rows)
+
+# **************************************************************************************
+def buildableWith(conn, stoneSetIds, ignoreColors=False, tolerance=0):
+    # (path, BuildingId, name, missing stones) of the buildings the sets are enough for, with up to tolerance stones missing
+    missing = missingStones(conn, stoneSetIds, ignoreColors)
+    rows = conn.execute("""SELECT Buildings.BuildingKey, Files.Path, Buildings.BuildingId, Buildings.Name
+        FROM Buildings JOIN Files ON Files.FileId = Buildings.FileId ORDER BY Files.Path, Buildings.BuildingId""").fetchall()
+    return [(path, buildingId, name, missing.get(key, 0)) for key, path, buildingId, name in rows if missing.get(key, 0) <= tolerance]
+
+# **************************************************************************************
+def topShapes(conn, limit=20):
+    # (ShapeId, stones, buildings) of the most used shapes
+    return conn.execute("""SELECT ShapeId, SUM(Count), COUNT(DISTINCT BuildingKey) FROM ShapeCounts
+        GROUP BY ShapeId ORDER BY 2 DESC LIMIT ?""", (limit,)).fetchall()
+
+# **************************************************************************************
+def stoneSets(conn):
+    # (StoneSetId, stones in its own inventory, buildings designed for it) of every known stone set
+    return conn.execute("""SELECT Sets.StoneSetId, IFNULL((SELECT SUM(Number) FROM StoneSetShapes WHERE StoneSetShapes.StoneSetId = Sets.StoneSetId), 0),
+        (SELECT COUNT(*) FROM Buildings WHERE Buildings.StoneSetId = Sets.StoneSetId)
+        FROM (SELECT StoneSetId FROM StoneSetShapes UNION SELECT StoneSetId FROM StoneSetSets UNION SELECT StoneSetId FROM Buildings WHERE StoneSetId IS NOT NULL) AS Sets
+        ORDER BY Sets.StoneSetId""").fetchall()
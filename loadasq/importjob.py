@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ background job
+
+An import split into short steps, so a modal operator can keep Blender
+responsive, show the progress and cancel it. The placements are read and
+converted on a thread while the library is linked on the main thread, only
+asqcore runs on the thread since bpy may not be used outside the main thread.
+The stones are then created in chunks:
+
+    job = ImportJob(file)
+    while not job.step(0.1):
+        print(job.progress)
+
+cancel() removes everything the job created so far.
+"""
+
+import os
+import time
+import threading
+
+import bpy
+
+from . import asqcore
+from . import loadasq
+from .loadasq import Options, profiler
+
+CHUNK_SIZE = 500        # Stones created per step
+
+# Share of the progress taken by reading the file, the rest is creating the stones
+READ_PROGRESS = 0.2
+
+
+# **************************************************************************************
+class ImportJob:
+    """Import of one .asq file run step by step on the main thread"""
+
+    def __init__(self, file, chunkSize=CHUNK_SIZE):
+        self.file = os.path.expanduser(file)
+        self.name = os.path.splitext(os.path.basename(self.file))[0] or 'Building'
+        self.chunkSize = chunkSize
+        self.progress = 0.0
+        self.buildings = []     # Collections created so far, removed again on cancel
+        self.parents = []
+        self.placements = None
+        self.error = None
+        self.thread = None
+        self.work = self.run()
+        profiler.reset()
+
+    def read(self, buildingIds):
+        # Thread side, sqlite and numpy only
+        try:
+            self.placements = asqcore.readPlacements(self.file, True, Options.batchSize, Options.mmapSize, Options.nks, buildingIds)
+        except Exception as e:
+            self.error = e
+
+    def step(self, seconds):
+        # Works for about the given time but at least one step, returns True when the import is done
+        end = time.perf_counter() + seconds
+        while True:
+            try:
+                self.progress = next(self.work)
+            except StopIteration:
+                self.progress = 1.0
+                loadasq.finishProfile()
+                return True
+            if time.perf_counter() >= end:
+                return False
+
+    def cancel(self):
+        # Removes the buildings created so far, a running read is left to finish on its own
+        self.work.close()
+        for i, building in enumerate(self.buildings):
+            loadasq.removeBuilding(building, self.parents[i] if i < len(self.parents) else None)
+        self.buildings, self.parents = [], []
+
+    def run(self):
+        # Generator doing the import, yields the progress between 0 and 1 after every step
+        file = self.file
+        buildings = loadasq.buildingNames(file, self.name)
+        if not buildings:
+            return
+        key = None
+        if len(buildings) == 1:
+            buildingIds = None if buildings[0][0] is None else [buildings[0][0]]
+        else:
+            buildingIds = [buildingId for buildingId, _ in buildings]
+
+        # Updates only touch the changed stones and cached buildings are appended, both run at once
+        existing = [loadasq.findBuilding(name) if Options.update else (None, None) for _, name in buildings]
+        if any(loadasq.canUpdate(parent) for _, parent in existing):
+            if len(buildings) > 1:
+                self.parents = loadasq.loadBuildings(file, buildings)
+            else:
+                self.parents = [loadasq.loadBuilding(file, buildings[0][1], buildingIds)]
+            return
+        for building, parent in existing:
+            if building is not None:
+                with profiler.stage("remove"):
+                    loadasq.removeBuilding(building, parent)
+        if len(buildings) == 1:
+            with profiler.stage("cache"):
+                key = loadasq.buildCacheKey(file, buildingIds) if Options.buildCache else None
+                parent = loadasq.loadBuildCache(key, buildings[0][1]) if key else None
+            if parent is not None:
+                self.parents = [parent]
+                return
+
+        # The requirements are a quick query, the library is linked while the thread reads the placements
+        with profiler.stage("read"):
+            shapeIds, materialKeys = loadasq.loadRequirementsFromAsq(file, buildingIds)
+        self.thread = threading.Thread(target=self.read, args=(buildingIds,), daemon=True)
+        self.thread.start()
+        with profiler.stage("library"):
+            loadasq.linkRequirements(shapeIds, materialKeys, file)
+        yield READ_PROGRESS / 2
+        while self.thread.is_alive():
+            with profiler.stage("read"):
+                self.thread.join(0.01)
+            yield READ_PROGRESS / 2
+        if self.error is not None:
+            raise self.error
+        if self.placements is None:
+            return
+        placements = self.placements
+        count = len(placements.placement)
+        profiler.count("stones", count)
+        with profiler.stage("prepare scene"):
+            loadasq.prepareScene()
+        yield READ_PROGRESS
+
+        tables = asqcore.splitBuildings(placements) if len(buildings) > 1 else {buildings[0][0]: placements}
+        importMode = loadasq.buildingImportMode()
+        target = bpy.context.scene.cursor.location.copy()
+        done = 0
+        for buildingId, name in buildings:
+            table = tables.get(buildingId)
+            if table is None:
+                continue
+            building = loadasq.createBuildingCollection(name)
+            self.buildings.append(building)
+            if importMode == "objects":
+                bricks, layerCollections = [], {}
+                for start in range(0, len(table.placement), self.chunkSize):
+                    chunk = asqcore.BlenderPlacements(*(column[start:start + self.chunkSize] for column in table))
+                    with profiler.stage("objects"):
+                        bricks += loadasq.createBrickObjects(asqcore.iterBlenderStones([chunk]), building, layerCollections)
+                    done += len(chunk.placement)
+                    yield READ_PROGRESS + (1 - READ_PROGRESS) * done / count
+            else:
+                with profiler.stage("objects"):
+                    if importMode == "instances":
+                        bricks = loadasq.createBrickInstancer(name, table, building)
+                    else:
+                        bricks = loadasq.createMergedBricks(name, table, building)
+                done += len(table.placement)
+            parent = loadasq.finishBuilding(name, building, bricks, importMode, Options.center and len(buildings) == 1)
+            # An empty building is already removed again, buildings and parents stay in step for cancel
+            if parent is None:
+                self.buildings.pop()
+            else:
+                self.parents.append(parent)
+            yield READ_PROGRESS + (1 - READ_PROGRESS) * done / count
+
+        if len(self.parents) > 1 and Options.center:
+            with profiler.stage("center"):
+                loadasq.centerBuildings(self.parents, target)
+        loadasq.setupScene(self.parents)
+        if key and self.parents:
+            with profiler.stage("cache"):
+                loadasq.saveBuildCache(key, self.parents[0])
@@ -43,13 +43,28 @@ import itertools
 import operator
 from pprint import pprint
 import sqlite3
+import hashlib
+import json
+import numpy
 import bpy
 from mathutils import Matrix,Euler,Vector,Quaternion
 import bmesh
-from ..operators.utils import enclose, center_relative, setupRendering, setupHDRI, position_cam, add_cam
+from .profiler import Profiler
+from . import asqcore
+from .asqcore import (hotStoneId, hotStonesReplace, fileChecksum, AsqStone, BlenderStone, BlenderPlacements,
+    iterBlenderStones, collectPlacements, MeshGeometry, instanceGeometry, joinGeometry, MeshShading, instanceShading, joinShading,
+    boundsCenter, AsqShape,
+    loadShapeVersionsFromAsq, loadShapeGeometryFromAsq, splitBuildings)
+from ..operators.utils import enclose, center_relative, setupRendering, setupHDRI, position_cam, add_cam, get_bounds, store_bounds, transform_bounds, world_matrix, get_bottom_center
 
 global linkedTemplateBricks
-linkedTemplateBricks=[]
+linkedTemplateBricks={}
+
+global libraryStamp
+libraryStamp=(None, None)
+
+# Stage timings of the last import
+profiler = Profiler()
 
 # **************************************************************************************
 # **************************************************************************************
@@ -61,7 +76,10 @@ class Options:
     gapAmount          = 0.1            # Percent
     clearScene         = False
     center             = True
-    link               = False
+    link               = False          # Share one mesh per stone shape instead of copying it for every stone
+    update             = False          # Update a building imported before from the same file name instead of adding a new one
+    buildings          = None           # BuildingIds to import from files with several buildings, None for all
+    importMode         = "objects"      # "objects" one object per stone, "instances" one geometry nodes instancer, "merged" one mesh per material
     setupCam           = False
     angleH             = 45 
     angleV             =-15
@@ -72,9 +90,16 @@ class Options:
     cameraMargin       = 2
     magnification      = 50
     scriptDirectory    = os.path.dirname( os.path.realpath(__file__) )
+    useCache           = True           # Keep the geometry of library stones and their materials on disk between sessions
+    cacheDirectory     = os.path.join(scriptDirectory, "..", "cache")
+    buildCache         = True           # Keep built buildings as .blend files and append them on identical imports
+    buildCacheSize     = 1024           # Megabytes of built buildings kept, the least recently used are evicted first
     verbose            = 1              # 1 = Show messages while working, 0 = Only show warnings/errors
-    nks                = 6
+    nks                = asqcore.DIGITS
     applyScale         = False
+    batchSize          = asqcore.BATCH_SIZE # Placements read from the .asq file per batch
+    mmapSize           = asqcore.MMAP_SIZE  # Bytes of the .asq file sqlite may memory-map
+    profileFile        = None           # Write the stage timings of every import as JSON to this path
 
 # **************************************************************************************
 def linkToScene(ob):
@@ -82,10 +107,30 @@ def linkToScene(ob):
         bpy.context.collection.objects.link(ob)
 
 # **************************************************************************************
-def setParent(objects, parent):
+def setParent(objects, parent, inverse=None):
+    # Keeps the world transforms of the objects, unless another parent inverse is given
+    inverse = inverse if inverse is not None else world_matrix(parent).inverted()
     for o in objects:
         o.parent = parent
+        o.matrix_parent_inverse = inverse
         
+# **************************************************************************************
+def createBuildingCollection(name):
+    # Stones go into one child collection per layer, so layers can be switched as a whole
+    building = bpy.data.collections.new(name)
+    building["ankerBuilding"] = True
+    bpy.context.collection.children.link(building)
+    return building
+
+# **************************************************************************************
+def linkToLayer(ob, building, layerCollections, layer):
+    if layer not in layerCollections:
+        collection = bpy.data.collections.new("{0} Layer {1}".format(building.name, layer))
+        collection["ankerLayer"] = layer
+        building.children.link(collection)
+        layerCollections[layer] = collection
+    layerCollections[layer].objects.link(ob)
+
 # **************************************************************************************
 def internalPrint(message):
     """Debug print with identification timestamp."""
@@ -111,112 +156,297 @@ def clearScene():
     bpy.ops.object.delete(use_global=False, confirm=False)
 
 # **************************************************************************************
-def linkLibrary():
+def libraryPath():
+    return os.path.join(Options.scriptDirectory, "..", "lib", "anker_library.blend" )
+
+# **************************************************************************************
+def templateCollection():
+    # Appended template stones live in a collection outside of the scenes
+    collection = bpy.data.collections.get("AnkerTemplates")
+    if collection is None:
+        collection = bpy.data.collections.new("AnkerTemplates")
+        collection.use_fake_user = True
+    return collection
+
+# **************************************************************************************
+def templateIndex(templates):
+    # Templates by name. Stones built from the .asq also stand in for the library templates
+    # missing for them, real templates take precedence.
+    index = {alias: ob for ob in templates.objects for alias in ob.get("aliases", [])}
+    index.update({ob.get("template", ob.name): ob for ob in templates.objects})
+    return index
+
+# **************************************************************************************
+def linkLibrary(templateNames=None, materialNames=None):
+    # Appends the given templates and materials from the library. None appends everything of
+    # that kind, an empty set nothing, so a building only loads what it needs.
     global linkedTemplateBricks
-    if not bpy.data.scenes.get("library"):
-        debugPrint("Linking Stones from Library")
-        filepath = os.path.join(Options.scriptDirectory, "..", "lib", "anker_library.blend" )
-        if not os.path.isfile(filepath):
-            debugPrint("Library file not found: "+filepath)
-            return
-        with bpy.data.libraries.load(filepath) as (data_from, data_to):
-            data_to.scenes = ["library"]
-            data_to.materials = data_from.materials
-        debugPrint("Linked {0} bricks from library".format(len(bpy.data.scenes['library'].objects)))
-    else:
+    templates = templateCollection()
+    linkedTemplateBricks = templateIndex(templates)
+    missingTemplates = None if templateNames is None else {n for n in templateNames if n not in linkedTemplateBricks}
+    missingMaterials = None if materialNames is None else {n for n in materialNames if n not in bpy.data.materials}
+    if missingTemplates == set() and missingMaterials == set():
         debugPrint("Library already linked")
-    linkedTemplateBricks = bpy.data.scenes['library'].objects
+        return linkedTemplateBricks
+    filepath = libraryPath()
+    if not os.path.isfile(filepath):
+        debugPrint("Library file not found: "+filepath)
+        return linkedTemplateBricks
+
+    # Build the stones found in the geometry cache without opening the library
+    if Options.useCache and missingTemplates:
+        cached = 0
+        for templateName in sorted(missingTemplates):
+            ob = loadTemplateCache(templateName)
+            if ob is not None:
+                addTemplate(templates, templateName, ob)
+                missingTemplates.discard(templateName)
+                cached += 1
+        debugPrint("Loaded {0} bricks from cache".format(cached))
+    # Materials come from small .blend files of their own
+    if Options.useCache and missingMaterials:
+        found = loadMaterialCache(missingMaterials)
+        missingMaterials -= found
+        debugPrint("Loaded {0} materials from cache".format(len(found)))
+    if missingTemplates == set() and missingMaterials == set():
+        return linkedTemplateBricks
+
+    debugPrint("Linking Stones from Library")
+    profiler.count("library loads")
+    with bpy.data.libraries.load(filepath) as (data_from, data_to):
+        objectNames = [n for n in data_from.objects if n not in linkedTemplateBricks and (missingTemplates is None or n in missingTemplates)]
+        materials = [n for n in data_from.materials if n not in bpy.data.materials and (missingMaterials is None or n in missingMaterials)]
+        data_to.objects = objectNames
+        data_to.materials = materials
+    for templateName, ob in zip(objectNames, data_to.objects):
+        if ob is not None:
+            addTemplate(templates, templateName, ob)
+            if Options.useCache:
+                saveTemplateCache(templateName, ob)
+    if Options.useCache:
+        for materialName, mat in zip(materials, data_to.materials):
+            if mat is not None:
+                saveMaterialCache(materialName, mat)
+    debugPrint("Linked {0} bricks and {1} materials from library".format(len(objectNames), len(materials)))
     return linkedTemplateBricks
 
 # **************************************************************************************
-def hotStonesReplace(stone):
-    appendF = ["GKNF101", "GKNF101","GKNF102","GKNF112","GKNF113","GKNF114","GKNF115","GKNF124","GKNF126",]
-    if stone['shapeId'] in appendF:
-        stone['shapeId'] = "{}F".format(stone['shapeId'])
-    return stone
+def addTemplate(templates, templateName, ob):
+    global linkedTemplateBricks
+    ob["template"] = templateName
+    templates.objects.link(ob)
+    linkedTemplateBricks[templateName] = ob
 
 # **************************************************************************************
-def loadBricksFromAsq(file):
-    searchSQL = """SELECT BuildingShapePlacement.ShapeId, BuildingShapePlacement.PositionX, BuildingShapePlacement.PositionY, BuildingShapePlacement.PositionZ, BuildingShapePlacement.RotationW,BuildingShapePlacement.RotationX,BuildingShapePlacement.RotationY,BuildingShapePlacement.RotationZ, Material.KeyCode, IFNULL(LayerShapePlacement.LayerId, 0)
-    FROM BuildingShapePlacement
-    LEFT JOIN LayerShapePlacement on BuildingShapePlacement.BuildingShapePlacementId=LayerShapePlacement.BuildingShapePlacementId
-	LEFT JOIN Material on BuildingShapePlacement.MaterialId = Material.MaterialId
-    WHERE BuildingShapePlacement.BuildingId=1
-    """
-    keys = ["shapeId","x","y","z","rw","rx","ry","rz","material","layer"]
-    debugPrint("Loading file " + str(file))
-    with sqlite3.connect(file) as conn:
-        cur = conn.cursor()
-        cur.execute(searchSQL)
-        stones = cur.fetchall()
-    debugPrint("Found {0} stones in {1}".format(len(stones), file))
-    asqStones = map(lambda stone: dict(zip(keys, stone)), stones)
-    return asqStones
-
-# **************************************************************************************
-def asqToBlenderCoordinates(asqStone):
-    # Converts coordinates from asq to blender
-    if asqStone:
-        quaternion = Quaternion( (asqStone['rw'], asqStone['rx'], asqStone['ry'], asqStone['rz']) )
-        r_transform = Euler((math.radians(90),0,0))
-        quaternion.rotate(r_transform)
-        euler = quaternion.to_euler()
-        blenderStone = {
-            'shapeId': asqStone['shapeId'],
-            'x': round(asqStone['x']/1000, Options.nks), 
-            'y': round(asqStone['z']/-1000, Options.nks), 
-            'z': round(asqStone['y']/1000, Options.nks),
-            'rx': euler.x,
-            'ry': euler.y,
-            'rz': euler.z,
-            'material': asqStone['material'],
-            'layer': asqStone['layer']
-        }
-        return blenderStone
+def libraryChecksum():
+    # Hash of the library contents, only recomputed when its size or modification time changes
+    global libraryStamp
+    stat = os.stat(libraryPath())
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    if libraryStamp[0] != stamp:
+        libraryStamp = (stamp, fileChecksum(libraryPath()))
+    return libraryStamp[1]
+
+# **************************************************************************************
+def templateCachePath(templateName):
+    return os.path.join(Options.cacheDirectory, libraryChecksum()[:16], templateName + ".npz")
+
+# **************************************************************************************
+def saveTemplateCache(templateName, ob):
+    # Stones with modifiers can't be rebuilt from their mesh alone and are not cached
+    if ob.type != 'MESH' or ob.modifiers:
+        return
+    path = templateCachePath(templateName)
+    ankerdata = ob.get("ankerdata")
+    if hasattr(ankerdata, "to_dict"):
+        ankerdata = ankerdata.to_dict()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez(f, ankerdata=json.dumps(ankerdata, default=list), **readMeshGeometry(ob.data)._asdict(), **readMeshShading(ob.data))
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        debugPrint("WARNING: Could not cache stone {0}. {1}".format(templateName, e))
+
+# **************************************************************************************
+def materialCachePath(materialName):
+    return os.path.join(Options.cacheDirectory, libraryChecksum()[:16], "materials", materialName + ".blend")
+
+# **************************************************************************************
+def saveMaterialCache(materialName, mat):
+    # Every material is written with its node groups and images to a small .blend of its own
+    path = materialCachePath(materialName)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        bpy.data.libraries.write(path[:-6] + ".tmp.blend", {mat}, path_remap='ABSOLUTE')
+        os.replace(path[:-6] + ".tmp.blend", path)
+    except (OSError, RuntimeError) as e:
+        debugPrint("WARNING: Could not cache material {0}. {1}".format(materialName, e))
+
+# **************************************************************************************
+def loadMaterialCache(materialNames):
+    # Appends the cached materials, returns the names found in the cache
+    found = set()
+    for materialName in materialNames:
+        path = materialCachePath(materialName)
+        if not os.path.isfile(path):
+            continue
+        try:
+            with bpy.data.libraries.load(path) as (data_from, data_to):
+                data_to.materials = [n for n in data_from.materials if n == materialName]
+        except (OSError, RuntimeError) as e:
+            debugPrint("WARNING: Ignoring cached material {0}. {1}".format(materialName, e))
+            continue
+        if data_to.materials and data_to.materials[0] is not None:
+            found.add(materialName)
+    return found
+
+# **************************************************************************************
+# Shading of a template beyond MeshGeometry, kept in the cache so cached stones shade like appended ones
+SHADING_FIELDS = ["normals", "customNormals", "sharpEdges", "freestyleEdges", "autoSmooth", "materialIndex"]
+
+# **************************************************************************************
+def edgeKeys(mesh, edges=None):
+    # One number per edge from its sorted vertex pair, edges are recreated in another order when written
+    if edges is None:
+        edges = numpy.empty(len(mesh.edges)*2, dtype=numpy.int32)
+        mesh.edges.foreach_get("vertices", edges)
+    edges = numpy.sort(numpy.asarray(edges).reshape(-1, 2), axis=1).astype(numpy.int64)
+    return edges[:, 0] * len(mesh.vertices) + edges[:, 1]
+
+# **************************************************************************************
+def readMeshShading(mesh):
+    normals = numpy.empty(len(mesh.loops)*3, dtype=numpy.float32)
+    if hasattr(mesh, "corner_normals"):
+        mesh.corner_normals.foreach_get("vector", normals)
     else:
-        return {}
+        mesh.calc_normals_split()
+        mesh.loops.foreach_get("normal", normals)
+    edges = numpy.empty(len(mesh.edges)*2, dtype=numpy.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    edges = edges.reshape(-1, 2)
+    sharp = numpy.empty(len(mesh.edges), dtype=bool)
+    mesh.edges.foreach_get("use_edge_sharp", sharp)
+    freestyle = numpy.empty(len(mesh.edges), dtype=bool)
+    mesh.edges.foreach_get("use_freestyle_mark", freestyle)
+    materialIndex = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get("material_index", materialIndex)
+    # Auto smooth is a modifier since Blender 4.1, those meshes aren't cached
+    autoSmooth = (getattr(mesh, "use_auto_smooth", False), getattr(mesh, "auto_smooth_angle", 0.0))
+    return dict(normals=normals.reshape(-1, 3), customNormals=mesh.has_custom_normals, sharpEdges=edges[sharp],
+        freestyleEdges=edges[freestyle], autoSmooth=numpy.array(autoSmooth, dtype=numpy.float64), materialIndex=materialIndex)
 
 # **************************************************************************************
-def asqToBlender(asqStones):
-    # Converts an list of stones from asq to blender coordinates
-    blenderStones = map(asqToBlenderCoordinates, asqStones)
-    return blenderStones
+def writeMeshShading(mesh, shading):
+    keys = edgeKeys(mesh)
+    mesh.edges.foreach_set("use_edge_sharp", numpy.isin(keys, edgeKeys(mesh, shading["sharpEdges"])))
+    mesh.edges.foreach_set("use_freestyle_mark", numpy.isin(keys, edgeKeys(mesh, shading["freestyleEdges"])))
+    mesh.polygons.foreach_set("material_index", shading["materialIndex"])
+    if hasattr(mesh, "use_auto_smooth"):
+        mesh.use_auto_smooth = bool(shading["autoSmooth"][0]) or bool(shading["customNormals"])
+        mesh.auto_smooth_angle = float(shading["autoSmooth"][1])
+    if shading["customNormals"]:
+        mesh.normals_split_custom_set(shading["normals"].tolist())
+    mesh.update()
 
 # **************************************************************************************
-def assignBrickMaterial(blenderObject, keyCode, materialLib = "realistic"):
+def loadTemplateCache(templateName):
+    path = templateCachePath(templateName)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with numpy.load(path) as data:
+            geometry = MeshGeometry(*(data[field] for field in MeshGeometry._fields))
+            shading = {field: data[field] for field in SHADING_FIELDS}
+            ankerdata = json.loads(str(data["ankerdata"]))
+    except (OSError, ValueError, KeyError) as e:
+        debugPrint("WARNING: Ignoring cached stone {0}. {1}".format(templateName, e))
+        return None
+    mesh = writeMeshGeometry(templateName, geometry)
+    writeMeshShading(mesh, shading)
+    ob = bpy.data.objects.new(templateName, mesh)
+    if ankerdata is not None:
+        ob["ankerdata"] = ankerdata
+    return ob
+
+# **************************************************************************************
+def loadBricksFromAsq(file, batchSize=None, buildingIds=None):
+    # Yields the placements of the buildings in batches of AsqStone rows
+    debugPrint("Loading file " + str(file))
+    count = 0
+    for batch in asqcore.loadBricksFromAsq(file, batchSize or Options.batchSize, Options.mmapSize, buildingIds):
+        count += len(batch)
+        yield batch
+    profiler.count("stones", count)
+    debugPrint("Found {0} stones in {1}".format(count, file))
+
+# **************************************************************************************
+def loadRequirementsFromAsq(file, buildingIds=None):
+    # Returns the shape ids and material key codes used by the buildings
+    shapeIds, materialKeys = asqcore.loadRequirementsFromAsq(file, Options.mmapSize, buildingIds)
+    profiler.count("shapes", len(shapeIds))
+    profiler.count("material keys", len(materialKeys))
+    debugPrint("Building uses {0} shapes and {1} materials".format(len(shapeIds), len(materialKeys)))
+    return shapeIds, materialKeys
+
+# **************************************************************************************
+def asqToBlenderArrays(asqStones):
+    return asqcore.asqToBlenderArrays(asqStones, Options.nks)
+
+# **************************************************************************************
+def asqToBlender(asqBatches):
+    # Converts batches of stones from asq to batches of placements in blender coordinates
+    return asqcore.asqToBlender(asqBatches, Options.nks)
+
+# **************************************************************************************
+def getBrickMaterial(keyCode, materialLib = "realistic"):
     mat = bpy.data.materials.get("Anker_{0}_{1}".format(keyCode, materialLib))
     if mat is None:
         debugPrint("Material with number {0} not found in {1} library.".format(keyCode, materialLib))
-    else:
-        blenderObject.data.materials.append(None)
-        blenderObject.material_slots[0].link = 'OBJECT'
-        blenderObject.material_slots[0].material = mat
+    return mat
+
+# **************************************************************************************
+def assignBrickMaterial(blenderObject, keyCode, materialLib = "realistic"):
+    mat = getBrickMaterial(keyCode, materialLib)
+    if mat is not None:
+        bindBrickMaterial(blenderObject, mat)
     return
 
+# **************************************************************************************
+def bindBrickMaterial(blenderObject, mat):
+    # Materials are bound to the object, so stones sharing a mesh can differ in color
+    if not blenderObject.material_slots:
+        blenderObject.data.materials.append(None)
+    blenderObject.material_slots[0].link = 'OBJECT'
+    blenderObject.material_slots[0].material = mat
+
 def apply_rotation(ob):
     ob.data.transform(ob.matrix_world)
     ob.matrix_world = Matrix()
 
 # **************************************************************************************
-def createBrickObjects(blenderBricklist):
+def createBrickObjects(blenderBricklist, building, layerCollections=None):
     global linkedTemplateBricks
     buildingBricks = []
+    layerCollections = {} if layerCollections is None else layerCollections
     fac = int(Options.magnification)
 
     for s in blenderBricklist:
-        templateName = "{0}_{1}".format(s['shapeId'], Options.stoneLib)
+        templateName = "{0}_{1}".format(s.shapeId, Options.stoneLib)
         if templateName in linkedTemplateBricks:
             template_ob = linkedTemplateBricks[templateName]
+            # Linked stones all use the template mesh, materials are bound to the object
             ob = template_ob.copy()
             if not Options.link:
                 ob.data = ob.data.copy()
             ob["ankerdata"] = template_ob["ankerdata"]
-            ob["layer"] = s['layer']
+            ob["layer"] = s.layer
+            ob["placement"] = s.placement
             # Set rotation
-            rotation = (s['rx'], s['ry'], s['rz'])
+            rotation = (s.rx, s.ry, s.rz)
             ob.rotation_euler = rotation
             # Set location and scale
-            location = (s['x']*fac, s['y']*fac, s['z']*fac)
+            location = (s.x*fac, s.y*fac, s.z*fac)
             ob.location = location
             # Set scale because library is 50x bigger
             scale = (fac/50,fac/50,fac/50)
@@ -226,16 +456,300 @@ def createBrickObjects(blenderBricklist):
                 "rotation": rotation,
                 "location": location,
                 "scale": scale,
-                "material": s['material']
+                "material": s.material,
+                "shapeId": s.shapeId
             }
             # Assign material
-            assignBrickMaterial(ob, s['material'], Options.materialLib)
-            linkToScene(ob)
+            with profiler.stage("materials"):
+                assignBrickMaterial(ob, s.material, Options.materialLib)
+            linkToLayer(ob, building, layerCollections, s.layer)
             buildingBricks.append(ob)
         else:
+            profiler.count("missing stones")
             debugPrint("Stone {0} not found in loaded library.".format(str(templateName)))
+    profiler.count("objects", len(buildingBricks))
+    return buildingBricks
+
+# **************************************************************************************
+def newGroupSocket(tree, inOut, socketType, name):
+    # Blender 4.0 moved node group sockets into the interface
+    if hasattr(tree, "interface"):
+        return tree.interface.new_socket(name, in_out=inOut, socket_type=socketType)
+    sockets = tree.inputs if inOut == 'INPUT' else tree.outputs
+    return sockets.new(socketType, name)
+
+# **************************************************************************************
+def namedAttributeNode(tree, name, dataType):
+    node = tree.nodes.new("GeometryNodeInputNamedAttribute")
+    node.data_type = dataType
+    node.inputs["Name"].default_value = name
+    # Older versions have one output per data type, only the matching one is enabled
+    output = next(o for o in node.outputs if o.enabled and o.name == "Attribute")
+    return output
+
+# **************************************************************************************
+def createInstancerNodeGroup(name, prototypes, scale):
+    tree = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    newGroupSocket(tree, 'INPUT', 'NodeSocketGeometry', "Geometry")
+    newGroupSocket(tree, 'INPUT', 'NodeSocketInt', "Layer From").default_value = 0
+    newGroupSocket(tree, 'INPUT', 'NodeSocketInt', "Layer To").default_value = 2**31 - 1
+    newGroupSocket(tree, 'OUTPUT', 'NodeSocketGeometry', "Geometry")
+    groupIn = tree.nodes.new("NodeGroupInput")
+    groupOut = tree.nodes.new("NodeGroupOutput")
+    # Every prototype becomes one pickable instance, ordered by its name
+    collectionInfo = tree.nodes.new("GeometryNodeCollectionInfo")
+    collectionInfo.transform_space = 'ORIGINAL'
+    collectionInfo.inputs["Collection"].default_value = prototypes
+    collectionInfo.inputs["Separate Children"].default_value = True
+    collectionInfo.inputs["Reset Children"].default_value = True
+    instancer = tree.nodes.new("GeometryNodeInstanceOnPoints")
+    instancer.inputs["Pick Instance"].default_value = True
+    instancer.inputs["Scale"].default_value = scale
+    tree.links.new(groupIn.outputs[0], instancer.inputs["Points"])
+    tree.links.new(collectionInfo.outputs[0], instancer.inputs["Instance"])
+    tree.links.new(namedAttributeNode(tree, "shape_index", 'INT'), instancer.inputs["Instance Index"])
+    tree.links.new(namedAttributeNode(tree, "rotation", 'FLOAT_VECTOR'), instancer.inputs["Rotation"])
+    tree.links.new(instancer.outputs[0], groupOut.inputs[0])
+    # Only stones of the layers between Layer From and Layer To are instanced
+    layer = namedAttributeNode(tree, "layer", 'INT')
+    fromLayer = compareNode(tree, 'GREATER_EQUAL', layer, groupIn.outputs["Layer From"])
+    toLayer = compareNode(tree, 'LESS_EQUAL', layer, groupIn.outputs["Layer To"])
+    both = tree.nodes.new("FunctionNodeBooleanMath")
+    both.operation = 'AND'
+    tree.links.new(fromLayer, both.inputs[0])
+    tree.links.new(toLayer, both.inputs[1])
+    tree.links.new(both.outputs[0], instancer.inputs["Selection"])
+    return tree
+
+# **************************************************************************************
+def compareNode(tree, operation, a, b):
+    node = tree.nodes.new("FunctionNodeCompare")
+    node.data_type = 'INT'
+    node.operation = operation
+    # The compare node has a pair of inputs per data type, only told apart by their identifier
+    tree.links.new(a, next(i for i in node.inputs if i.identifier == "A_INT"))
+    tree.links.new(b, next(i for i in node.inputs if i.identifier == "B_INT"))
+    return node.outputs[0]
+
+# **************************************************************************************
+def createBrickInstancer(name, placements, building):
+    # Creates one point object for the whole building, instancing a prototype per shape and material
+    global linkedTemplateBricks
+    if placements is None:
+        return []
+    fac = int(Options.magnification)
+    prototypes = bpy.data.collections.new("{0}_prototypes".format(name))
+    bpy.context.scene.collection.children.link(prototypes)
+    prototypes.hide_viewport = True
+    prototypes.hide_render = True
+    building["ankerPrototypes"] = prototypes.name
+
+    # Find a prototype for every placement, dropping stones missing in the library
+    prototypeIndex = {}
+    prototypeCorners = []
+    materialKeys = {}
+    found = numpy.zeros(len(placements.shapeId), dtype=bool)
+    shapeIndex = numpy.zeros(len(placements.shapeId), dtype=int)
+    materialKey = numpy.zeros(len(placements.shapeId), dtype=int)
+    for i, key in enumerate(zip(placements.shapeId.tolist(), placements.material.tolist())):
+        templateName = "{0}_{1}".format(key[0], Options.stoneLib)
+        if key not in prototypeIndex:
+            if templateName not in linkedTemplateBricks:
+                debugPrint("Stone {0} not found in loaded library.".format(str(templateName)))
+                profiler.count("missing stones")
+                prototypeIndex[key] = None
+                continue
+            template_ob = linkedTemplateBricks[templateName]
+            ob = template_ob.copy()
+            ob.name = "{0:05d}_{1}_{2}".format(len(prototypes.objects), key[0], key[1])
+            ob["ankerdata"] = template_ob["ankerdata"]
+            ob["instancedata"] = {"shapeId": key[0], "material": key[1]}
+            assignBrickMaterial(ob, key[1], Options.materialLib)
+            prototypes.objects.link(ob)
+            prototypeIndex[key] = len(prototypes.objects) - 1
+            prototypeCorners.append(numpy.array(template_ob.bound_box))
+        if prototypeIndex[key] is not None:
+            found[i] = True
+            shapeIndex[i] = prototypeIndex[key]
+            materialKey[i] = materialKeys.setdefault(key[1], len(materialKeys))
+
+    # One vertex per placement carrying the per stone attributes, origin in the middle
+    count = int(found.sum())
+    co = placements.location[found] * fac
+    center = boundsCenter(co)
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(count)
+    mesh.vertices.foreach_set("co", (co - center).astype(numpy.float32).ravel())
+    setMeshAttribute(mesh, "shape_index", 'INT', 'POINT', shapeIndex[found])
+    setMeshAttribute(mesh, "material_key", 'INT', 'POINT', materialKey[found])
+    setMeshAttribute(mesh, "layer", 'INT', 'POINT', placements.layer[found])
+    setMeshAttribute(mesh, "rotation", 'FLOAT_VECTOR', 'POINT', placements.rotation[found])
+    mesh.update()
+
+    ob = bpy.data.objects.new(name, mesh)
+    ob.location = center
+    ob["materialKeys"] = [str(k) for k in materialKeys]
+    # The points don't cover the instanced stones, so keep the bounds of the stones on the object
+    if count:
+        matrices = numpy.zeros((count, 4, 4))
+        matrices[:, :3, :3] = placements.matrix[found] * (fac/50)
+        matrices[:, :3, 3] = co - center
+        (lo, hi) = transform_bounds(numpy.array(prototypeCorners)[shapeIndex[found]], matrices)
+        ob["bounds"] = [list(lo), list(hi)]
+    modifier = ob.modifiers.new("AnkerInstancer", 'NODES')
+    modifier.node_group = createInstancerNodeGroup("{0}_instancer".format(name), prototypes, (fac/50, fac/50, fac/50))
+    building.objects.link(ob)
+    debugPrint("Instanced {0} stones with {1} prototypes".format(count, len(prototypes.objects)))
+    return [ob]
+
+# **************************************************************************************
+def readMeshGeometry(mesh):
+    co = numpy.empty(len(mesh.vertices)*3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", co)
+    loopVertex = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+    mesh.loops.foreach_get("vertex_index", loopVertex)
+    loopStart = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get("loop_start", loopStart)
+    loopTotal = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get("loop_total", loopTotal)
+    smooth = numpy.empty(len(mesh.polygons), dtype=bool)
+    mesh.polygons.foreach_get("use_smooth", smooth)
+    uv = numpy.zeros(len(mesh.loops)*2, dtype=numpy.float32)
+    if mesh.uv_layers.active:
+        mesh.uv_layers.active.data.foreach_get("uv", uv)
+    return MeshGeometry(co.reshape(-1, 3), loopVertex, loopStart, loopTotal, smooth, uv.reshape(-1, 2))
+
+# **************************************************************************************
+def writeMeshGeometry(name, geometry):
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(geometry.co))
+    mesh.loops.add(len(geometry.loopVertex))
+    mesh.polygons.add(len(geometry.loopStart))
+    mesh.vertices.foreach_set("co", geometry.co.astype(numpy.float32).ravel())
+    mesh.loops.foreach_set("vertex_index", geometry.loopVertex)
+    mesh.polygons.foreach_set("loop_start", geometry.loopStart)
+    if bpy.app.version < (4, 0, 0):
+        # Derived from loop_start in newer versions
+        mesh.polygons.foreach_set("loop_total", geometry.loopTotal)
+    mesh.polygons.foreach_set("use_smooth", geometry.smooth)
+    uvLayer = mesh.uv_layers.new(name="UVMap")
+    uvLayer.data.foreach_set("uv", geometry.uv.ravel())
+    mesh.update(calc_edges=True)
+    return mesh
+
+# **************************************************************************************
+def setMeshAttribute(mesh, name, attributeType, domain, values):
+    attribute = mesh.attributes.new(name, attributeType, domain)
+    if attributeType == 'INT':
+        attribute.data.foreach_set("value", numpy.ascontiguousarray(values, dtype=numpy.int32))
+    else:
+        attribute.data.foreach_set("vector", numpy.ascontiguousarray(values, dtype=numpy.float32).ravel())
+    return attribute
+
+# **************************************************************************************
+def createMergedBricks(name, placements, building):
+    # Bakes all stones of a material and layer into one mesh, keeping the placement and layer of every face
+    global linkedTemplateBricks
+    if placements is None:
+        return []
+    fac = int(Options.magnification)
+    scale = fac / 50
+
+    # Group the placements by material, layer and shape
+    groups = {}
+    for i, key in enumerate(zip(placements.material.tolist(), placements.layer.tolist(), placements.shapeId.tolist())):
+        groups.setdefault(key, []).append(i)
+
+    geometries = {}
+    parts = {}
+    for (material, layer, shapeId), indices in groups.items():
+        templateName = "{0}_{1}".format(shapeId, Options.stoneLib)
+        if templateName not in geometries:
+            if templateName in linkedTemplateBricks:
+                mesh = linkedTemplateBricks[templateName].data
+                shading = readMeshShading(mesh)
+                geometries[templateName] = (readMeshGeometry(mesh), MeshShading(shading["normals"], shading["sharpEdges"], shading["freestyleEdges"]))
+            else:
+                debugPrint("Stone {0} not found in loaded library.".format(str(templateName)))
+                profiler.count("missing shapes")
+                geometries[templateName] = None
+        if geometries[templateName] is None:
+            continue
+        geometry, shading = geometries[templateName]
+        indices = numpy.array(indices)
+        matrices = placements.matrix[indices] * scale
+        part = instanceGeometry(geometry, matrices, placements.location[indices] * fac)
+        partShading = instanceShading(shading, len(geometry.co), matrices)
+        parts.setdefault((material, layer), []).append((part, partShading, numpy.repeat(indices, len(geometry.loopStart))))
+
+    buildingBricks = []
+    layerCollections = {}
+    for (material, layer), materialParts in parts.items():
+        geometry = joinGeometry([part for part, _, _ in materialParts])
+        shading = joinShading([partShading for _, partShading, _ in materialParts], [len(part.co) for part, _, _ in materialParts])
+        # Rows of the placements table per face, stored as the BuildingShapePlacementId of the file
+        faceRows = numpy.concatenate([rows for _, _, rows in materialParts])
+        center = boundsCenter(geometry.co)
+        mesh = writeMeshGeometry("{0}_{1}_{2}".format(name, material, layer), geometry._replace(co=geometry.co - center))
+        # The normals the templates showed, whatever auto smooth or custom normals made them
+        writeMeshShading(mesh, dict(normals=shading.normals, customNormals=True, sharpEdges=shading.sharpEdges,
+            freestyleEdges=shading.freestyleEdges, autoSmooth=(True, math.pi), materialIndex=numpy.zeros(len(geometry.loopStart), dtype=numpy.int32)))
+        setMeshAttribute(mesh, "placement_id", 'INT', 'FACE', placements.placement[faceRows])
+        setMeshAttribute(mesh, "layer", 'INT', 'FACE', placements.layer[faceRows])
+        mat = getBrickMaterial(material, Options.materialLib)
+        if mat is not None:
+            mesh.materials.append(mat)
+        ob = bpy.data.objects.new(mesh.name, mesh)
+        ob.location = center
+        ob["material"] = material
+        ob["layer"] = layer
+        linkToLayer(ob, building, layerCollections, layer)
+        buildingBricks.append(ob)
+    debugPrint("Merged {0} stones into {1} meshes".format(len(placements.shapeId), len(buildingBricks)))
     return buildingBricks
 
+# **************************************************************************************
+def createShapeTemplate(templateName, shape):
+    mesh = writeMeshGeometry(templateName, shape.geometry)
+    if hasattr(mesh, "use_auto_smooth"):
+        # Custom normals need auto smooth before Blender 4.1
+        mesh.use_auto_smooth = True
+    mesh.normals_split_custom_set_from_vertices(shape.normals)
+    # Lines of the shape become freestyle edges for the instruction look
+    if len(shape.lines):
+        mesh.edges.foreach_set("use_freestyle_mark", numpy.isin(edgeKeys(mesh), edgeKeys(mesh, shape.lines)))
+    return bpy.data.objects.new(templateName, mesh)
+
+# **************************************************************************************
+def linkAsqShapes(file, shapeIds):
+    # Stones missing in the library are built from the geometry stored in the .asq file
+    global linkedTemplateBricks
+    missing = [s for s in shapeIds if "{0}_{1}".format(hotStoneId(s), Options.stoneLib) not in linkedTemplateBricks]
+    if not missing:
+        return
+    versions = loadShapeVersionsFromAsq(file, Options.mmapSize)
+    def asqTemplateName(shapeId):
+        return "{0}_asq{1}".format(shapeId, versions.get(shapeId))
+    # Shapes built before in this session are reused per ShapeId and ShapeVersion
+    toLoad = [s for s in missing if asqTemplateName(s) not in linkedTemplateBricks]
+    if toLoad:
+        templates = templateCollection()
+        shapes = loadShapeGeometryFromAsq(file, toLoad, Options.mmapSize)
+        for shapeId, shape in shapes.items():
+            ob = createShapeTemplate(asqTemplateName(shapeId), shape)
+            ob["ankerdata"] = {"nr": shapeId}
+            addTemplate(templates, asqTemplateName(shapeId), ob)
+        debugPrint("Built {0} of {1} missing stones from the geometry in the file".format(len(shapes), len(toLoad)))
+    for shapeId in missing:
+        ob = linkedTemplateBricks.get(asqTemplateName(shapeId))
+        if ob is not None:
+            # Kept on the template, so linkLibrary finds the stone again under the library name
+            templateName = "{0}_{1}".format(hotStoneId(shapeId), Options.stoneLib)
+            aliases = list(ob.get("aliases", []))
+            if templateName not in aliases:
+                ob["aliases"] = aliases + [templateName]
+            linkedTemplateBricks[templateName] = ob
+
 # **************************************************************************************
 def deselectAll():
     bpy.ops.object.select_all(action='DESELECT')
@@ -248,15 +762,42 @@ def selectAll(objects):
 
 # **************************************************************************************
 def applyScaleAndRotation(objects, scale=True):
-    selectAll(objects)
-    bpy.ops.object.transform_apply(location=False, rotation=True, scale=scale)
-    deselectAll()
+    # Bakes the rotation, and the scale if asked, of the stones into their meshes without operators.
+    # A mesh is transformed once for all its users, as long as they are all given and share one transform,
+    # otherwise (i.e. shared stone meshes) the transform stays on the objects.
+    users = {}
+    for ob in objects:
+        users.setdefault(ob.data, []).append(ob)
+    for mesh, meshUsers in users.items():
+        if mesh.users != len(meshUsers):
+            continue
+        matrices = numpy.array([ob.matrix_basis.to_3x3() if scale else ob.rotation_euler.to_matrix() for ob in meshUsers])
+        if not numpy.allclose(matrices, matrices[0]):
+            continue
+        co = numpy.empty(len(mesh.vertices)*3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3) @ matrices[0].T.astype(numpy.float32)
+        mesh.vertices.foreach_set("co", co.ravel())
+        mesh.update()
+        for ob in meshUsers:
+            ob.rotation_euler = (0, 0, 0)
+            if scale:
+                ob.scale = (1, 1, 1)
 
 # **************************************************************************************
-def buildBuilding(name, blenderBricks):
-    # Load Library
-    linkLibrary()
+def linkRequirements(shapeIds=None, materialKeys=None, asqFile=None, stoneLib=None, materialLib=None):
+    # Load Library, only the stones and materials the building uses when they are known
+    templateNames = materialNames = None
+    if shapeIds is not None:
+        templateNames = {"{0}_{1}".format(hotStoneId(s), stoneLib or Options.stoneLib) for s in shapeIds}
+    if materialKeys is not None:
+        materialNames = {"Anker_{0}_{1}".format(k, materialLib or Options.materialLib) for k in materialKeys}
+    linkLibrary(templateNames, materialNames)
+    if asqFile is not None and shapeIds is not None:
+        linkAsqShapes(asqFile, shapeIds)
 
+# **************************************************************************************
+def prepareScene():
     # Switch to Object mode and deselect all
     if bpy.ops.object.mode_set.poll():
        bpy.ops.object.mode_set(mode='OBJECT')
@@ -267,24 +808,97 @@ def buildBuilding(name, blenderBricks):
     else:
         bpy.ops.object.select_all(action='DESELECT')
 
+# **************************************************************************************
+def buildBuilding(name, blenderBricks, shapeIds=None, materialKeys=None, asqFile=None):
+    with profiler.stage("library"):
+        linkRequirements(shapeIds, materialKeys, asqFile)
+    with profiler.stage("prepare scene"):
+        prepareScene()
+    parent = createBuilding(name, blenderBricks, Options.center)
+    setupScene([parent] if parent is not None else [])
+
+    # Apply rotations
+    #if not Options.link:
+    #    for ob in parent.children:
+    #        apply_rotation(ob)
+
+    return parent
 
+# **************************************************************************************
+def createBuilding(name, blenderBricks, center=True):
+    # Creates the stones, layer collections and enclosing parent of one building, the library has to be linked
     # Replace stones
-    blenderBricks = map(hotStonesReplace, blenderBricks)
+    blenderBricks = profiler.iterate("convert", map(hotStonesReplace, blenderBricks))
 
     # Create Building
-    buildingBricks = createBrickObjects(blenderBricks )
-    applyScaleAndRotation(buildingBricks, scale=Options.applyScale)
+    importMode = buildingImportMode()
+    building = createBuildingCollection(name)
+    with profiler.stage("objects"):
+        if importMode == "instances":
+            buildingBricks = createBrickInstancer(name, collectPlacements(blenderBricks), building)
+        elif importMode == "merged":
+            buildingBricks = createMergedBricks(name, collectPlacements(blenderBricks), building)
+        else:
+            buildingBricks = createBrickObjects(iterBlenderStones(blenderBricks), building)
+    return finishBuilding(name, building, buildingBricks, importMode, center)
 
-    # Center
-    if Options.center:
-        center_relative(buildingBricks, bpy.context.scene.cursor.location)
+# **************************************************************************************
+def buildingImportMode():
+    importMode = Options.importMode
+    if importMode == "instances" and bpy.app.version < (3, 2, 0):
+        debugPrint("Instancing needs Blender 3.2 or newer, creating objects instead.")
+        importMode = "objects"
+    return importMode
+
+# **************************************************************************************
+def finishBuilding(name, building, buildingBricks, importMode, center=True):
+    # Transforms, bounds, centering and the enclosing parent of the created stones.
+    # A building without a single stone of the library is removed again, returns None then.
+    if not buildingBricks:
+        printError("Building {0} has no stones of the library {1}, skipping it".format(name, Options.stoneLib))
+        removeBuilding(building, None)
+        return None
+    if importMode == "objects":
+        with profiler.stage("transforms"):
+            applyScaleAndRotation(buildingBricks, scale=Options.applyScale)
+
+    # Bounds of the whole building, computed once and moved along when centering
+    with profiler.stage("bounds"):
+        bounds = get_bounds(buildingBricks)
+
+    # Center, the offset is kept on the parent to place stones added by an update
+    offset = Vector()
+    if center:
+        with profiler.stage("center"):
+            centered = center_relative(buildingBricks, bpy.context.scene.cursor.location, bounds)
+        offset = bounds[0] - centered[0]
+        bounds = centered
 
     # Create Parent
-    parent = enclose(buildingBricks, margin=Options.cameraMargin*int(Options.magnification))
-    parent.name = name
-    linkToScene(parent)
-    setParent(buildingBricks, parent)
+    with profiler.stage("enclose"):
+        parent = enclose(buildingBricks, margin=Options.cameraMargin*int(Options.magnification), bounds=bounds)
+        parent.name = name
+        linkToScene(parent)
+        setParent(buildingBricks, parent)
+        store_bounds(parent, bounds)
+    parent["ankerOffset"] = list(offset)
+    parent["ankerMode"] = importMode
+    parent["ankerCollection"] = building.name
+    parent["ankerStoneLib"] = Options.stoneLib
+    parent["ankerMaterialLib"] = Options.materialLib
+    return parent
 
+# **************************************************************************************
+def centerBuildings(parents, target):
+    # Moves buildings as a whole to target, keeping their places relative to each other.
+    # The target is taken before creating them, enclose moves the cursor to every building's base.
+    bounds = get_bounds(parents)
+    delta = get_bottom_center(parents, bounds) - target
+    for parent in parents:
+        parent.location = parent.location - delta
+
+# **************************************************************************************
+def setupScene(parents=None):
     # Setup File Units
     if int(Options.magnification) < 10:
         bpy.context.scene.unit_settings.length_unit = 'CENTIMETERS'
@@ -292,33 +906,585 @@ def buildBuilding(name, blenderBricks):
         bpy.context.scene.unit_settings.length_unit = 'METERS'
 
     # Setup Rendering
-        setupRendering(Options.preset)
+    if Options.setupRendering:
+        with profiler.stage("rendering"):
+            setupRendering(Options.preset)
         
     if Options.setupLighting:
-        setupHDRI(Options.environment)
+        with profiler.stage("lighting"):
+            setupHDRI(Options.environment)
         
     # Setup Camera
     if Options.setupCam:
-        cam = add_cam()
-        bpy.context.scene.camera = cam
-        position_cam(cam, Options.angleH, Options.angleV)
+        with profiler.stage("camera"):
+            cam = add_cam()
+            bpy.context.scene.camera = cam
+            # Framed from the stored bounds of the buildings, the selection isn't needed
+            bounds = get_bounds(parents) if parents else None
+            position_cam(cam, Options.angleH, Options.angleV, bounds, Options.cameraMargin*int(Options.magnification))
 
-    # Apply rotations
-    #if not Options.link:
-    #    for ob in parent.children:
-    #        apply_rotation(ob)
 
+# **************************************************************************************
+def buildCacheDirectory():
+    return os.path.join(Options.cacheDirectory, "buildings")
+
+# **************************************************************************************
+def buildCacheKey(file, buildingIds=None):
+    # Hash of the file contents, the library and every option that changes the built building
+    library = libraryChecksum() if os.path.isfile(libraryPath()) else None
+    options = [
+        Options.stoneLib, Options.materialLib, int(Options.magnification), Options.importMode, Options.link,
+        Options.applyScale, Options.center, Options.cameraMargin, Options.nks, library, list(bpy.app.version[:2]),
+        buildingIds
+    ]
+    return hashlib.sha1((fileChecksum(file) + json.dumps(options)).encode()).hexdigest()
+
+# **************************************************************************************
+def saveBuildCache(key, parent):
+    # Writes the building collection and its parent to a library .blend, with their names in a .json next to it
+    building = bpy.data.collections.get(parent.get("ankerCollection", ""))
+    if building is None:
+        return
+    prototypes = bpy.data.collections.get(building.get("ankerPrototypes", ""))
+    names = {"building": building.name, "parent": parent.name, "prototypes": prototypes.name if prototypes else None}
+    path = os.path.join(buildCacheDirectory(), key + ".blend")
+    try:
+        os.makedirs(buildCacheDirectory(), exist_ok=True)
+        bpy.data.libraries.write(path + ".tmp", {building, parent} | ({prototypes} if prototypes else set()))
+        with open(path[:-6] + ".json", "w") as f:
+            json.dump(names, f)
+        os.replace(path + ".tmp", path)
+    except (OSError, RuntimeError) as e:
+        debugPrint("WARNING: Could not cache building {0}. {1}".format(building.name, e))
+        return
+    pruneBuildCache()
+
+# **************************************************************************************
+def loadBuildCache(key, name):
+    # Appends a cached building, returns its parent or None when it isn't cached
+    path = os.path.join(buildCacheDirectory(), key + ".blend")
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path[:-6] + ".json") as f:
+            names = json.load(f)
+        with bpy.data.libraries.load(path) as (data_from, data_to):
+            data_to.collections = [n for n in (names["building"], names["prototypes"]) if n]
+            data_to.objects = [names["parent"]]
+    except (OSError, ValueError, KeyError) as e:
+        debugPrint("WARNING: Ignoring cached building {0}. {1}".format(name, e))
+        return None
+    building, parent = data_to.collections[0], data_to.objects[0]
+    if building is None or parent is None:
+        return None
+    prepareScene()
+    bpy.context.collection.children.link(building)
+    linkToScene(parent)
+    if len(data_to.collections) > 1 and data_to.collections[1] is not None:
+        bpy.context.scene.collection.children.link(data_to.collections[1])
+        # Appended next to the same building the prototypes get another name
+        building["ankerPrototypes"] = data_to.collections[1].name
+    building.name = name
+    parent.name = name
+    parent["ankerCollection"] = building.name
+    # The building was cached where it was first built, the cursor may have moved since
+    if Options.center:
+        centerBuildings([parent], bpy.context.scene.cursor.location.copy())
+    profiler.count("stones", countStones(building, parent))
+    # Touching the file marks it as recently used for the eviction
+    os.utime(path)
+    setupScene([parent])
+    debugPrint("Loaded {0} from the import cache".format(name))
     return parent
 
+# **************************************************************************************
+def removeBuildCacheEntry(path):
+    for p in (path, path[:-6] + ".json"):
+        if os.path.isfile(p):
+            os.remove(p)
+
+# **************************************************************************************
+def pruneBuildCache():
+    # Evicts the least recently used buildings until the cache fits into Options.buildCacheSize
+    entries = sorted((os.path.getmtime(f), os.path.getsize(f), f) for f in glob.glob(os.path.join(buildCacheDirectory(), "*.blend")))
+    total = sum(size for _, size, _ in entries)
+    limit = Options.buildCacheSize * 1024 * 1024
+    while entries and total > limit:
+        _, size, path = entries.pop(0)
+        removeBuildCacheEntry(path)
+        total -= size
+
+# **************************************************************************************
+def clearBuildCache():
+    # Removes all cached buildings, returns how many there were
+    files = glob.glob(os.path.join(buildCacheDirectory(), "*.blend"))
+    for path in files:
+        removeBuildCacheEntry(path)
+    return len(files)
+
+# **************************************************************************************
+def findBuilding(name):
+    # Collection and parent of a building imported before under this name, (None, None) if there is none
+    building = bpy.data.collections.get(name)
+    if building is None or not building.get("ankerBuilding"):
+        return None, None
+    parent = next((ob.parent for ob in building.all_objects if ob.parent is not None), None)
+    return building, parent
+
+# **************************************************************************************
+def removeStones(objects):
+    # Deletes the stones and the mesh copies nothing else uses
+    meshes = {ob.data for ob in objects if ob.type == 'MESH'}
+    for ob in objects:
+        bpy.data.objects.remove(ob)
+    for mesh in meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+# **************************************************************************************
+def removeBuilding(building, parent):
+    # Deletes a building with its stones, layer collections, instancer prototypes and parent
+    collections = [building] + list(building.children_recursive)
+    prototypes = bpy.data.collections.get(building.get("ankerPrototypes", ""))
+    if prototypes is not None:
+        collections.append(prototypes)
+    removeStones({ob for c in collections for ob in c.all_objects} | ({parent} if parent is not None else set()))
+    for collection in collections:
+        bpy.data.collections.remove(collection)
+
+# **************************************************************************************
+def buildingStones(building, parent):
+    # Import mode of the building and the objects carrying its stones: one object per stone,
+    # the instancer prototypes or the merged meshes
+    mode = parent.get("ankerMode", "objects") if parent is not None else "objects"
+    if mode == "merged":
+        return mode, [ob for ob in building.all_objects if "material" in ob]
+    if mode == "instances":
+        prototypes = bpy.data.collections.get(building.get("ankerPrototypes", ""))
+        return mode, [ob for ob in prototypes.objects if "instancedata" in ob] if prototypes is not None else []
+    return mode, [ob for ob in building.all_objects if "instancedata" in ob]
+
+# **************************************************************************************
+def countStones(building, parent):
+    # Stones of a built building: the stone objects, the instancer points or the placements of the merged faces
+    mode, stones = buildingStones(building, parent)
+    if mode == "instances":
+        return sum(len(ob.data.vertices) for ob in building.all_objects if "materialKeys" in ob)
+    if mode == "merged":
+        placementIds = set()
+        for ob in stones:
+            attribute = ob.data.attributes.get("placement_id")
+            if attribute is not None:
+                values = numpy.empty(len(attribute.data), dtype=numpy.int32)
+                attribute.data.foreach_get("value", values)
+                placementIds.update(numpy.unique(values).tolist())
+        return len(placementIds)
+    return len(stones)
+
+# **************************************************************************************
+def swapLibrary(building, parent, stoneLib=None, materialLib=None):
+    # Switches the stones of a building to the templates of another stone library and their materials
+    # to another material library, without reading the file again. Templates and materials are looked
+    # up once per shape and key. Merged buildings have their stones baked and only switch materials.
+    # Returns the number of switched stones and prototypes.
+    mode, stones = buildingStones(building, parent)
+    if mode == "merged":
+        if stoneLib:
+            debugPrint("Merged building {0} keeps its stones, import it again to switch them.".format(building.name))
+            stoneLib = None
+        shapeIds, materialKeys = set(), {ob["material"] for ob in stones}
+    else:
+        # Proxies belong to the templates of the old library
+        with profiler.stage("detail"):
+            setStoneDetail(stones, [False] * len(stones))
+        shapeIds = {ob["instancedata"]["shapeId"] for ob in stones}
+        materialKeys = {ob["instancedata"]["material"] for ob in stones}
+
+    # Only the library that changes is looked up, an empty set loads nothing of the other
+    with profiler.stage("library"):
+        linkRequirements(shapeIds if stoneLib else set(), materialKeys if materialLib else set(), None, stoneLib, materialLib)
+    templates = {s: linkedTemplateBricks.get("{0}_{1}".format(hotStoneId(s), stoneLib)) for s in shapeIds} if stoneLib else {}
+    materials = {k: getBrickMaterial(k, materialLib) for k in materialKeys} if materialLib else {}
+
+    if mode == "merged":
+        with profiler.stage("materials"):
+            for ob in stones:
+                mat = materials.get(ob["material"])
+                if mat is not None:
+                    if ob.data.materials:
+                        ob.data.materials[0] = mat
+                    else:
+                        ob.data.materials.append(mat)
+    else:
+        oldMeshes, copies, missing = set(), [], 0
+        # Copied meshes have the rotation, and maybe the scale, of their stone baked in
+        applyScale = any(ob.data.users == 1 and tuple(ob.scale) != tuple(ob["instancedata"]["scale"]) for ob in stones if mode == "objects")
+        with profiler.stage("stones"):
+            for ob in stones:
+                data = ob["instancedata"]
+                template = templates.get(data["shapeId"])
+                if stoneLib and template is None:
+                    missing += 1
+                elif template is not None:
+                    mat = ob.material_slots[0].material if ob.material_slots else None
+                    oldMeshes.add(ob.data)
+                    if mode == "objects" and ob.data.users == 1:
+                        ob.data = template.data.copy()
+                        copies.append(ob)
+                    else:
+                        ob.data = template.data
+                    if mode == "objects":
+                        ob.rotation_euler = data["rotation"]
+                        ob.scale = data["scale"]
+                    ob["ankerdata"] = template["ankerdata"]
+                    if mat is not None and not materialLib:
+                        bindBrickMaterial(ob, mat)
+        with profiler.stage("transforms"):
+            applyScaleAndRotation(copies, scale=applyScale)
+        with profiler.stage("materials"):
+            for ob in stones:
+                mat = materials.get(ob["instancedata"]["material"])
+                if mat is not None:
+                    bindBrickMaterial(ob, mat)
+        for mesh in oldMeshes:
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        if missing:
+            profiler.count("missing stones", missing)
+            debugPrint("{0} stones of {1} not found in the {2} library, they keep their shape.".format(missing, building.name, stoneLib))
+
+    if parent is not None:
+        if stoneLib:
+            parent["ankerStoneLib"] = stoneLib
+        if materialLib:
+            parent["ankerMaterialLib"] = materialLib
+    profiler.count("stones", len(stones))
+    return len(stones)
+
+# **************************************************************************************
+def proxyMesh(template, proxyType="box"):
+    # Low poly stand-in of a template, its bounding box or convex hull, created once and kept in the file
+    name = "{0}_proxy_{1}".format(template.get("template", template.name), proxyType)
+    mesh = bpy.data.meshes.get(name)
+    if mesh is not None:
+        return mesh
+    co = numpy.empty(len(template.data.vertices)*3, dtype=numpy.float32)
+    template.data.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    mesh = bpy.data.meshes.new(name)
+    bm = bmesh.new()
+    if proxyType == "hull" and len(co) >= 4:
+        for v in co:
+            bm.verts.new(v)
+        hull = bmesh.ops.convex_hull(bm, input=bm.verts)
+        bmesh.ops.delete(bm, geom=[v for v in hull["geom_interior"] + hull["geom_unused"] if isinstance(v, bmesh.types.BMVert)], context='VERTS')
+        bmesh.ops.dissolve_limit(bm, angle_limit=math.radians(5), verts=bm.verts, edges=bm.edges)
+    else:
+        lo, hi = (co.min(axis=0), co.max(axis=0)) if len(co) else (numpy.zeros(3), numpy.zeros(3))
+        bmesh.ops.create_cube(bm, size=1.0, matrix=Matrix.Translation(Vector((lo + hi) / 2)) @ Matrix.Diagonal(Vector(hi - lo)).to_4x4())
+    bm.to_mesh(mesh)
+    bm.free()
+    # One slot for the object bound material of the stone
+    mesh.materials.append(None)
+    mesh.use_fake_user = True
+    return mesh
+
+# **************************************************************************************
+def setStoneDetail(stones, proxies, proxyType="box", stoneLib=None):
+    # Switches every stone to its proxy or back to its full mesh, proxies is a flag per stone.
+    # The full mesh is kept on the stone while it shows the proxy, copied meshes have the rotation
+    # baked in so the stone gets its rotation back while it shows the shared proxy.
+    templates = templateIndex(templateCollection())
+    switched = 0
+    for ob, proxy in zip(stones, proxies):
+        if bool(proxy) == ("ankerMesh" in ob):
+            continue
+        mat = ob.material_slots[0].material if ob.material_slots else None
+        if proxy:
+            data = ob["instancedata"]
+            template = templates.get("{0}_{1}".format(data["shapeId"], stoneLib or Options.stoneLib))
+            if template is None or template.type != 'MESH':
+                continue
+            ob["ankerMesh"] = ob.data
+            ob["ankerBasis"] = [list(ob.rotation_euler), list(ob.scale)]
+            ob.data = proxyMesh(template, proxyType)
+            if "rotation" in data:
+                ob.rotation_euler = data["rotation"]
+                ob.scale = data["scale"]
+        else:
+            ob.data = ob["ankerMesh"]
+            ob.rotation_euler, ob.scale = ob["ankerBasis"]
+            del ob["ankerMesh"]
+            del ob["ankerBasis"]
+        if mat is not None:
+            bindBrickMaterial(ob, mat)
+        switched += 1
+    return switched
+
+# **************************************************************************************
+# Detail shown in the viewport and in renders for every level of detail setting
+DETAIL_LEVELS = {
+    "FULL":     ("FULL", "FULL"),
+    "VIEWPORT": ("PROXY", "FULL"),
+    "RENDER":   ("FULL", "PROXY"),
+    "DISTANCE": ("DISTANCE", "DISTANCE"),
+}
+
+# **************************************************************************************
+def applyDetail(scene, detail, distance=25.0, proxyType="box"):
+    # Picks the full mesh or the proxy for the stones of all buildings in the scene at once. With
+    # "DISTANCE" stones farther than distance from the active camera get their proxy, an instancer
+    # is judged by the center of its building. Returns the number of switched stones.
+    camera = scene.camera
+    switched = 0
+    for parent in [ob for ob in scene.objects if "ankerCollection" in ob]:
+        building = bpy.data.collections.get(parent["ankerCollection"])
+        if building is None:
+            continue
+        mode, stones = buildingStones(building, parent)
+        if mode == "merged" or not stones:
+            continue
+        if detail == "DISTANCE" and camera is not None:
+            eye = numpy.array(camera.matrix_world.translation)
+            if mode == "instances":
+                bounds = parent.get("bounds")
+                center = parent.matrix_world @ ((Vector(bounds[0]) + Vector(bounds[1])) / 2) if bounds else parent.matrix_world.translation
+                proxies = [numpy.linalg.norm(numpy.array(center) - eye) > distance] * len(stones)
+            else:
+                positions = numpy.array([ob.matrix_world.translation for ob in stones])
+                proxies = numpy.linalg.norm(positions - eye, axis=1) > distance
+        else:
+            proxies = [detail == "PROXY"] * len(stones)
+        switched += setStoneDetail(stones, proxies, proxyType, parent.get("ankerStoneLib"))
+    return switched
+
+# **************************************************************************************
+def setLevelOfDetail(scene, level, distance=25.0, proxyType="box"):
+    # Keeps the level of detail setting on the scene, for the render handlers, and shows the viewport detail
+    scene["ankerLevelOfDetail"] = level
+    scene["ankerLodDistance"] = distance
+    scene["ankerProxyType"] = proxyType
+    # Render handlers switch the stones, the interface has to wait for them
+    if DETAIL_LEVELS[level][0] != DETAIL_LEVELS[level][1]:
+        scene.render.use_lock_interface = True
+    return applyDetail(scene, DETAIL_LEVELS[level][0], distance, proxyType)
+
+# **************************************************************************************
+def sceneDetail(scene, rendering):
+    level = scene.get("ankerLevelOfDetail")
+    if level in DETAIL_LEVELS:
+        detail = DETAIL_LEVELS[level][1 if rendering else 0]
+        # Distance is judged again, the camera may have moved since
+        if DETAIL_LEVELS[level][0] != DETAIL_LEVELS[level][1] or detail == "DISTANCE":
+            applyDetail(scene, detail, scene.get("ankerLodDistance", 25.0), scene.get("ankerProxyType", "box"))
+
+# **************************************************************************************
+@bpy.app.handlers.persistent
+def detailRenderInit(scene, *args):
+    sceneDetail(scene, True)
+
+# **************************************************************************************
+@bpy.app.handlers.persistent
+def detailRenderDone(scene, *args):
+    sceneDetail(scene, False)
+
+# **************************************************************************************
+def registerHandlers():
+    bpy.app.handlers.render_init.append(detailRenderInit)
+    bpy.app.handlers.render_complete.append(detailRenderDone)
+    bpy.app.handlers.render_cancel.append(detailRenderDone)
+
+# **************************************************************************************
+def unregisterHandlers():
+    for handlers, handler in ((bpy.app.handlers.render_init, detailRenderInit),
+                              (bpy.app.handlers.render_complete, detailRenderDone),
+                              (bpy.app.handlers.render_cancel, detailRenderDone)):
+        if handler in handlers:
+            handlers.remove(handler)
+
+# **************************************************************************************
+def canUpdate(parent):
+    # Only buildings of single stone objects are updated, instancers and merged meshes are cheap to rebuild
+    return parent is not None and parent.get("ankerMode") == "objects" and Options.importMode == "objects"
+
+# **************************************************************************************
+def updateBuilding(building, parent, blenderBricks):
+    # Diffs the placements against the stones of the building, keyed by placement id and layer.
+    # Only added, removed and changed placements are touched, moved stones are patched in place,
+    # stones with a new shape or rotation are created again. The library has to be linked.
+    if bpy.ops.object.mode_set.poll():
+       bpy.ops.object.mode_set(mode='OBJECT')
+    fac = int(Options.magnification)
+    offset = Vector(parent.get("ankerOffset", (0, 0, 0)))
+    stones = {}
+    for ob in building.all_objects:
+        if "placement" in ob:
+            stones[(ob["placement"], ob["layer"])] = ob
+    # New stones share the parent inverse of the others, the parent may have been moved since
+    inverse = next((ob.matrix_parent_inverse.copy() for ob in stones.values() if ob.parent == parent), None)
+    layerCollections = {c["ankerLayer"]: c for c in building.children if c.get("ankerLayer") is not None}
+
+    added, replaced = [], []
+    changed = 0
+    with profiler.stage("diff"):
+        for s in iterBlenderStones(profiler.iterate("convert", map(hotStonesReplace, blenderBricks))):
+            ob = stones.pop((s.placement, s.layer), None)
+            if ob is None:
+                added.append(s)
+                continue
+            data = ob["instancedata"]
+            if data.get("shapeId") != s.shapeId or not numpy.allclose(tuple(data["rotation"]), (s.rx, s.ry, s.rz), atol=1e-6):
+                replaced.append(ob)
+                added.append(s)
+                continue
+            location = (s.x*fac, s.y*fac, s.z*fac)
+            moved = not numpy.allclose(tuple(data["location"]), location, atol=1e-6)
+            if moved:
+                ob.location = Vector(location) - offset
+                data["location"] = location
+            rematerialed = data["material"] != s.material
+            if rematerialed:
+                with profiler.stage("materials"):
+                    assignBrickMaterial(ob, s.material, Options.materialLib)
+                data["material"] = s.material
+            if moved or rematerialed:
+                changed += 1
+
+    removed = list(stones.values())
+    with profiler.stage("remove"):
+        removeStones(removed + replaced)
+    with profiler.stage("objects"):
+        newBricks = createBrickObjects(added, building, layerCollections)
+        for ob in newBricks:
+            ob.location -= offset
+        setParent(newBricks, parent, inverse)
+    with profiler.stage("transforms"):
+        applyScaleAndRotation(newBricks, scale=Options.applyScale)
+    for layer, collection in layerCollections.items():
+        if not collection.objects:
+            bpy.data.collections.remove(collection)
+
+    with profiler.stage("bounds"):
+        allBricks = [ob for ob in building.all_objects if "placement" in ob]
+        if allBricks:
+            store_bounds(parent, get_bounds(allBricks))
+    profiler.count("added", len(added) - len(replaced))
+    profiler.count("removed", len(removed))
+    profiler.count("changed", changed + len(replaced))
+    debugPrint("Updated {0}: {1} added, {2} removed, {3} changed".format(
+        building.name, len(added) - len(replaced), len(removed), changed + len(replaced)))
+    return parent
+
+# **************************************************************************************
+def readAsq(file, buildingIds=None):
+    # Returns the shape ids, the material keys and the lazily read and converted placement batches
+    with profiler.stage("read"):
+        shapeIds, materialKeys = loadRequirementsFromAsq(file, buildingIds)
+    blenderBricks = profiler.iterate("convert", asqToBlender(profiler.iterate("read", loadBricksFromAsq(file, buildingIds=buildingIds))))
+    return blenderBricks, shapeIds, materialKeys
+
+# **************************************************************************************
+def buildingNames(file, name):
+    # (BuildingId, name) of the buildings to import, a file with a single building keeps the file name
+    with profiler.stage("read"):
+        buildings = asqcore.loadBuildingsFromAsq(file, Options.mmapSize)
+    if len(buildings) <= 1:
+        return [(None, name)]
+    if Options.buildings is not None:
+        buildings = [b for b in buildings if b[0] in Options.buildings]
+    names = [buildingName for _, buildingName in buildings]
+    return [(buildingId, buildingName if buildingName and names.count(buildingName) == 1 else "{0} {1}".format(name, buildingId))
+            for buildingId, buildingName in buildings]
+
+# **************************************************************************************
+def loadBuilding(file, name, buildingIds=None):
+    # Imports, updates or appends from the cache one building
+    building, parent = findBuilding(name) if Options.update else (None, None)
+    if canUpdate(parent):
+        blenderBricks, shapeIds, materialKeys = readAsq(file, buildingIds)
+        with profiler.stage("library"):
+            linkRequirements(shapeIds, materialKeys, file)
+        return updateBuilding(building, parent, blenderBricks)
+    if building is not None:
+        with profiler.stage("remove"):
+            removeBuilding(building, parent)
+    with profiler.stage("cache"):
+        key = buildCacheKey(file, buildingIds) if Options.buildCache else None
+        rootOb = loadBuildCache(key, name) if key else None
+    if rootOb is None:
+        rootOb = buildBuilding(name, *readAsq(file, buildingIds), file)
+        if key and rootOb is not None:
+            with profiler.stage("cache"):
+                saveBuildCache(key, rootOb)
+    return rootOb
+
+# **************************************************************************************
+def loadBuildings(file, buildings):
+    # Imports several buildings of one file with a single read and library pass, one parent each.
+    # They keep their places relative to each other, buildings imported before are updated or replaced.
+    blenderBricks, shapeIds, materialKeys = readAsq(file, [buildingId for buildingId, _ in buildings])
+    with profiler.stage("library"):
+        linkRequirements(shapeIds, materialKeys, file)
+    with profiler.stage("prepare scene"):
+        if Options.update and any(canUpdate(findBuilding(name)[1]) for _, name in buildings):
+            if bpy.ops.object.mode_set.poll():
+                bpy.ops.object.mode_set(mode='OBJECT')
+        else:
+            prepareScene()
+    with profiler.stage("split"):
+        placements = collectPlacements(blenderBricks)
+        tables = splitBuildings(placements) if placements is not None else {}
+
+    target = bpy.context.scene.cursor.location.copy()
+    parents, created = [], []
+    for buildingId, name in buildings:
+        if buildingId not in tables:
+            continue
+        building, parent = findBuilding(name) if Options.update else (None, None)
+        if canUpdate(parent):
+            parents.append(updateBuilding(building, parent, [tables[buildingId]]))
+            continue
+        if building is not None:
+            with profiler.stage("remove"):
+                removeBuilding(building, parent)
+        parent = createBuilding(name, [tables[buildingId]], center=False)
+        if parent is None:
+            continue
+        parents.append(parent)
+        created.append(parent)
+    if Options.center and created:
+        with profiler.stage("center"):
+            centerBuildings(created, target)
+    setupScene(parents)
+    return parents
+
+# **************************************************************************************
+def finishProfile():
+    # Stops the clock of the import, prints the stage timings and writes them to Options.profileFile
+    profiler.finish()
+    for line in profiler.lines():
+        debugPrint(line)
+    if Options.profileFile:
+        profiler.dump(Options.profileFile)
+
 # **************************************************************************************
 def loadFromFile(context, filename, isFullFilepath=True):
+    # Returns the parent of the building, or a list of parents for a file with several buildings
     file = os.path.expanduser(filename)
     if os.path.isfile(file):
         filename = os.path.basename(file)
         name = os.path.splitext(filename)[0] or 'Building'
-        asqBricks = loadBricksFromAsq(file)
-        blenderBricks = asqToBlender(asqBricks)
-        rootOb = buildBuilding(name, blenderBricks)
+        profiler.reset()
+        buildings = buildingNames(file, name)
+        if len(buildings) > 1:
+            rootOb = loadBuildings(file, buildings)
+        elif buildings:
+            buildingId, name = buildings[0]
+            rootOb = loadBuilding(file, name, None if buildingId is None else [buildingId])
+        else:
+            debugPrint("None of the buildings {0} is in the file.".format(Options.buildings))
+            rootOb = None
+        finishProfile()
         debugPrint("Load Done")
         return rootOb
     else:
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ previews
+
+Scans .asq files for their preview image and building metadata without
+reading any stones. The results are cached per file, keyed by its path, size
+and modification time, so browsing a folder again only opens the files that
+changed. Like asqcore this module doesn't need Blender:
+
+    entries = scanFolder("buildings/", cacheDirectory)
+    entries[0]["buildings"][0]["name"], entries[0]["thumbnail"]
+"""
+
+import os
+import glob
+import json
+import sqlite3
+import hashlib
+import concurrent.futures
+
+from . import asqcore
+
+THUMBNAIL_SIZE = 96     # Smallest preview width used as thumbnail, the .asq files carry 96 and 1024 pixels
+
+# **************************************************************************************
+def cacheKey(file):
+    stat = os.stat(file)
+    return hashlib.sha1("{0}|{1}|{2}".format(os.path.abspath(file), stat.st_size, stat.st_mtime_ns).encode()).hexdigest()
+
+# **************************************************************************************
+def scanAsq(file, cacheDirectory, size=THUMBNAIL_SIZE):
+    # Metadata and thumbnail path of a file as a dict, from the cache as long as the file is unchanged
+    base = os.path.join(cacheDirectory, cacheKey(file))
+    try:
+        with open(base + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    entry = {"file": os.path.abspath(file), "buildings": [], "thumbnail": None, "error": None}
+    preview = None
+    try:
+        entry["buildings"] = [info._asdict() for info in asqcore.loadInfoFromAsq(file)]
+        preview = asqcore.loadPreviewFromAsq(file, size)
+    except sqlite3.Error as e:
+        entry["error"] = str(e)
+    # Without a writable cache the metadata is still returned, only the thumbnail is missing
+    try:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        if preview is not None:
+            imageFormat, data = preview
+            entry["thumbnail"] = "{0}.{1}".format(base, (imageFormat or "png").lower())
+            with open(entry["thumbnail"], "wb") as f:
+                f.write(data)
+        with open(base + ".json.tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(base + ".json.tmp", base + ".json")
+    except OSError:
+        entry["thumbnail"] = None
+    return entry
+
+# **************************************************************************************
+def scanFolder(directory, cacheDirectory, recursive=False, workers=8):
+    # Entries of all .asq files of the folder sorted by file name, unchanged files come from the cache
+    pattern = os.path.join(directory, "**", "*.asq") if recursive else os.path.join(directory, "*.asq")
+    files = sorted(glob.glob(pattern, recursive=recursive), key=lambda f: os.path.basename(f).lower())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda file: scanAsq(file, cacheDirectory), files))
+
+# **************************************************************************************
+def clearPreviews(cacheDirectory):
+    # Removes all cached thumbnails and metadata, returns how many files were scanned
+    files = glob.glob(os.path.join(cacheDirectory, "*"))
+    for path in files:
+        os.remove(path)
+    return len([f for f in files if f.endswith(".json")])
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ profiler
+
+Records the time spent in every stage of an import and a few counters, so a
+slow import can be broken down without an external profiler. Stages nest, a
+stage only books the time not spent in the stages running inside of it:
+
+    with profiler.stage("objects"):
+        ...
+        with profiler.stage("materials"):
+            ...
+
+Lazy pipelines are timed with iterate(), which books the time spent producing
+each item to the given stage.
+
+With a memory function set (i.e. the resident set size in bytes) every stage
+also books the memory it grew by, the same way as the time:
+
+    profiler.memory = residentMemory
+"""
+
+import time
+import json
+
+
+# **************************************************************************************
+class ProfilerStage:
+    """Context manager timing one run of a stage"""
+    __slots__ = ("profiler", "name", "start", "startMemory")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack.append([0.0, 0])
+        self.startMemory = self.profiler.memory() if self.profiler.memory else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        grown = self.profiler.memory() - self.startMemory if self.profiler.memory else 0
+        nested, nestedMemory = self.profiler.stack.pop()
+        if self.profiler.stack:
+            self.profiler.stack[-1][0] += elapsed
+            self.profiler.stack[-1][1] += grown
+        entry = self.profiler.stages.setdefault(self.name, [0.0, 0, 0])
+        entry[0] += elapsed - nested
+        entry[1] += 1
+        entry[2] += grown - nestedMemory
+        return False
+
+
+# **************************************************************************************
+class Profiler:
+    """Stage durations and counters of one import"""
+
+    def __init__(self, memory=None):
+        self.memory = memory    # Function returning the memory in use in bytes, None to only record time
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counts = {}
+        self.stack = []
+        self.start = time.perf_counter()
+        self.end = None
+
+    def stage(self, name):
+        return ProfilerStage(self, name)
+
+    def iterate(self, name, iterable):
+        # Yields the items of iterable, booking the time spent producing them to the stage
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def total(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def toDict(self):
+        return {
+            "total": self.total(),
+            "stages": {name: {"seconds": seconds, "calls": calls, "bytes": grown} for name, (seconds, calls, grown) in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+
+    def lines(self):
+        # Table of the stages, slowest first, followed by the counters
+        total = self.total()
+        rows = sorted(self.stages.items(), key=lambda item: -item[1][0])
+        lines = ["{0:<18} {1:>10.1f} ms {2:>6.1f} % {3:>8} calls".format(name, seconds*1000, seconds/total*100 if total else 0, calls)
+                 + (" {0:>+10.1f} MiB".format(grown/1024/1024) if self.memory else "")
+                 for name, (seconds, calls, grown) in rows]
+        lines.append("{0:<18} {1:>10.1f} ms".format("total", total*1000))
+        lines += ["{0:<18} {1:>10}".format(name, value) for name, value in sorted(self.counts.items())]
+        return lines
+
+    def summary(self, top=4):
+        # One line for the status bar, the total and the slowest stages
+        rows = sorted(self.stages.items(), key=lambda item: -item[1][0])[:top]
+        stages = ", ".join("{0} {1:.2f}s".format(name, seconds) for name, (seconds, _, _) in rows)
+        return "{0} stones in {1:.2f}s ({2})".format(self.counts.get("stones", 0), self.total(), stages)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.toDict(), f, indent=2)
@@ -3,6 +3,8 @@ from mathutils import Vector, Euler
 from bpy.props import StringProperty, FloatProperty, EnumProperty, BoolProperty, IntProperty
 import os
 import math
+import itertools
+import numpy
 
 class OBJECT_OT_cursor_save(bpy.types.Operator):
     """Save 3d Cursor Position relative to the part (relative to the part)"""
@@ -163,16 +165,30 @@ class OBJECT_OT_show_layer(bpy.types.Operator):
         name="Layer",
         default=1
     )
+    layerTo: IntProperty(
+        name="To Layer",
+        default=1
+    )
+    mode: EnumProperty(
+        name="Show",
+        default="SINGLE",
+        items=(
+            ("SINGLE", "Single Layer", "Show only the layer"),
+            ("RANGE", "Range of Layers", "Show the layers from Layer to To Layer"),
+            ("UP_TO", "Up to Layer", "Show all layers up to the layer"),
+        )
+    )
     showWireframe: BoolProperty(
         name="Show Wireframe of other layers",
         default=False
     )
     def execute(self, context):
-        for o in context.scene.objects:
-            if o.get('layer') and int(o.get('layer')) == self.layer:
-                o.hide_set(False)
-            else:
-                o.hide_set(True)
+        if self.mode == "RANGE":
+            show_layers(context, self.layer, self.layerTo)
+        elif self.mode == "UP_TO":
+            show_layers(context, LAYER_FIRST, self.layer)
+        else:
+            show_layers(context, self.layer, self.layer)
         return {'FINISHED'}  
 
 class OBJECT_OT_show_all_layers(bpy.types.Operator):
@@ -181,11 +197,70 @@ class OBJECT_OT_show_all_layers(bpy.types.Operator):
     bl_label        = "Show all Layers of the building"
     bl_options      = {'REGISTER', 'UNDO'}
     def execute(self, context):
-        for o in context.scene.objects:
-            o.hide_set(False)
+        show_layers(context, LAYER_FIRST, LAYER_LAST)
         return {'FINISHED'}  
 
 
+LAYER_FIRST = 0
+LAYER_LAST = 2**31 - 1
+
+def anker_buildings(context):
+    # Layer collections of the imported buildings in the view layer
+    buildings = []
+    def walk(layer_collection):
+        for child in layer_collection.children:
+            if child.collection.get("ankerBuilding"):
+                buildings.append(child)
+            else:
+                walk(child)
+    walk(context.view_layer.layer_collection)
+    return buildings
+
+def set_group_input(modifier, name, value):
+    # Geometry nodes modifiers store their inputs under the socket identifier
+    tree = modifier.node_group
+    sockets = tree.interface.items_tree if hasattr(tree, "interface") else tree.inputs
+    for socket in sockets:
+        if getattr(socket, "in_out", 'INPUT') == 'INPUT' and socket.name == name:
+            modifier[socket.identifier] = value
+
+def building_layers(context):
+    # Sorted layer ids of all imported buildings, from the layer collections and the instancer points
+    layers = set()
+    for building in anker_buildings(context):
+        for child in building.children:
+            if child.collection.get("ankerLayer") is not None:
+                layers.add(child.collection["ankerLayer"])
+        for o in building.collection.objects:
+            if o.modifiers.get("AnkerInstancer") and "layer" in o.data.attributes:
+                values = numpy.empty(len(o.data.vertices), dtype=numpy.int32)
+                o.data.attributes["layer"].data.foreach_get("value", values)
+                layers.update(numpy.unique(values).tolist())
+    return sorted(layers)
+
+def show_layers(context, first, last):
+    # Shows the stones of the layers first to last by switching the layer collections
+    buildings = anker_buildings(context)
+    for building in buildings:
+        for child in building.children:
+            layer = child.collection.get("ankerLayer")
+            if layer is not None:
+                hidden = not (first <= layer <= last)
+                child.hide_viewport = hidden
+                child.collection.hide_render = hidden
+        for o in building.collection.objects:
+            modifier = o.modifiers.get("AnkerInstancer")
+            if modifier:
+                set_group_input(modifier, "Layer From", first)
+                set_group_input(modifier, "Layer To", last)
+                o.update_tag()
+    if not buildings:
+        # Buildings imported before the layer collections only know the layer of each stone
+        for o in context.scene.objects:
+            if o.get('layer') is not None:
+                o.hide_set(not (first <= int(o.get('layer')) <= last))
+
+
 def setupRendering(preset):
     if preset == "REALISTIC_EEVEE":
         bpy.context.scene.render.engine = 'BLENDER_EEVEE'
@@ -211,9 +286,72 @@ def setupHDRI(name):
     bpy.context.scene.render.film_transparent = True
 
 
-def position_cam(cam, angleH=45, angleV=-15):
-    cam.rotation_euler = Euler((math.radians(90 + angleV), math.radians(0), math.radians(angleH)))
-    bpy.ops.view3d.camera_to_view_selected()
+def camera_rotation(angleH=45, angleV=-15):
+    return Euler((math.radians(90 + angleV), math.radians(0), math.radians(angleH)))
+
+def view_tangents(camera, scene):
+    # Half the view width and height at distance 1 and the one of the two the sensor (or ortho scale) is fitted to
+    render = scene.render
+    aspect = (render.resolution_x * render.pixel_aspect_x) / (render.resolution_y * render.pixel_aspect_y)
+    fit = camera.sensor_fit
+    if fit == 'AUTO':
+        fit = 'HORIZONTAL' if aspect >= 1 else 'VERTICAL'
+    if fit == 'HORIZONTAL':
+        tx = camera.sensor_width / (2 * camera.lens)
+        return tx, tx / aspect, tx
+    ty = (camera.sensor_height if camera.sensor_fit == 'VERTICAL' else camera.sensor_width) / (2 * camera.lens)
+    return ty * aspect, ty, ty
+
+def frame_bounds(camera, bounds, angles, margin=0, scene=None):
+    # Camera placements fitting the world bounds into the view, without selection or a 3D view.
+    # Returns (location, rotation, ortho scale, far distance) for every (angleH, angleV), the scale is None for perspective cameras.
+    scene = scene or bpy.context.scene
+    lo = numpy.array(bounds[0]) - margin / 2
+    hi = numpy.array(bounds[1]) + margin / 2
+    center = (lo + hi) / 2
+    corners = box_corners(lo, hi) - center
+    tx, ty, fit = view_tangents(camera, scene)
+    framings = []
+    for angleH, angleV in angles:
+        rotation = camera_rotation(angleH, angleV)
+        matrix = numpy.array(rotation.to_matrix())
+        # Corners in camera space, the camera looks along -Z
+        x, y, z = (corners @ matrix).T
+        if camera.type == 'ORTHO':
+            offset = numpy.array(((x.max() + x.min()) / 2, (y.max() + y.min()) / 2, z.max() + 2 * camera.clip_start))
+            scale = max((x.max() - x.min()) * fit / tx, (y.max() - y.min()) * fit / ty)
+        else:
+            # Smallest distance keeping every corner inside the frustum, the camera is shifted sideways to balance both sides
+            (ax, bx), (ay, by) = [((v / t + z).max(), (-v / t + z).max()) for v, t in ((x, tx), (y, ty))]
+            offset = numpy.array((tx * (ax - bx) / 2, ty * (ay - by) / 2, max(ax + bx, ay + by) / 2))
+            scale = None
+        framings.append((Vector(center + matrix @ offset), rotation, scale, offset[2] - z.min()))
+    return framings
+
+def apply_framing(cam, framing):
+    (location, rotation, scale, far) = framing
+    cam.location = location
+    cam.rotation_euler = rotation
+    if scale is not None:
+        cam.data.ortho_scale = scale
+    # Keep the far side of the building in front of the clipping distance
+    cam.data.clip_end = max(cam.data.clip_end, far * 1.01)
+
+def framed_objects(context):
+    # The selection, otherwise the imported buildings, otherwise everything that renders
+    objects = [o for o in context.selected_objects if o.type not in ('CAMERA', 'LIGHT')]
+    objects = objects or [o for o in context.scene.objects if o.get("ankerCollection")]
+    return objects or [o for o in context.scene.objects if o.type not in ('CAMERA', 'LIGHT') and not o.hide_render]
+
+def position_cam(cam, angleH=45, angleV=-15, bounds=None, margin=0):
+    # Frames the bounds (the selection by default) from the given angles
+    if bounds is None:
+        objects = framed_objects(bpy.context)
+        if not objects:
+            cam.rotation_euler = camera_rotation(angleH, angleV)
+            return
+        bounds = get_bounds(objects)
+    apply_framing(cam, frame_bounds(cam.data, bounds, [(angleH, angleV)], margin)[0])
 
 
 def add_cam(name="RenderCam"):
@@ -225,46 +363,71 @@ def add_cam(name="RenderCam"):
     else:
         return bpy.context.collection.objects.get(name)
 
-def column_func(vectors, column=0, func = min):
-    els = [el[column] for el in vectors]
-    res = func(els)
-    return round(res, 6)
-
-def get_bottom_left(objects):
-    edges = [o.location - o.dimensions / 2 for o in objects]
-    res = Vector(( column_func(edges,0,min), column_func(edges,1,min), column_func(edges,2,min)    ))
-    return res
-
-def get_top_right(objects):
-    edges = [o.location + o.dimensions / 2 for o in objects]
-    res = Vector(( column_func(edges,0,max), column_func(edges,1,max), column_func(edges,2,max)    ))
-    return res
+def box_corners(lo, hi):
+    return numpy.array(list(itertools.product(*zip(lo, hi))))
+
+def local_corners(ob, cache):
+    # Corners of the local bounding box, read once per mesh. Objects whose bounding box
+    # doesn't cover what they show (i.e. instancers) store their own in "bounds"
+    if ob.get("bounds"):
+        return box_corners(*ob["bounds"])
+    key = ob.data if ob.data is not None else ob
+    if key not in cache:
+        cache[key] = numpy.array(ob.bound_box)
+    return cache[key]
+
+def world_matrix(ob):
+    # matrix_world is only updated by the depsgraph, freshly created objects still have the identity there
+    if ob.parent is None:
+        return ob.matrix_basis
+    return world_matrix(ob.parent) @ ob.matrix_parent_inverse @ ob.matrix_basis
+
+def transform_bounds(corners, matrices):
+    # World aligned bounds of (n, 8, 3) local corners transformed by (n, 4, 4) matrices
+    points = numpy.einsum('nij,nkj->nki', matrices[:, :3, :3], corners) + matrices[:, None, :3, 3]
+    points = points.reshape(-1, 3)
+    return points.min(axis=0), points.max(axis=0)
 
 def get_bounds(objects):
-    min = get_bottom_left(objects)
-    max = get_top_right(objects)
-    return (min,max)
-
-def get_center(objects):
-    (min, max) =get_bounds(objects)
+    cache = {}
+    corners = numpy.array([local_corners(o, cache) for o in objects])
+    matrices = numpy.array([world_matrix(o) for o in objects])
+    (lo, hi) = transform_bounds(corners, matrices)
+    return (Vector(numpy.round(lo, 6)), Vector(numpy.round(hi, 6)))
+
+def store_bounds(ob, bounds):
+    # Keeps world bounds in the local space of ob, so they move along with it
+    inverse = numpy.linalg.inv(numpy.array(world_matrix(ob)))
+    (lo, hi) = transform_bounds(box_corners(*bounds)[None], inverse[None])
+    ob["bounds"] = [list(lo), list(hi)]
+
+def get_bottom_left(objects, bounds=None):
+    return (bounds or get_bounds(objects))[0]
+
+def get_top_right(objects, bounds=None):
+    return (bounds or get_bounds(objects))[1]
+
+def get_center(objects, bounds=None):
+    (min, max) = bounds or get_bounds(objects)
     center = Vector (( (min.x+max.x)/2, (min.y+max.y)/2, (min.z+max.z)/2))
     return center
 
-def get_bottom_center(objects):
-    (min, max) =get_bounds(objects)
+def get_bottom_center(objects, bounds=None):
+    (min, max) = bounds or get_bounds(objects)
     center = Vector (( (min.x+max.x)/2, (min.y+max.y)/2, min.z))
     return center
 
-def get_dimensions(objects):
-    (min, max) =get_bounds(objects)
+def get_dimensions(objects, bounds=None):
+    (min, max) = bounds or get_bounds(objects)
     res = max-min
     return res
 
-def enclose(objects, name="enclosing", margin=0):
+def enclose(objects, name="enclosing", margin=0, bounds=None):
     if objects:
+        bounds = bounds or get_bounds(objects)
         # Get location and dimensions of objects
-        loc = get_center(objects)
-        dim = get_dimensions(objects)
+        loc = get_center(objects, bounds)
+        dim = get_dimensions(objects, bounds)
         # Calculate dimension and base of enclosure
         full_dim = dim + Vector((margin, margin, margin/2))
         base = Vector((loc.x, loc.y, loc.z - full_dim.z/2 + margin/4))
@@ -281,9 +444,12 @@ def enclose(objects, name="enclosing", margin=0):
         enclosing.name = name
         return enclosing
 
-def center_relative(objects, relative_to_vector):
+def center_relative(objects, relative_to_vector, bounds=None):
+    # Moves the objects and returns their moved bounds
     if objects:
-        center = get_bottom_center(objects)
+        bounds = bounds or get_bounds(objects)
+        center = get_bottom_center(objects, bounds)
         delta  = center - relative_to_vector
         for obj in objects:
             obj.location = obj.location - delta
+        return (bounds[0] - delta, bounds[1] - delta)
@@ -0,0 +1,637 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ benchmarks
+
+Run inside Blender in background mode, arguments go after the "--":
+
+    blender -b --python scripts/benchmark.py -- reader examples/GKAF11_17_Kirche_(Richter).asq
+
+Each benchmark prints a small table with wall time and peak python memory.
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+import tracemalloc
+import sqlite3
+import shutil
+import tempfile
+import math
+import itertools
+import random
+import json
+import glob
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.dirname(ADDON_DIRECTORY))
+loadasq = importlib.import_module(os.path.basename(ADDON_DIRECTORY) + ".loadasq.loadasq")
+previews = importlib.import_module(os.path.basename(ADDON_DIRECTORY) + ".loadasq.previews")
+catalog = importlib.import_module(os.path.basename(ADDON_DIRECTORY) + ".loadasq.catalog")
+utils = importlib.import_module(os.path.basename(ADDON_DIRECTORY) + ".operators.utils")
+
+EXAMPLE = os.path.join(ADDON_DIRECTORY, "examples", "GKAF11_17_Kirche_(Richter).asq")
+
+# **************************************************************************************
+def measure(func, *args):
+    # Returns (result, seconds, peak bytes) of a single call
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+# **************************************************************************************
+def printRow(name, count, seconds, peak, unit="stones"):
+    print("{0:<24} {1:>8} {2:<8} {3:>10.1f} ms {4:>10.1f} KiB".format(name, count, unit, seconds*1000, peak/1024))
+
+# **************************************************************************************
+def legacyReader(file):
+    # The fetchall + dict per row reader loadBricksFromAsq used before streaming
+    searchSQL = """SELECT BuildingShapePlacement.ShapeId, BuildingShapePlacement.PositionX, BuildingShapePlacement.PositionY, BuildingShapePlacement.PositionZ, BuildingShapePlacement.RotationW,BuildingShapePlacement.RotationX,BuildingShapePlacement.RotationY,BuildingShapePlacement.RotationZ, Material.KeyCode, IFNULL(LayerShapePlacement.LayerId, 0)
+    FROM BuildingShapePlacement
+    LEFT JOIN LayerShapePlacement on BuildingShapePlacement.BuildingShapePlacementId=LayerShapePlacement.BuildingShapePlacementId
+    LEFT JOIN Material on BuildingShapePlacement.MaterialId = Material.MaterialId
+    WHERE BuildingShapePlacement.BuildingId=1
+    """
+    keys = ["shapeId","x","y","z","rw","rx","ry","rz","material","layer"]
+    with sqlite3.connect(file) as conn:
+        stones = conn.execute(searchSQL).fetchall()
+    return list(map(lambda stone: dict(zip(keys, stone)), stones))
+
+# **************************************************************************************
+def streamingReader(file):
+    # Consume the stream the way the pipeline does, one batch alive at a time
+    count = 0
+    for batch in loadasq.loadBricksFromAsq(file):
+        count += len(batch)
+    return count
+
+# **************************************************************************************
+def benchReader(args):
+    loadasq.Options.verbose = 0
+    for file in args.files:
+        print(file)
+        stones, seconds, peak = measure(legacyReader, file)
+        printRow("fetchall + dict", len(stones), seconds, peak)
+        del stones
+        count, seconds, peak = measure(streamingReader, file)
+        printRow("streaming batches", count, seconds, peak)
+
+# **************************************************************************************
+def legacyTransform(asqStones):
+    # The per stone mathutils conversion asqToBlenderCoordinates used before vectorizing
+    from mathutils import Euler, Quaternion
+    result = []
+    for stone in asqStones:
+        quaternion = Quaternion((stone.rw, stone.rx, stone.ry, stone.rz))
+        quaternion.rotate(Euler((math.radians(90), 0, 0)))
+        euler = quaternion.to_euler()
+        location = (round(stone.x/1000, 6), round(stone.z/-1000, 6), round(stone.y/1000, 6))
+        result.append((location, euler))
+    return result
+
+# **************************************************************************************
+def syntheticStones(count, seed=0):
+    # Random placements with arbitrary rotations, for scaling beyond the example file
+    rnd = random.Random(seed)
+    stones = []
+    for i in range(count):
+        position = [rnd.uniform(-5000, 5000) for _ in range(3)]
+        rotation = [rnd.gauss(0, 1) for _ in range(4)]
+        stones.append(loadasq.AsqStone("GKNF1", *position, *rotation, "g", 0, i, 1))
+    return stones
+
+# **************************************************************************************
+def benchTransform(args):
+    loadasq.Options.verbose = 0
+    for count in args.counts:
+        stones = syntheticStones(count)
+        legacy, seconds, peak = measure(legacyTransform, stones)
+        printRow("mathutils per stone", count, seconds, peak)
+        placements, seconds, peak = measure(loadasq.asqToBlenderArrays, stones)
+        printRow("numpy vectorized", count, seconds, peak)
+        # Compare rotation matrices, eulers may legitimately wrap around at +-pi
+        deviation = max(
+            max(abs(a - b) for a, b in zip(itertools.chain(*old[1].to_matrix()), new.flat))
+            for old, new in zip(legacy, placements.matrix)
+        )
+        print("{0:<24} {1:.2e}".format("max rotation deviation", deviation))
+
+# **************************************************************************************
+def resetScene():
+    # Start every run from an empty file, so runs don't share objects or meshes
+    import bpy
+    bpy.ops.wm.read_homefile(use_empty=True)
+
+# **************************************************************************************
+def importBuilding(file, importMode):
+    import bpy
+    loadasq.Options.importMode = importMode
+    loadasq.Options.buildCache = False
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    return loadasq.loadFromFile(bpy.context, file)
+
+# **************************************************************************************
+def benchStages(args):
+    # Stage breakdown of full imports, as recorded by the import profiler
+    loadasq.Options.verbose = 0
+    for file in args.files:
+        for importMode in args.modes:
+            resetScene()
+            importBuilding(file, importMode)
+            print("{0} ({1})".format(file, importMode))
+            for line in loadasq.profiler.lines():
+                print("  " + line)
+            if args.json:
+                loadasq.profiler.dump("{0}.{1}.profile.json".format(os.path.splitext(file)[0], importMode))
+
+# **************************************************************************************
+def evaluateScene():
+    # Depsgraph evaluation is what every viewport redraw after an edit has to pay
+    import bpy
+    bpy.context.view_layer.update()
+    return bpy.context.evaluated_depsgraph_get()
+
+# **************************************************************************************
+def benchModes(args):
+    import bpy
+    loadasq.Options.verbose = 0
+    for file in args.files:
+        print(file)
+        for importMode in args.modes:
+            resetScene()
+            _, seconds, peak = measure(importBuilding, file, importMode)
+            printRow("import " + importMode, len(bpy.data.objects), seconds, peak, "objects")
+            _, seconds, peak = measure(evaluateScene)
+            printRow("evaluate " + importMode, len(bpy.data.meshes), seconds, peak, "meshes")
+
+# **************************************************************************************
+def residentMemory():
+    # Current resident set size of the process in bytes (Linux), peak size elsewhere
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# **************************************************************************************
+def tiledPlacements(file, copies):
+    # The placements of the file repeated on a grid, to scale an example up
+    import numpy
+    base = loadasq.collectPlacements(loadasq.asqToBlender(loadasq.loadBricksFromAsq(file)))
+    size = base.location.max(axis=0) - base.location.min(axis=0) + 0.1
+    side = math.ceil(math.sqrt(copies))
+    ids = base.placement.max() + 1
+    return [
+        base._replace(location=base.location + size * (i % side, i // side, 0), placement=base.placement + i * ids)
+        for i in range(copies)
+    ]
+
+# **************************************************************************************
+def benchSharing(args):
+    import bpy
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    for copies in args.copies:
+        for link in (False, True):
+            resetScene()
+            loadasq.linkLibrary()
+            placements = tiledPlacements(args.file, copies)
+            meshes = len(bpy.data.meshes)
+            memory = residentMemory()
+            loadasq.Options.link = link
+            start = time.perf_counter()
+            loadasq.buildBuilding("Building", placements)
+            seconds = time.perf_counter() - start
+            name = "shared meshes" if link else "mesh copies"
+            print("{0:<24} {1:>8} stones {2:>8} meshes {3:>10.1f} ms {4:>10.1f} MiB".format(
+                name, sum(len(p.shapeId) for p in placements), len(bpy.data.meshes) - meshes,
+                seconds*1000, (residentMemory() - memory)/1024/1024))
+
+# **************************************************************************************
+def benchLibrary(args):
+    import bpy
+    loadasq.Options.verbose = 0
+    for file in args.files:
+        print(file)
+        shapeIds, materialKeys = loadasq.loadRequirementsFromAsq(file)
+        templateNames = {"{0}_{1}".format(loadasq.hotStoneId(s), loadasq.Options.stoneLib) for s in shapeIds}
+        materialNames = {"Anker_{0}_{1}".format(k, loadasq.Options.materialLib) for k in materialKeys}
+        for name, required in (("whole library", (None, None)), ("used stones only", (templateNames, materialNames))):
+            resetScene()
+            memory = residentMemory()
+            templates, seconds, peak = measure(loadasq.linkLibrary, *required)
+            print("{0:<24} {1:>8} stones {2:>8} materials {3:>10.1f} ms {4:>10.1f} MiB".format(
+                name, len(templates), len(bpy.data.materials), seconds*1000, (residentMemory() - memory)/1024/1024))
+
+# **************************************************************************************
+def benchCache(args):
+    loadasq.Options.verbose = 0
+    loadasq.Options.useCache = True
+    loadasq.Options.cacheDirectory = tempfile.mkdtemp(prefix="importasq_cache_")
+    try:
+        for file in args.files:
+            print(file)
+            shapeIds, materialKeys = loadasq.loadRequirementsFromAsq(file)
+            templateNames = {"{0}_{1}".format(loadasq.hotStoneId(s), loadasq.Options.stoneLib) for s in shapeIds}
+            materialNames = {"Anker_{0}_{1}".format(k, loadasq.Options.materialLib) for k in materialKeys}
+            shutil.rmtree(loadasq.Options.cacheDirectory, ignore_errors=True)
+            for name in ("cold start", "warm start"):
+                resetScene()
+                loadasq.profiler.reset()
+                templates, seconds, peak = measure(loadasq.linkLibrary, templateNames, materialNames)
+                printRow(name, len(templates), seconds, peak)
+                # The warm start builds stones and materials from the cache without opening the library
+                print("{0:<24} {1:>8}".format("library opened", loadasq.profiler.counts.get("library loads", 0)))
+    finally:
+        shutil.rmtree(loadasq.Options.cacheDirectory, ignore_errors=True)
+
+# **************************************************************************************
+def benchBuildCache(args):
+    # Full import against appending the cached building, for every import mode
+    import bpy
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    loadasq.Options.buildCache = True
+    loadasq.Options.cacheDirectory = tempfile.mkdtemp(prefix="importasq_cache_")
+    try:
+        for file in args.files:
+            print(file)
+            for importMode in args.modes:
+                loadasq.Options.importMode = importMode
+                loadasq.clearBuildCache()
+                for name in ("build", "cached"):
+                    resetScene()
+                    _, seconds, peak = measure(loadasq.loadFromFile, bpy.context, file)
+                    printRow("{0} {1}".format(importMode, name), len(bpy.data.objects), seconds, peak, "objects")
+    finally:
+        shutil.rmtree(loadasq.Options.cacheDirectory, ignore_errors=True)
+
+# **************************************************************************************
+def legacyApply(objects, scale):
+    # The select + transform_apply operator path applyScaleAndRotation used before
+    import bpy
+    bpy.ops.object.select_all(action='DESELECT')
+    for ob in objects:
+        ob.select_set(True)
+    bpy.ops.object.transform_apply(location=False, rotation=True, scale=scale)
+    bpy.ops.object.select_all(action='DESELECT')
+
+# **************************************************************************************
+def benchApply(args):
+    loadasq.Options.verbose = 0
+    loadasq.Options.link = False
+    for count in args.counts:
+        for name, apply in (("transform_apply", legacyApply), ("data api", loadasq.applyScaleAndRotation)):
+            resetScene()
+            loadasq.linkLibrary()
+            copies = max(1, round(count / len(tiledPlacements(args.file, 1)[0].shapeId)))
+            placements = map(loadasq.hotStonesReplace, tiledPlacements(args.file, copies))
+            objects = loadasq.createBrickObjects(loadasq.iterBlenderStones(placements), loadasq.createBuildingCollection("Building"))
+            _, seconds, peak = measure(apply, objects, False)
+            printRow(name, len(objects), seconds, peak)
+
+# **************************************************************************************
+def editedPlacements(placements, fraction):
+    # A small edit of a building: a fraction of the stones moved and as many removed
+    import numpy
+    batches = []
+    for p in placements:
+        count = max(1, int(len(p.shapeId) * fraction))
+        location = p.location.copy()
+        location[:count] += (0.0, 0.0, 0.01)
+        batches.append(loadasq.BlenderPlacements(*(column[:-count] for column in p._replace(location=location))))
+    return batches
+
+# **************************************************************************************
+def benchUpdate(args):
+    # Full import of a large building against updating it after a small edit
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    loadasq.Options.importMode = "objects"
+    resetScene()
+    placements = tiledPlacements(args.file, args.copies)
+    count = sum(len(p.shapeId) for p in placements)
+    loadasq.linkLibrary()
+    _, seconds, peak = measure(loadasq.buildBuilding, "Building", placements)
+    printRow("full import", count, seconds, peak)
+    building, parent = loadasq.findBuilding("Building")
+    edited = editedPlacements(placements, args.fraction)
+    _, seconds, peak = measure(loadasq.updateBuilding, building, parent, edited)
+    printRow("update after edit", count, seconds, peak)
+    _, seconds, peak = measure(loadasq.updateBuilding, building, parent, edited)
+    printRow("update unchanged", count, seconds, peak)
+
+# **************************************************************************************
+def benchSwap(args):
+    # Switching a large building between the realistic and the instruction look, against importing it again
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    for mode in args.modes:
+        for link in ((False, True) if mode == "objects" else (False,)):
+            resetScene()
+            loadasq.Options.importMode = mode
+            loadasq.Options.link = link
+            loadasq.Options.stoneLib = loadasq.Options.materialLib = "realistic"
+            placements = tiledPlacements(args.file, args.copies)
+            count = sum(len(p.shapeId) for p in placements)
+            shapeIds = set(itertools.chain.from_iterable(p.shapeId.tolist() for p in placements))
+            materialKeys = set(itertools.chain.from_iterable(p.material.tolist() for p in placements))
+            name = mode if mode != "objects" else "objects shared" if link else "objects copies"
+            _, seconds, peak = measure(loadasq.buildBuilding, "Building", placements, shapeIds, materialKeys)
+            printRow(name + " import", count, seconds, peak)
+            building, parent = loadasq.findBuilding("Building")
+            # The swaps load what they need themselves, the first one of each library includes its loading
+            for stoneLib, materialLib in (("instruction", "instruction"), ("realistic", "realistic"), (None, "noise")):
+                _, seconds, peak = measure(loadasq.swapLibrary, building, parent, stoneLib, materialLib)
+                printRow("{0} to {1}/{2}".format(name, stoneLib or "-", materialLib), count, seconds, peak)
+
+# **************************************************************************************
+def benchDetail(args):
+    # Switch time, depsgraph evaluation and vertices to draw or render with full stones and proxies
+    import bpy
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    loadasq.Options.importMode = "objects"
+    loadasq.Options.link = True
+    resetScene()
+    loadasq.linkLibrary()
+    placements = tiledPlacements(args.file, args.copies)
+    count = sum(len(p.shapeId) for p in placements)
+    loadasq.buildBuilding("Building", placements)
+    scene = bpy.context.scene
+    for name, detail, proxyType in (("full", "FULL", "box"), ("box", "PROXY", "box"), ("hull", "PROXY", "hull"), ("full again", "FULL", "box")):
+        _, seconds, _ = measure(loadasq.applyDetail, scene, detail, 0, proxyType)
+        start = time.perf_counter()
+        evaluateScene()
+        evaluation = time.perf_counter() - start
+        vertices = sum(len(ob.data.vertices) for ob in scene.objects if ob.type == 'MESH' and "instancedata" in ob)
+        print("{0:<12} {1:>8} stones {2:>10.1f} ms switch {3:>10.1f} ms evaluate {4:>12} vertices".format(
+            name, count, seconds*1000, evaluation*1000, vertices))
+
+# **************************************************************************************
+def benchCamera(args):
+    # Framing a building from many angles with the cached bounds, in background mode without selection or 3D view
+    loadasq.Options.verbose = 0
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = False
+    loadasq.Options.clearScene = False
+    resetScene()
+    loadasq.linkLibrary()
+    parent = loadasq.buildBuilding("Building", tiledPlacements(args.file, args.copies))
+    cam = utils.add_cam()
+    angles = [(360 * i / args.angles, -15 - 45 * (i % 3) / 2) for i in range(args.angles)]
+    _, seconds, peak = measure(utils.get_bounds, [parent])
+    printRow("bounds", 1, seconds, peak, unit="parents")
+    for cameraType in ("PERSP", "ORTHO"):
+        cam.data.type = cameraType
+        bounds = utils.get_bounds([parent])
+        framings, seconds, peak = measure(utils.frame_bounds, cam.data, bounds, angles, loadasq.Options.cameraMargin*int(loadasq.Options.magnification))
+        printRow(cameraType.lower() + " framing", len(framings), seconds, peak, unit="angles")
+        _, seconds, peak = measure(lambda: [utils.apply_framing(cam, framing) for framing in framings])
+        printRow(cameraType.lower() + " apply", len(framings), seconds, peak, unit="angles")
+
+# **************************************************************************************
+def benchScan(args):
+    # Scanning a folder of buildings for previews and metadata with an empty and a filled thumbnail cache
+    with tempfile.TemporaryDirectory() as directory:
+        folder = args.folder
+        if folder is None:
+            folder = os.path.join(directory, "buildings")
+            os.makedirs(folder)
+            for i in range(args.copies):
+                shutil.copy(EXAMPLE, os.path.join(folder, "building_{0:04d}.asq".format(i)))
+        cache = os.path.join(directory, "previews")
+        for name in ("empty cache", "filled cache"):
+            entries, seconds, peak = measure(previews.scanFolder, folder, cache)
+            printRow(name, len(entries), seconds, peak, unit="files")
+
+# **************************************************************************************
+def benchCatalog(args):
+    # Indexing a folder into the catalog, then scanning it again unchanged and with a tenth of the files touched
+    with tempfile.TemporaryDirectory() as directory:
+        folder = args.folder
+        if folder is None:
+            folder = os.path.join(directory, "buildings")
+            os.makedirs(folder)
+            for i in range(args.copies):
+                shutil.copy(EXAMPLE, os.path.join(folder, "building_{0:04d}.asq".format(i)))
+        conn = catalog.openCatalog(os.path.join(directory, "catalog.sqlite"))
+        files = sorted(glob.glob(os.path.join(folder, "**", "*.asq"), recursive=True))
+        for name in ("empty catalog", "unchanged", "touched"):
+            if name == "touched":
+                for file in files[::10]:
+                    os.utime(file)
+            (read, skipped, removed), seconds, peak = measure(catalog.scanDirectory, conn, folder, True, args.workers)
+            printRow(name, read + skipped, seconds, peak, unit="files")
+        stoneSetIds = [row[0] for row in catalog.stoneSets(conn)][:1]
+        buildings, seconds, peak = measure(catalog.buildableWith, conn, stoneSetIds * 4, False, 10)
+        printRow("buildable", len(buildings), seconds, peak, unit="found")
+        conn.close()
+
+# **************************************************************************************
+def benchScaling(args):
+    # Import time, memory and their breakdown per stage of generated buildings of growing size.
+    # The results can be saved and compared against a saved baseline.
+    import bpy
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import generate_asq
+    loadasq.Options.verbose = 0
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r["stones"], r["mode"]): r for r in json.load(f)}
+    results = []
+    work = tempfile.mkdtemp(prefix="importasq_scaling_")
+    # Every stage also books the resident memory it grew by
+    loadasq.profiler.memory = residentMemory
+    try:
+        for stones in args.sizes:
+            file = os.path.join(work, "generated_{0}.asq".format(stones))
+            generate_asq.generateAsq(file, stones, seed=args.seed)
+            for importMode in args.modes:
+                resetScene()
+                memory = residentMemory()
+                importBuilding(file, importMode)
+                result = loadasq.profiler.toDict()
+                result.update(stones=stones, mode=importMode, memory=residentMemory() - memory, objects=len(bpy.data.objects))
+                results.append(result)
+                line = "{0:>8} stones {1:<10} {2:>10.1f} ms {3:>8.1f} MiB {4:>8} objects".format(
+                    stones, importMode, result["total"]*1000, result["memory"]/1024/1024, result["objects"])
+                if (stones, importMode) in baseline:
+                    line += " {0:>+8.1f} %".format((result["total"] / baseline[(stones, importMode)]["total"] - 1) * 100)
+                print(line)
+                stages = sorted(result["stages"].items(), key=lambda item: -item[1]["seconds"])
+                print("    " + ", ".join("{0} {1:.1f} ms {2:+.1f} MiB".format(name, stage["seconds"]*1000, stage["bytes"]/1024/1024)
+                    for name, stage in stages))
+    finally:
+        loadasq.profiler.memory = None
+        shutil.rmtree(work, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+# **************************************************************************************
+def benchConvert(args):
+    # Throughput of the batch converter over a folder, for several worker counts
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import convert
+    parser = argparse.ArgumentParser()
+    convert.addOptions(parser)
+    options = parser.parse_args(["--format", args.format])
+    options.blender = convert.blenderBinary()
+    options.timeout = 600
+    options.recursive = False
+    for workers in args.workers:
+        options.workers = workers
+        output = tempfile.mkdtemp(prefix="importasq_convert_")
+        try:
+            converted, failed, seconds = convert.convertFolder(args.folder, output, options, verbose=False)
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+        print("{0:>3} workers {1:>6} files {2:>4} failed {3:>10.1f} s {4:>10.1f} files/min".format(
+            workers, len(converted), len(failed), seconds, len(converted) / seconds * 60 if seconds else 0))
+
+# **************************************************************************************
+def benchInstructions(args):
+    # Wall time of rendering all layer steps of one building, for several process counts
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import render_instructions
+    options = argparse.Namespace(blender=render_instructions.convert.blenderBinary(), timeout=3600,
+        stoneLib="instruction", materialLib="instruction", importMode="objects", preset="INSTRUCTIONS_EEVEE")
+    work = tempfile.mkdtemp(prefix="importasq_instructions_")
+    try:
+        scene = render_instructions.sceneFile(args.file, work, options)
+        for workers in args.workers:
+            options.workers = workers
+            output = os.path.join(work, "steps_{0}".format(workers))
+            failed, seconds = render_instructions.renderInstructions(scene, output, options)
+            steps = len(os.listdir(output))
+            print("{0:>3} processes {1:>6} steps {2:>4} failed {3:>10.1f} s {4:>10.2f} s/step".format(
+                workers, steps, len(failed), seconds, seconds / steps if steps else 0))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+# **************************************************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reader = commands.add_parser("reader", help="Compare the streaming .asq reader with fetchall")
+    reader.add_argument("files", nargs="*", default=[EXAMPLE])
+    reader.set_defaults(func=benchReader)
+
+    transform = commands.add_parser("transform", help="Compare the vectorized coordinate conversion with mathutils")
+    transform.add_argument("counts", nargs="*", type=int, default=[1000, 10000, 100000])
+    transform.set_defaults(func=benchTransform)
+
+    modes = commands.add_parser("modes", help="Compare import and evaluation time of the import modes")
+    modes.add_argument("files", nargs="*", default=[EXAMPLE])
+    modes.add_argument("--modes", nargs="+", default=["objects", "instances", "merged"])
+    modes.set_defaults(func=benchModes)
+
+    stages = commands.add_parser("stages", help="Time spent in every import stage")
+    stages.add_argument("files", nargs="*", default=[EXAMPLE])
+    stages.add_argument("--modes", nargs="+", default=["objects", "instances", "merged"])
+    stages.add_argument("--json", action="store_true", help="Also write the timings next to every file")
+    stages.set_defaults(func=benchStages)
+
+    sharing = commands.add_parser("sharing", help="Compare mesh count and memory of shared and copied stone meshes")
+    sharing.add_argument("file", nargs="?", default=EXAMPLE)
+    sharing.add_argument("--copies", nargs="+", type=int, default=[1, 10, 100])
+    sharing.set_defaults(func=benchSharing)
+
+    library = commands.add_parser("library", help="Compare appending the whole library with the stones a file uses")
+    library.add_argument("files", nargs="*", default=[EXAMPLE])
+    library.set_defaults(func=benchLibrary)
+
+    cache = commands.add_parser("cache", help="Compare linking stones and materials with an empty and a filled cache")
+    cache.add_argument("files", nargs="*", default=[EXAMPLE])
+    cache.set_defaults(func=benchCache)
+
+    buildcache = commands.add_parser("buildcache", help="Compare a full import with appending the building from the import cache")
+    buildcache.add_argument("files", nargs="*", default=[EXAMPLE])
+    buildcache.add_argument("--modes", nargs="+", default=["objects", "instances", "merged"])
+    buildcache.set_defaults(func=benchBuildCache)
+
+    apply = commands.add_parser("apply", help="Compare applying the stone rotations with the operator and the data api")
+    apply.add_argument("file", nargs="?", default=EXAMPLE)
+    apply.add_argument("--counts", nargs="+", type=int, default=[1000, 10000, 50000])
+    apply.set_defaults(func=benchApply)
+
+    update = commands.add_parser("update", help="Compare a full import with updating the building after a small edit")
+    update.add_argument("file", nargs="?", default=EXAMPLE)
+    update.add_argument("--copies", type=int, default=150)
+    update.add_argument("--fraction", type=float, default=0.01)
+    update.set_defaults(func=benchUpdate)
+
+    swap = commands.add_parser("swap", help="Compare switching the stone and material library in place with importing again")
+    swap.add_argument("file", nargs="?", default=EXAMPLE)
+    swap.add_argument("--copies", type=int, default=150)
+    swap.add_argument("--modes", nargs="+", default=["objects", "instances", "merged"])
+    swap.set_defaults(func=benchSwap)
+
+    detail = commands.add_parser("detail", help="Compare full stones with box and hull proxies")
+    detail.add_argument("file", nargs="?", default=EXAMPLE)
+    detail.add_argument("--copies", type=int, default=150)
+    detail.set_defaults(func=benchDetail)
+
+    camera = commands.add_parser("camera", help="Framing a building from many angles with the cached bounds")
+    camera.add_argument("file", nargs="?", default=EXAMPLE)
+    camera.add_argument("--copies", type=int, default=1)
+    camera.add_argument("--angles", type=int, default=360)
+    camera.set_defaults(func=benchCamera)
+
+    scan = commands.add_parser("scan", help="Compare scanning a folder for previews with an empty and a filled cache")
+    scan.add_argument("folder", nargs="?", default=None, help="Default is a folder of copies of the example")
+    scan.add_argument("--copies", type=int, default=500)
+    scan.set_defaults(func=benchScan)
+
+    indexer = commands.add_parser("catalog", help="Indexing a folder into the catalog, unchanged and touched rescans and a query")
+    indexer.add_argument("folder", nargs="?", default=None, help="Default is a folder of copies of the example")
+    indexer.add_argument("--copies", type=int, default=500)
+    indexer.add_argument("--workers", type=int, default=8)
+    indexer.set_defaults(func=benchCatalog)
+
+    scaling = commands.add_parser("scaling", help="Import time, memory and stages of generated buildings of growing size")
+    scaling.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    scaling.add_argument("--modes", nargs="+", default=["objects", "instances", "merged"])
+    scaling.add_argument("--seed", type=int, default=0)
+    scaling.add_argument("--output", help="Save the results as JSON")
+    scaling.add_argument("--baseline", help="Results saved before, totals are compared against them")
+    scaling.set_defaults(func=benchScaling)
+
+    converter = commands.add_parser("convert", help="Files per minute of the batch converter against the worker count")
+    converter.add_argument("folder", nargs="?", default=os.path.join(ADDON_DIRECTORY, "examples"))
+    converter.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+    converter.add_argument("--format", choices=["blend", "glb"], default="blend")
+    converter.set_defaults(func=benchConvert)
+
+    instructions = commands.add_parser("instructions", help="Wall time of the layer step renderer against the process count")
+    instructions.add_argument("file", nargs="?", default=EXAMPLE)
+    instructions.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    instructions.set_defaults(func=benchInstructions)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    main(argv)
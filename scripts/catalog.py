@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ catalog
+
+Indexes an archive of .asq files and answers questions about it without
+opening the files again. Needs no Blender, a plain python will do:
+
+    python scripts/catalog.py scan archive/
+    python scripts/catalog.py buildable "697:GKKlassik Serie:8" "697:GKKlassik Serie:8" --tolerance 5
+    python scripts/catalog.py shapes --limit 10
+    python scripts/catalog.py sets
+
+Scanning again only reads the files that changed since the last scan. The
+catalog is kept in the cache directory of the add-on unless --catalog is given.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ADDON_DIRECTORY)
+from loadasq import catalog
+
+# **************************************************************************************
+def scan(conn, options):
+    start = time.perf_counter()
+    read, skipped, removed = catalog.scanDirectory(conn, options.folder, not options.flat, options.workers)
+    print("{0} files read, {1} unchanged, {2} removed in {3:.2f} s".format(read, skipped, removed, time.perf_counter() - start))
+
+# **************************************************************************************
+def buildable(conn, options):
+    buildings = catalog.buildableWith(conn, options.sets, options.ignoreColors, options.tolerance)
+    for path, buildingId, name, missing in buildings:
+        print("{0:<40} {1:>4} {2:>6} missing  {3}".format(name or "", buildingId, missing, path))
+    print("{0} buildings".format(len(buildings)))
+
+# **************************************************************************************
+def shapes(conn, options):
+    for shapeId, stones, buildings in catalog.topShapes(conn, options.limit):
+        print("{0:<24} {1:>8} stones {2:>6} buildings".format(shapeId, stones, buildings))
+
+# **************************************************************************************
+def sets(conn, options):
+    for stoneSetId, stones, buildings in catalog.stoneSets(conn):
+        print("{0:<40} {1:>8} stones {2:>6} buildings".format(stoneSetId, stones, buildings))
+
+# **************************************************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(prog="catalog.py", description="Index and query a folder of .asq files")
+    parser.add_argument("--catalog", default=os.path.join(ADDON_DIRECTORY, "cache", "catalog.sqlite"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scanner = commands.add_parser("scan", help="Add the .asq files of a folder and its subfolders to the catalog")
+    scanner.add_argument("folder")
+    scanner.add_argument("--flat", action="store_true", help="Skip the subfolders")
+    scanner.add_argument("--workers", type=int, default=8)
+    scanner.set_defaults(func=scan)
+
+    feasible = commands.add_parser("buildable", help="Buildings that can be built with the stones of the given stone sets")
+    feasible.add_argument("sets", nargs="+", help="Stone set ids, give a set twice to own it twice")
+    feasible.add_argument("--ignore-colors", dest="ignoreColors", action="store_true", help="Count stones of any material")
+    feasible.add_argument("--tolerance", type=int, default=0, help="Also list buildings missing up to this many stones")
+    feasible.set_defaults(func=buildable)
+
+    top = commands.add_parser("shapes", help="The most used shapes")
+    top.add_argument("--limit", type=int, default=20)
+    top.set_defaults(func=shapes)
+
+    known = commands.add_parser("sets", help="The stone sets found in the catalog")
+    known.set_defaults(func=sets)
+
+    options = parser.parse_args(argv)
+    os.makedirs(os.path.dirname(os.path.abspath(options.catalog)), exist_ok=True)
+    conn = catalog.openCatalog(options.catalog)
+    try:
+        options.func(conn, options)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
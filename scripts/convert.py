@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ batch converter
+
+Converts every .asq file of a folder to a .blend or .glb file. The files are
+fanned out over several background Blender processes, one process per file,
+so a crashing building can't take the others down:
+
+    blender -b --python scripts/convert.py -- buildings/ converted/ --format glb --workers 4
+
+The driver doesn't need Blender itself, with a plain python --blender has to
+point to the Blender executable. Each worker is started as
+
+    blender -b --factory-startup --python scripts/convert.py -- --worker in.asq out.glb
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import importlib
+import subprocess
+import concurrent.futures
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SCRIPT = os.path.realpath(__file__)
+
+# **************************************************************************************
+def blenderBinary():
+    # The running Blender, when the driver itself runs inside Blender
+    try:
+        import bpy
+        return bpy.app.binary_path or "blender"
+    except ImportError:
+        return "blender"
+
+# **************************************************************************************
+def importLoadasq():
+    sys.path.insert(0, os.path.dirname(ADDON_DIRECTORY))
+    return importlib.import_module(os.path.basename(ADDON_DIRECTORY) + ".loadasq.loadasq")
+
+# **************************************************************************************
+def convertFile(file, output, options):
+    # Worker side, runs inside a background Blender
+    import bpy
+    loadasq = importLoadasq()
+    bpy.ops.wm.read_homefile(use_empty=True)
+    loadasq.Options.stoneLib = options.stoneLib
+    loadasq.Options.materialLib = options.materialLib
+    loadasq.Options.importMode = options.importMode
+    loadasq.Options.magnification = options.magnification
+    loadasq.Options.link = options.shareMeshes
+    loadasq.Options.clearScene = False
+    # The converted files are the cache, don't keep a second copy of every building
+    loadasq.Options.buildCache = False
+    loadasq.Options.setupCam = False
+    loadasq.Options.setupLighting = options.format == "blend"
+    if loadasq.loadFromFile(bpy.context, file) is None:
+        raise RuntimeError("Nothing imported from {0}".format(file))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if output.lower().endswith(".glb"):
+        bpy.ops.export_scene.gltf(filepath=output, export_format='GLB')
+    else:
+        bpy.ops.wm.save_as_mainfile(filepath=output)
+
+# **************************************************************************************
+def workerCommand(file, output, options):
+    return [
+        options.blender, "-b", "--factory-startup", "--python-exit-code", "1", "--python", SCRIPT, "--",
+        "--worker", file, output,
+        "--format", options.format,
+        "--stone-lib", options.stoneLib,
+        "--material-lib", options.materialLib,
+        "--import-mode", options.importMode,
+        "--magnification", options.magnification,
+    ] + (["--share-meshes"] if options.shareMeshes else [])
+
+# **************************************************************************************
+def runWorker(file, output, options):
+    # Returns (ok, message, seconds) of converting a single file in its own Blender
+    start = time.perf_counter()
+    if os.path.exists(output):
+        os.remove(output)
+    try:
+        result = subprocess.run(workerCommand(file, output, options), capture_output=True, text=True, timeout=options.timeout)
+    except subprocess.TimeoutExpired:
+        return False, "timed out after {0}s".format(options.timeout), time.perf_counter() - start
+    seconds = time.perf_counter() - start
+    if result.returncode == 0 and os.path.isfile(output):
+        return True, "", seconds
+    lines = [l for l in (result.stderr or result.stdout).splitlines() if l.strip()]
+    return False, lines[-1] if lines else "exit code {0}".format(result.returncode), seconds
+
+# **************************************************************************************
+def findFiles(inputDirectory, recursive=False):
+    pattern = os.path.join(inputDirectory, "**", "*.asq") if recursive else os.path.join(inputDirectory, "*.asq")
+    return sorted(glob.glob(pattern, recursive=recursive))
+
+# **************************************************************************************
+def convertFolder(inputDirectory, outputDirectory, options, verbose=True):
+    # Converts all files with options.workers Blender processes, returns (converted, failed, seconds)
+    files = findFiles(inputDirectory, options.recursive)
+    jobs = {}
+    for file in files:
+        relative = os.path.relpath(os.path.splitext(file)[0], inputDirectory)
+        jobs[file] = os.path.join(outputDirectory, "{0}.{1}".format(relative, options.format))
+        os.makedirs(os.path.dirname(jobs[file]), exist_ok=True)
+    converted, failed = [], []
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as pool:
+        futures = {pool.submit(runWorker, file, output, options): file for file, output in jobs.items()}
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            file = futures[future]
+            ok, message, seconds = future.result()
+            (converted if ok else failed).append((file, message))
+            if verbose:
+                print("[{0}/{1}] {2:<6} {3} {4:.1f}s {5}".format(i, len(jobs), "ok" if ok else "FAILED", file, seconds, message))
+    return converted, failed, time.perf_counter() - start
+
+# **************************************************************************************
+def printSummary(converted, failed, seconds):
+    total = len(converted) + len(failed)
+    print("Converted {0} of {1} files in {2:.1f}s ({3:.1f} files per minute)".format(
+        len(converted), total, seconds, len(converted) / seconds * 60 if seconds else 0))
+    if failed:
+        print("Failed:")
+        for file, message in failed:
+            print("  {0}: {1}".format(file, message))
+
+# **************************************************************************************
+def addOptions(parser):
+    parser.add_argument("--format", choices=["blend", "glb"], default="blend")
+    parser.add_argument("--stone-lib", dest="stoneLib", choices=["realistic", "instruction"], default="realistic")
+    parser.add_argument("--material-lib", dest="materialLib", choices=["noise", "instruction", "realistic", "texture"], default="realistic")
+    parser.add_argument("--import-mode", dest="importMode", choices=["objects", "instances", "merged"], default="objects")
+    parser.add_argument("--magnification", choices=["1", "50"], default="50")
+    parser.add_argument("--share-meshes", dest="shareMeshes", action="store_true")
+
+# **************************************************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(prog="convert.py", description="Convert a folder of .asq files")
+    parser.add_argument("input", help="Folder with .asq files (a single file with --worker)")
+    parser.add_argument("output", help="Folder for the converted files (a single file with --worker)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--blender", default=blenderBinary())
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    addOptions(parser)
+    options = parser.parse_args(argv)
+
+    if options.worker:
+        convertFile(options.input, options.output, options)
+        return 0
+    converted, failed, seconds = convertFolder(options.input, options.output, options)
+    printSummary(converted, failed, seconds)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
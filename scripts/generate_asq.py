@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ synthetic building generator
+
+Writes .asq files of any size for testing and benchmarking the importer. The
+schema is copied from a real .asq file (the example by default), the stones are
+stacked layer by layer on the 12.5 mm grid of the real buildings:
+
+    python scripts/generate_asq.py big.asq --stones 100000 --layers 200
+    python scripts/generate_asq.py mix.asq --stones 5000 --shapes GKNF1 GKNF4 GKNF19 --materials r g b
+    python scripts/generate_asq.py town.asq --stones 20000 --buildings 4
+
+With --buildings the stones are split into several buildings standing side by
+side in the same file. The shape mix is taken from the template file, with its frequencies, unless
+--shapes is given. Inside Blender --library uses every stone of the stone
+library instead:
+
+    blender -b --python scripts/generate_asq.py -- all.asq --stones 20000 --library
+"""
+
+import os
+import sys
+import math
+import random
+import sqlite3
+import argparse
+import datetime
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+EXAMPLE = os.path.join(ADDON_DIRECTORY, "examples", "GKAF11_17_Kirche_(Richter).asq")
+
+# Colors of the material key codes found in real files, others are grey
+MATERIAL_COLORS = {
+    "r": (0.8117647058823529, 0.3686274509803922, 0.29411764705882354),
+    "g": (0.9725490196078431, 0.8901960784313725, 0.6784313725490196),
+    "b": (0.5607843137254902, 0.5725490196078431, 0.6627450980392157),
+}
+
+# Rotations (x, y, z, w) around the vertical axis, as the stones of real buildings mostly have
+ROTATIONS = [
+    (0.0, 0.0, 0.0, 1.0),
+    (0.0, math.sqrt(0.5), 0.0, math.sqrt(0.5)),
+    (0.0, 1.0, 0.0, 0.0),
+    (0.0, -math.sqrt(0.5), 0.0, math.sqrt(0.5)),
+]
+
+GRID = 12.5         # mm between stone positions
+LAYER_HEIGHT = 25.0 # mm between layers
+
+# **************************************************************************************
+def templateSchema(template):
+    # CREATE statements of all tables and indexes of the template file
+    with sqlite3.connect(template) as conn:
+        rows = conn.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type DESC, rowid").fetchall()
+    return [sql for sql, in rows]
+
+# **************************************************************************************
+def templateShapeMix(template):
+    # Shape ids of the template building with how often they are used
+    with sqlite3.connect(template) as conn:
+        return conn.execute("SELECT ShapeId, COUNT(*) FROM BuildingShapePlacement GROUP BY ShapeId ORDER BY ShapeId").fetchall()
+
+# **************************************************************************************
+def libraryShapeMix(stoneLib="realistic"):
+    # Every stone of the stone library, needs Blender
+    import bpy
+    path = os.path.join(ADDON_DIRECTORY, "lib", "anker_library.blend")
+    suffix = "_" + stoneLib
+    with bpy.data.libraries.load(path) as (data_from, data_to):
+        names = [n[:-len(suffix)] for n in data_from.objects if n.endswith(suffix)]
+    return [(name, 1) for name in sorted(names)]
+
+# **************************************************************************************
+def placements(stones, layers, shapeMix, materialCount, seed=0):
+    # Yields (id, shapeId, x, y, z, rotation, materialId, layerId) rows, filling every layer with a square of stones
+    rnd = random.Random(seed)
+    shapes = [shape for shape, _ in shapeMix]
+    weights = [weight for _, weight in shapeMix]
+    perLayer = math.ceil(stones / layers)
+    side = math.ceil(math.sqrt(perLayer))
+    for i in range(stones):
+        layer, cell = divmod(i, perLayer)
+        row, column = divmod(cell, side)
+        yield (
+            i + 1,
+            rnd.choices(shapes, weights)[0],
+            GRID / 2 + column * GRID * 2,
+            GRID / 2 + layer * LAYER_HEIGHT,
+            GRID / 2 + row * GRID * 2,
+            rnd.choice(ROTATIONS),
+            rnd.randrange(materialCount) + 1,
+            layer + 1,
+        )
+
+# **************************************************************************************
+def generateAsq(path, stones, layers=None, shapeMix=None, materials=("r", "g", "b"), seed=0, template=EXAMPLE, name=None, buildings=1):
+    # Writes buildings with the given number of stones in total to path, returns the number of layers of each
+    buildings = max(1, min(buildings, stones))
+    perBuilding = stones // buildings
+    layers = max(1, min(layers or max(1, round(perBuilding ** (1 / 3))), perBuilding))
+    shapeMix = shapeMix or templateShapeMix(template)
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        for sql in templateSchema(template):
+            conn.execute(sql)
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        shift = 0.0
+        for b in range(buildings):
+            # Every building has its own ids, materials and layers and stands next to the one before
+            count = perBuilding + (stones % buildings if b == buildings - 1 else 0)
+            buildingId, first = b + 1, b * perBuilding
+            materialIds = [b * len(materials) + i + 1 for i in range(len(materials))]
+            conn.executemany("INSERT INTO Material VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                [(materialId, buildingId, keyCode, *MATERIAL_COLORS.get(keyCode, (0.5, 0.5, 0.5))) for materialId, keyCode in zip(materialIds, materials)])
+            conn.executemany("INSERT INTO Layer VALUES (?, ?, 0, ?, 2)",
+                [(b * layers + i + 1, buildingId, (i + 1) * LAYER_HEIGHT) for i in range(layers)])
+            rows = [(first + i, shapeId, x + shift, y, z, rotation, materialIds[materialId - 1], b * layers + layerId)
+                    for i, shapeId, x, y, z, rotation, materialId, layerId in placements(count, layers, shapeMix, len(materials), seed + b)]
+            conn.executemany("INSERT INTO BuildingShapePlacement VALUES (?, ?, ?, 20001, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                [(i, buildingId, shapeId, x, y, z, *rotation, materialId) for i, shapeId, x, y, z, rotation, materialId, _ in rows])
+            conn.executemany("INSERT INTO LayerShapePlacement VALUES (?, ?, ?, 0, 0, ?, ?, ?, ?, ?, ?, ?, 0)",
+                [(i, layerId, i, x, y, z, *rotation) for i, _, x, y, z, rotation, _, layerId in rows])
+            extent = [max(r[k] for r in rows) + GRID / 2 - (shift if k == 2 else 0) if rows else 0 for k in (2, 3, 4)]
+            buildingName = name if buildings == 1 else "{0} {1}".format(name, buildingId)
+            conn.execute("INSERT INTO BuildingParameters VALUES (?, ?, '2.2.3', '2.4', ?, ?, 'GK', ?, ?, ?, 'generate_asq', '', '', ?, ?, ?)",
+                (buildingId, buildingId, now, now, buildingName, buildingName, buildingName, round(extent[0]), round(extent[1]), round(extent[2])))
+            conn.execute("INSERT INTO BuildingsStoneSet VALUES (?, 'generated', 1)", (buildingId,))
+            shift += extent[0] + GRID * 8
+        conn.commit()
+    finally:
+        conn.close()
+    return layers
+
+# **************************************************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(prog="generate_asq.py", description="Write a synthetic .asq building")
+    parser.add_argument("output", help="The .asq file to write")
+    parser.add_argument("--stones", type=int, default=10000)
+    parser.add_argument("--layers", type=int, default=None, help="Default is the cube root of the stone count")
+    parser.add_argument("--shapes", nargs="+", default=None, help="Shape ids, used equally often")
+    parser.add_argument("--library", action="store_true", help="Use every stone of the stone library (Blender only)")
+    parser.add_argument("--stone-lib", dest="stoneLib", choices=["realistic", "instruction"], default="realistic")
+    parser.add_argument("--materials", nargs="+", default=["r", "g", "b"], help="Material key codes")
+    parser.add_argument("--buildings", type=int, default=1, help="Split the stones into this many buildings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--template", default=EXAMPLE, help="Real .asq file to copy the schema and shape mix from")
+    options = parser.parse_args(argv)
+
+    shapeMix = None
+    if options.shapes:
+        shapeMix = [(shape, 1) for shape in options.shapes]
+    elif options.library:
+        shapeMix = libraryShapeMix(options.stoneLib)
+    layers = generateAsq(options.output, options.stones, options.layers, shapeMix, options.materials, options.seed, options.template,
+        buildings=options.buildings)
+    print("Wrote {0} stones in {1} layers to {2}".format(options.stones, layers, options.output))
+    return 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
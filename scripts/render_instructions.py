@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Import ASQ instruction renderer
+
+Renders every cumulative layer step of an imported building, step n shows
+all layers up to the n-th one. The steps are split across several background
+Blender processes that all open the same saved scene:
+
+    blender -b --python scripts/render_instructions.py -- building.blend steps/ --workers 4
+
+The input can also be an .asq file, it's imported with camera, lighting and the
+instruction render preset into a .blend in the output folder first. Worker i of
+n renders the steps i, i+n, i+2n, ... and is started as
+
+    blender -b scene.blend --python-exit-code 1 --python scripts/render_instructions.py -- --worker scene.blend steps/ --index i --count n
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+import subprocess
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import convert
+
+SCRIPT = os.path.realpath(__file__)
+
+# **************************************************************************************
+def importUtils():
+    sys.path.insert(0, os.path.dirname(convert.ADDON_DIRECTORY))
+    return importlib.import_module(os.path.basename(convert.ADDON_DIRECTORY) + ".operators.utils")
+
+# **************************************************************************************
+def prepareScene(file, output, options):
+    # Worker side, imports an .asq with camera and instruction settings and saves it
+    import bpy
+    loadasq = convert.importLoadasq()
+    bpy.ops.wm.read_homefile(use_empty=True)
+    loadasq.Options.stoneLib = options.stoneLib
+    loadasq.Options.materialLib = options.materialLib
+    loadasq.Options.importMode = options.importMode
+    loadasq.Options.link = True
+    loadasq.Options.clearScene = False
+    loadasq.Options.setupCam = True
+    loadasq.Options.setupRendering = True
+    loadasq.Options.setupLighting = True
+    loadasq.Options.preset = options.preset
+    if loadasq.loadFromFile(bpy.context, file) is None:
+        raise RuntimeError("Nothing imported from {0}".format(file))
+    bpy.ops.wm.save_as_mainfile(filepath=output)
+
+# **************************************************************************************
+def stepPath(outputDirectory, step, layer):
+    return os.path.join(outputDirectory, "step_{0:03d}_layer_{1}.png".format(step, layer))
+
+# **************************************************************************************
+def renderSteps(outputDirectory, index, count):
+    # Worker side, renders its share of the steps of the opened scene
+    import bpy
+    utils = importUtils()
+    context = bpy.context
+    scene = context.scene
+    if scene.camera is None:
+        raise RuntimeError("The scene has no camera")
+    layers = utils.building_layers(context)
+    if not layers:
+        raise RuntimeError("The scene has no imported building")
+    scene.render.image_settings.file_format = 'PNG'
+    for step in range(index, len(layers), count):
+        utils.show_layers(context, utils.LAYER_FIRST, layers[step])
+        scene.render.filepath = stepPath(outputDirectory, step + 1, layers[step])
+        bpy.ops.render.render(write_still=True)
+    print("Rendered {0} of {1} steps".format(len(range(index, len(layers), count)), len(layers)))
+
+# **************************************************************************************
+def workerCommand(scene, outputDirectory, index, options):
+    return [
+        options.blender, "-b", scene, "--python-exit-code", "1", "--python", SCRIPT, "--",
+        "--worker", scene, outputDirectory, "--index", str(index), "--count", str(options.workers),
+    ]
+
+# **************************************************************************************
+def runWorker(scene, outputDirectory, index, options):
+    # Returns (ok, message) of a single render process
+    try:
+        result = subprocess.run(workerCommand(scene, outputDirectory, index, options), capture_output=True, text=True, timeout=options.timeout)
+    except subprocess.TimeoutExpired:
+        return False, "timed out after {0}s".format(options.timeout)
+    if result.returncode == 0:
+        return True, ""
+    lines = [l for l in (result.stderr or result.stdout).splitlines() if l.strip()]
+    return False, lines[-1] if lines else "exit code {0}".format(result.returncode)
+
+# **************************************************************************************
+def sceneFile(file, outputDirectory, options):
+    # The saved scene shared by all workers, imported first for an .asq input
+    if not file.lower().endswith(".asq"):
+        return os.path.abspath(file)
+    scene = os.path.join(os.path.abspath(outputDirectory), os.path.splitext(os.path.basename(file))[0] + ".blend")
+    command = [
+        options.blender, "-b", "--factory-startup", "--python-exit-code", "1", "--python", SCRIPT, "--",
+        "--prepare", file, scene,
+        "--stone-lib", options.stoneLib, "--material-lib", options.materialLib,
+        "--import-mode", options.importMode, "--preset", options.preset,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=options.timeout)
+    if result.returncode != 0 or not os.path.isfile(scene):
+        lines = [l for l in (result.stderr or result.stdout).splitlines() if l.strip()]
+        raise RuntimeError("Importing {0} failed: {1}".format(file, lines[-1] if lines else result.returncode))
+    return scene
+
+# **************************************************************************************
+def renderInstructions(scene, outputDirectory, options):
+    # Renders all steps with options.workers Blender processes, returns (failed, seconds)
+    os.makedirs(outputDirectory, exist_ok=True)
+    failed = []
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as pool:
+        futures = {pool.submit(runWorker, scene, outputDirectory, index, options): index for index in range(options.workers)}
+        for future in concurrent.futures.as_completed(futures):
+            ok, message = future.result()
+            if not ok:
+                failed.append((futures[future], message))
+    return failed, time.perf_counter() - start
+
+# **************************************************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(prog="render_instructions.py", description="Render the layer steps of a building")
+    parser.add_argument("input", help="Saved scene with an imported building or an .asq file")
+    parser.add_argument("output", help="Folder for the step images")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--blender", default=convert.blenderBinary())
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--preset", choices=["REALISTIC_EEVEE", "REALISTIC_CYCLES", "INSTRUCTIONS_EEVEE"], default="INSTRUCTIONS_EEVEE")
+    parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--prepare", action="store_true", help=argparse.SUPPRESS)
+    convert.addOptions(parser)
+    parser.set_defaults(stoneLib="instruction", materialLib="instruction")
+    options = parser.parse_args(argv)
+
+    if options.prepare:
+        prepareScene(options.input, options.output, options)
+        return 0
+    if options.worker:
+        renderSteps(options.output, options.index, options.count)
+        return 0
+    scene = sceneFile(options.input, options.output, options)
+    failed, seconds = renderInstructions(scene, options.output, options)
+    steps = len([f for f in os.listdir(options.output) if f.startswith("step_") and f.endswith(".png")])
+    print("Rendered {0} steps with {1} processes in {2:.1f}s".format(steps, options.workers, seconds))
+    for index, message in failed:
+        print("  worker {0} failed: {1}".format(index, message))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
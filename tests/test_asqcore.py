@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parts of the importer that don't need Blender: reading and
+converting the placements of .asq files and the catalog built on them.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import math
+import random
+import sqlite3
+
+import numpy
+import pytest
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ADDON_DIRECTORY)
+sys.path.insert(0, os.path.join(ADDON_DIRECTORY, "scripts"))
+
+from loadasq import asqcore, catalog
+import generate_asq
+
+EXAMPLE = os.path.join(ADDON_DIRECTORY, "examples", "GKAF11_17_Kirche_(Richter).asq")
+
+# **************************************************************************************
+def referenceConversion(stone):
+    # Location and XYZ euler of one stone the way the importer did it with mathutils:
+    # the quaternion rotated by 90 degrees around X, then converted to euler
+    w1, x1, y1, z1 = math.cos(math.pi / 4), math.sin(math.pi / 4), 0.0, 0.0
+    w2, x2, y2, z2 = stone.rw, stone.rx, stone.ry, stone.rz
+    w = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    x = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    y = w1*y2 - x1*z2 + y1*w2 + z1*x2
+    z = w1*z2 + x1*y2 - y1*x2 + z1*w2
+    m20 = 2 * (x*z - w*y)
+    euler = (math.atan2(2 * (y*z + w*x), 1 - 2 * (x*x + y*y)),
+             math.asin(max(-1.0, min(1.0, -m20))),
+             math.atan2(2 * (x*y + w*z), 1 - 2 * (y*y + z*z)))
+    location = (stone.x / 1000, stone.z / -1000, stone.y / 1000)
+    return location, euler
+
+# **************************************************************************************
+def eulerMatrix(euler):
+    x, y, z = euler
+    rx = numpy.array(((1, 0, 0), (0, math.cos(x), -math.sin(x)), (0, math.sin(x), math.cos(x))))
+    ry = numpy.array(((math.cos(y), 0, math.sin(y)), (0, 1, 0), (-math.sin(y), 0, math.cos(y))))
+    rz = numpy.array(((math.cos(z), -math.sin(z), 0), (math.sin(z), math.cos(z), 0), (0, 0, 1)))
+    return rz @ ry @ rx
+
+# **************************************************************************************
+def randomStones(count, seed=0):
+    rnd = random.Random(seed)
+    stones = []
+    for i in range(count):
+        q = numpy.array([rnd.gauss(0, 1) for _ in range(4)])
+        q /= numpy.linalg.norm(q)
+        stones.append(asqcore.AsqStone("GKNF1", *(rnd.uniform(-5000, 5000) for _ in range(3)), *q, "r", 0, i, 1))
+    # Identity and the gimbal lock of the XYZ euler
+    stones.append(asqcore.AsqStone("GKNF1", 0, 0, 0, 1, 0, 0, 0, "r", 0, count, 1))
+    stones.append(asqcore.AsqStone("GKNF1", 0, 0, 0, math.cos(math.pi / 4), 0, 0, math.sin(math.pi / 4), "r", 0, count + 1, 1))
+    return stones
+
+# **************************************************************************************
+@pytest.fixture
+def town(tmp_path):
+    # Three generated buildings and a loose stone outside of any building (BuildingId 0)
+    path = str(tmp_path / "town.asq")
+    generate_asq.generateAsq(path, 300, buildings=3, seed=1)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO BuildingShapePlacement VALUES (100000, 0, 'GKNF1', 20001, 0, 0, 0, 0, 0, 0, 1, 1, 0)")
+    conn.commit()
+    conn.close()
+    return path
+
+# **************************************************************************************
+def test_asqToBlenderArrays_matches_reference():
+    stones = randomStones(200)
+    placements = asqcore.asqToBlenderArrays(stones, digits=6)
+    for i, stone in enumerate(stones):
+        location, euler = referenceConversion(stone)
+        assert placements.location[i] == pytest.approx(location, abs=1e-6)
+        # Eulers may wrap around at +-pi, their rotations have to be the same
+        assert numpy.allclose(eulerMatrix(placements.rotation[i]), eulerMatrix(euler), atol=1e-9)
+        assert numpy.allclose(placements.matrix[i], eulerMatrix(euler), atol=1e-9)
+
+# **************************************************************************************
+def test_loadBricksFromAsq_batches(town):
+    batches = list(asqcore.loadBricksFromAsq(town, batchSize=64))
+    assert all(len(batch) == 64 for batch in batches[:-1])
+    assert 0 < len(batches[-1]) <= 64
+    rows = [stone for batch in batches for stone in batch]
+    assert rows == next(asqcore.loadBricksFromAsq(town, batchSize=100000))
+    assert len(rows) == 300
+    # Ordered by building, the loose stone is never read
+    buildings = [stone.building for stone in rows]
+    assert buildings == sorted(buildings)
+    assert set(buildings) == {1, 2, 3}
+
+# **************************************************************************************
+def test_loadBricksFromAsq_selected_buildings(town):
+    rows = [stone for batch in asqcore.loadBricksFromAsq(town, buildingIds=[2]) for stone in batch]
+    assert len(rows) == 100
+    assert {stone.building for stone in rows} == {2}
+    shapeIds, _ = asqcore.loadRequirementsFromAsq(town, buildingIds=[2])
+    assert shapeIds == {stone.shapeId for stone in rows}
+
+# **************************************************************************************
+def test_example_skips_loose_stones():
+    conn = sqlite3.connect(EXAMPLE)
+    loose = conn.execute("SELECT COUNT(*) FROM BuildingShapePlacement WHERE BuildingId = 0").fetchone()[0]
+    conn.close()
+    assert loose > 0
+    rows = [stone for batch in asqcore.loadBricksFromAsq(EXAMPLE, batchSize=10) for stone in batch]
+    assert rows and all(stone.building > 0 for stone in rows)
+
+# **************************************************************************************
+def test_splitBuildings(town):
+    placements = asqcore.collectPlacements(asqcore.asqToBlender(asqcore.loadBricksFromAsq(town, batchSize=64)))
+    tables = asqcore.splitBuildings(placements)
+    assert sorted(tables) == [1, 2, 3]
+    assert sum(len(table.placement) for table in tables.values()) == len(placements.placement)
+    for buildingId, table in tables.items():
+        assert len(table.placement) == 100
+        assert (table.building == buildingId).all()
+        assert len(table.shapeId) == len(table.location) == len(table.matrix) == len(table.layer)
+    placementIds = numpy.concatenate([table.placement for table in tables.values()])
+    assert sorted(placementIds.tolist()) == sorted(placements.placement.tolist())
+    # A single building is returned as it is
+    single = tables[2]
+    assert asqcore.splitBuildings(single)[2] is single
+
+# **************************************************************************************
+def test_catalog_buildableWith(town, tmp_path):
+    # A stone set holding exactly the stones of building 1, one set lacking one of them and a set of two lacking sets
+    conn = sqlite3.connect(town)
+    needed = conn.execute("""SELECT ShapeId, MaterialId, COUNT(*) FROM BuildingShapePlacement WHERE BuildingId = 1
+        GROUP BY ShapeId, MaterialId ORDER BY COUNT(*) DESC""").fetchall()
+    conn.executemany("INSERT INTO StoneSetShapeInventory VALUES ('exact', ?, ?, ?)", [(n, s, m) for s, m, n in needed])
+    lacking = [(n - 1 if i == 0 else n, s, m) for i, (s, m, n) in enumerate(needed)]
+    conn.executemany("INSERT INTO StoneSetShapeInventory VALUES ('lacking', ?, ?, ?)", lacking)
+    conn.execute("INSERT INTO StoneSetSetInventory VALUES ('double', 2, 'lacking')")
+    conn.commit()
+    conn.close()
+
+    index = catalog.openCatalog(str(tmp_path / "catalog.sqlite"))
+    assert catalog.scanDirectory(index, str(tmp_path)) == (1, 0, 0)
+    building1 = lambda rows: [(buildingId, missing) for _, buildingId, _, missing in rows if buildingId == 1]
+    assert building1(catalog.buildableWith(index, ["exact"])) == [(1, 0)]
+    assert building1(catalog.buildableWith(index, ["lacking"])) == []
+    assert building1(catalog.buildableWith(index, ["lacking"], tolerance=1)) == [(1, 1)]
+    assert building1(catalog.buildableWith(index, ["double"])) == [(1, 0)]
+    assert building1(catalog.buildableWith(index, ["lacking", "lacking"])) == [(1, 0)]
+    # Without colors every material of a shape counts
+    assert building1(catalog.buildableWith(index, ["exact"], ignoreColors=True)) == [(1, 0)]
+    # Nothing changed, nothing is read again
+    assert catalog.scanDirectory(index, str(tmp_path)) == (0, 1, 0)
+    index.close()
+
+# **************************************************************************************
+def test_instanceShading_follows_instanceGeometry():
+    # A triangle with its loop normals and one sharp edge, copied twice and joined with a single copy
+    geometry = asqcore.MeshGeometry(numpy.array([(0, 0, 0), (1, 0, 0), (0, 1, 0)], dtype=float), numpy.array([0, 1, 2]),
+        numpy.array([0]), numpy.array([3]), numpy.array([True]), numpy.zeros((3, 2)))
+    shading = asqcore.MeshShading(numpy.array([(0, 0, 1), (0, 0, 1), (1, 0, 0)], dtype=float), numpy.array([(0, 1)]), numpy.zeros((0, 2), dtype=int))
+    matrices = numpy.array([eulerMatrix((math.pi / 2, 0, 0)) * 2, numpy.diag((1.0, 1.0, 3.0))])
+    part = asqcore.instanceShading(shading, len(geometry.co), matrices)
+    assert numpy.allclose(part.normals, [(0, -1, 0), (0, -1, 0), (1, 0, 0), (0, 0, 1), (0, 0, 1), (1, 0, 0)])
+    assert part.sharpEdges.tolist() == [[0, 1], [3, 4]]
+    joined = asqcore.joinShading([part, shading], [6, 3])
+    assert len(joined.normals) == 9
+    assert joined.sharpEdges.tolist() == [[0, 1], [3, 4], [6, 7]]
+    assert joined.freestyleEdges.shape == (0, 2)